@@ -0,0 +1,198 @@
+"""
+Closed-loop tuning of pipeline batch sizes and concurrency.
+
+Fixed batch sizes and worker counts are right for one account tier at one
+time of day. `Autotuner` instead watches every embedding and upsert request
+during a run - latency, throughput and whether it succeeded, was throttled
+(429) or failed - and adjusts each setting with AIMD control:
+
+    throttled requests (429)           multiplicative decrease of concurrency
+    failing requests (5xx, timeouts)   multiplicative decrease of concurrency and
+                                       batch size - undone if the failures do not
+                                       drop, as they are then not caused by load
+    seconds per item far above the     multiplicative decrease of concurrency
+    best seen (queueing somewhere)
+    throughput fell after an increase  the increase is undone and held for a while
+    otherwise                          additive increase, alternating between
+                                       concurrency and batch size
+
+Observations may come from any thread; `step()` is called periodically by the
+pipeline, which applies the returned changes. Every decision is logged, and
+the final values are written to a JSON state file so the next run starts from
+them instead of from the constants.
+"""
+
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MIN_SAMPLES = 4  # Requests per group before a window is judged
+MAX_ERROR_RATE = 0.05  # Share of throttled or failed requests that triggers a decrease
+FAILURE_IMPROVEMENT = 0.5  # A decrease for failures is undone unless it at least halves them
+MAX_FAILURE_TOLERANCE = 0.5  # Highest background failure rate that is put up with
+DECREASE_FACTOR = 0.5
+LATENCY_DECREASE_FACTOR = 0.75
+LATENCY_SLACK = 2.5  # Seconds per item this many times the best window's means requests are queueing
+THROUGHPUT_DROP = 0.9  # An increase followed by less than this share of the previous throughput is undone
+HOLD_WINDOWS = 5  # Windows an undone setting is left alone
+
+
+class Setting:
+    """One tuned value with its bounds and additive step."""
+
+    def __init__(self, name: str, value: int, minimum: int, maximum: int, step: int):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.value = self.clamp(value)
+        self.held = 0  # Windows left before this setting may be increased again
+
+    def clamp(self, value: float) -> int:
+        return int(min(self.maximum, max(self.minimum, value)))
+
+
+class _Group:
+    """The concurrency and batch size settings driven by one kind of request (e.g. "embed")."""
+
+    def __init__(self, concurrency: Setting, batch: Setting):
+        self.concurrency = concurrency
+        self.batch = batch
+        self.samples = []  # (seconds, items, outcome)
+        self.window_start = time.monotonic()
+        self.best_seconds_per_item = None
+        self.last_throughput = None
+        self.last_increase = None  # (setting, previous value) of the last window's increase
+        self.last_decrease = None  # ([(setting, previous value)], failure rate) of the last window's decrease for failures
+        self.failure_tolerance = MAX_ERROR_RATE  # Raised when failures turn out to be independent of load
+        self.increase_batch_next = False
+
+
+class Autotuner:
+    """Thread-safe AIMD controller for the pipeline's batch sizes and concurrency."""
+
+    def __init__(self, settings: dict[str, dict], groups: dict[str, tuple[str, str]], state_path: str | None = None,
+                 interval: float = 5.0):
+        """
+        `settings` maps a setting name to {value, min, max, step}; `groups` maps
+        a request kind to the names of its (concurrency, batch size) settings.
+        Values saved in `state_path` by an earlier run replace the given ones.
+        """
+        self.state_path = state_path
+        self.interval = interval
+        saved = self._load()
+        self.settings = {
+            name: Setting(name, saved.get(name, spec['value']), spec['min'], spec['max'], spec['step'])
+            for name, spec in settings.items()
+        }
+        if saved:
+            logger.info(f"Autotune: starting from saved settings {self.values()}")
+        self._groups = {
+            kind: _Group(self.settings[concurrency], self.settings[batch])
+            for kind, (concurrency, batch) in groups.items()
+        }
+        self._lock = threading.Lock()
+        self.decisions = 0
+
+    def values(self) -> dict[str, int]:
+        return {name: setting.value for name, setting in self.settings.items()}
+
+    def observe(self, kind: str, seconds: float, items: int, outcome: str = "ok"):
+        """Record one request of `kind`: its latency, how many items it carried, and "ok", "throttled" or "error"."""
+        with self._lock:
+            self._groups[kind].samples.append((seconds, max(items, 1), outcome))
+
+    def step(self) -> dict[str, int]:
+        """Judge the window since the last step for every group. Returns the settings that changed."""
+        changes = {}
+        now = time.monotonic()
+        with self._lock:
+            for kind, group in self._groups.items():
+                if len(group.samples) < MIN_SAMPLES:
+                    continue
+                samples, group.samples = group.samples, []
+                elapsed, group.window_start = now - group.window_start, now
+                for setting, value, reason in self._decide(group, samples, elapsed):
+                    if value != setting.value:
+                        logger.info(f"Autotune {kind}: {setting.name} {setting.value} -> {value} ({reason})")
+                        setting.value = value
+                        changes[setting.name] = value
+                        self.decisions += 1
+        return changes
+
+    def _decide(self, group: _Group, samples: list, elapsed: float) -> list[tuple[Setting, int, str]]:
+        concurrency, batch = group.concurrency, group.batch
+        for setting in (concurrency, batch):
+            setting.held = max(0, setting.held - 1)
+        throttled = sum(1 for _, _, outcome in samples if outcome == "throttled")
+        failed = sum(1 for _, _, outcome in samples if outcome == "error")
+        ok = [(seconds, items) for seconds, items, outcome in samples if outcome == "ok"]
+        throughput = sum(items for _, items in ok) / max(elapsed, 1e-6)
+        seconds_per_item = statistics.median(seconds / items for seconds, items in ok) if ok else None
+        last_increase, group.last_increase = group.last_increase, None
+        last_decrease, group.last_decrease = group.last_decrease, None
+        last_throughput, group.last_throughput = group.last_throughput, throughput
+
+        throttle_rate, failure_rate = throttled / len(samples), failed / len(samples)
+        if last_decrease is not None and failure_rate > FAILURE_IMPROVEMENT * last_decrease[1]:
+            # Smaller and fewer requests fail just as often, so load is not the cause: go back and tolerate them
+            group.failure_tolerance = min(MAX_FAILURE_TOLERANCE, failure_rate * 1.5)
+            return [(setting, previous, f"failures stayed at {failure_rate:.0%}, tolerating up to "
+                                        f"{group.failure_tolerance:.0%}") for setting, previous in last_decrease[0]]
+        if throttle_rate > MAX_ERROR_RATE or failure_rate > group.failure_tolerance:
+            reason = f"{throttled} throttled, {failed} failed of {len(samples)}"
+            decisions = [(concurrency, concurrency.clamp(concurrency.value * DECREASE_FACTOR), reason)]
+            if failure_rate > group.failure_tolerance:  # Timeouts and 5xx get worse with bigger requests; 429s do not
+                decisions.append((batch, batch.clamp(batch.value * DECREASE_FACTOR), reason))
+                if throttle_rate <= MAX_ERROR_RATE:
+                    group.last_decrease = ([(concurrency, concurrency.value), (batch, batch.value)], failure_rate)
+            return decisions
+
+        if seconds_per_item is not None:
+            best = group.best_seconds_per_item
+            group.best_seconds_per_item = seconds_per_item if best is None else min(best, seconds_per_item)
+            if best is not None and seconds_per_item > LATENCY_SLACK * best:
+                return [(concurrency, concurrency.clamp(concurrency.value * LATENCY_DECREASE_FACTOR),
+                         f"{seconds_per_item * 1000:.1f}ms per item vs best {best * 1000:.1f}ms")]
+
+        if last_increase is not None and last_throughput and throughput < THROUGHPUT_DROP * last_throughput:
+            setting, previous = last_increase
+            setting.held = HOLD_WINDOWS
+            return [(setting, previous, f"throughput {last_throughput:.1f} -> {throughput:.1f} items/s")]
+
+        # Additive increase, one setting per window so its effect can be judged
+        candidates = [batch, concurrency] if group.increase_batch_next else [concurrency, batch]
+        group.increase_batch_next = not group.increase_batch_next
+        for setting in candidates:
+            if setting.held or setting.value >= setting.maximum:
+                continue
+            group.last_increase = (setting, setting.value)
+            return [(setting, setting.clamp(setting.value + setting.step), "healthy")]
+        return []
+
+    # --- Persisted state ---
+
+    def _load(self) -> dict:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path) as f:
+                return json.load(f).get("settings", {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable autotune state {self.state_path}: {e}")
+            return {}
+
+    def save(self):
+        """Keep the current values for the next run."""
+        if not self.state_path:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        temporary_path = f"{self.state_path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"settings": self.values(), "saved_at": time.time()}, f, indent=2)
+        os.replace(temporary_path, self.state_path)
@@ -0,0 +1,308 @@
+"""
+Bulk embedding through the OpenAI Batch API, for large backfills.
+
+Synchronous embedding requests are capped by the requests/tokens-per-minute
+quota and billed at full price. The Batch API has its own, much larger queue
+quota and costs half as much, at the price of latency (results arrive within
+the completion window, usually well under it).
+
+`BatchEmbedder` packs chunk texts into embedding requests by token budget
+(like the pipeline does), writes them as JSON-lines request files of at most
+`max_inputs_per_batch` inputs, uploads each file and creates a batch job for
+it. `wait()` polls the jobs and streams every finished job's output file into
+the embedding cache, so the normal pipeline run that follows finds every
+embedding there and goes straight to upserting.
+
+Progress is checkpointed in SQLite (`batch_jobs.sqlite3`): a request file is
+recorded together with the cache keys of its requests before it is uploaded,
+and its upload and batch IDs as soon as they exist. A restarted run resumes
+uploading, submitting and polling where the last one stopped, and never
+resubmits chunks that are already in an unfinished job.
+"""
+
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import backoff
+import numpy as np
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from embedding_cache import EmbeddingCache, cache_key, embedding_space
+from token_batcher import TokenBatcher
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+MAX_INPUTS_PER_BATCH = 50_000  # Batch API limit for /v1/embeddings, across all requests in a batch
+MAX_FILE_BYTES = 190 * 1024 * 1024  # Batch input files may be at most 200MB
+RESULT_WRITE_BATCH = 200  # Result lines buffered per embedding cache write
+
+
+def _decode_embedding(embedding) -> np.ndarray:
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype="<f4")
+    return np.asarray(embedding, dtype=np.float32)  # Jobs submitted before base64 was requested
+
+
+class BatchEmbedder:
+    """Writes, submits and collects embedding batch jobs. Driven from a single thread."""
+
+    def __init__(
+        self,
+        client,
+        model: str,
+        cache: EmbeddingCache,
+        directory: str,
+        request_token_budget: int,
+        request_max_inputs: int,
+        max_inputs_per_batch: int = MAX_INPUTS_PER_BATCH,
+        poll_seconds: float = 30.0,
+        completion_window: str = "24h",
+        dimensions: int | None = None,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.space = embedding_space(model, dimensions)  # Cache keys are per model and output size
+        self.cache = cache
+        self.directory = directory
+        self.max_inputs_per_batch = max_inputs_per_batch
+        self.poll_seconds = poll_seconds
+        self.completion_window = completion_window
+        self._batcher = TokenBatcher(request_token_budget, request_max_inputs)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "batch_jobs.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                request_path TEXT NOT NULL,
+                inputs INTEGER NOT NULL,
+                input_file_id TEXT,
+                batch_id TEXT,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS requests (
+                custom_id TEXT PRIMARY KEY,
+                job_id INTEGER NOT NULL,
+                keys TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_requests_job ON requests(job_id);
+            """
+        )
+        self._conn.commit()
+        self._queued_keys = self._pending_keys()
+        self._remove_orphaned_files()
+        self._file = None
+
+    # --- Writing request files ---
+
+    def add(self, text: str, tokens: int) -> bool:
+        """Queue one chunk text for embedding. Returns False if it is already queued."""
+        key = cache_key(self.space, text)
+        if key in self._queued_keys:
+            return False
+        self._queued_keys.add(key)
+        batch = self._batcher.add((key, text), tokens)
+        if batch:
+            self._write_request(batch)
+        return True
+
+    def flush(self):
+        """Write out the partially filled request and submit the current file."""
+        batch = self._batcher.flush()
+        if batch:
+            self._write_request(batch)
+        if self._file is not None:
+            self._seal_file()
+
+    def _write_request(self, batch: list):
+        if self._file is not None and self._file['inputs'] + len(batch) > self.max_inputs_per_batch:
+            self._seal_file()
+        if self._file is None:
+            name = uuid.uuid4().hex[:12]
+            path = os.path.join(self.directory, f"requests_{name}.jsonl")
+            self._file = {'name': name, 'path': path, 'handle': open(path, "w"), 'inputs': 0, 'bytes': 0, 'requests': []}
+        custom_id = f"{self._file['name']}-{len(self._file['requests'])}"
+        # base64 output lines are about a quarter the size of JSON floats and decode without a float parse
+        body = {"model": self.model, "input": [text for _, text in batch], "encoding_format": "base64"}
+        if self.dimensions:
+            body["dimensions"] = self.dimensions
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/embeddings", "body": body}) + "\n"
+        self._file['handle'].write(line)
+        self._file['inputs'] += len(batch)
+        self._file['bytes'] += len(line.encode("utf-8"))
+        self._file['requests'].append((custom_id, [key for key, _ in batch]))
+        if self._file['bytes'] >= MAX_FILE_BYTES:
+            self._seal_file()
+
+    def _seal_file(self):
+        """Make the request file durable, record it with its keys, then submit it."""
+        current, self._file = self._file, None
+        current['handle'].flush()
+        os.fsync(current['handle'].fileno())
+        current['handle'].close()
+        with self._lock:
+            job_id = self._conn.execute(
+                "INSERT INTO jobs (request_path, inputs, status, created_at) VALUES (?, ?, 'written', ?)",
+                (current['path'], current['inputs'], time.time()),
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO requests (custom_id, job_id, keys) VALUES (?, ?, ?)",
+                [(custom_id, job_id, json.dumps(keys)) for custom_id, keys in current['requests']],
+            )
+            self._conn.commit()
+        logger.info(f"Wrote batch request file {os.path.basename(current['path'])}: "
+                    f"{len(current['requests'])} requests, {current['inputs']} inputs")
+        self._submit(self._job(job_id))
+
+    # --- Submitting and collecting ---
+
+    @backoff.on_exception(backoff.expo, RETRYABLE_ERRORS, max_tries=8)
+    def _submit(self, job: dict):
+        """Upload the job's request file and create its batch, resuming after whichever step last succeeded."""
+        job = self._job(job['id'])  # A retry must see the upload recorded by the failed attempt
+        if job['status'] == "written":
+            with open(job['request_path'], "rb") as f:
+                uploaded = self.client.files.create(file=f, purpose="batch")
+            job = self._update(job['id'], input_file_id=uploaded.id, status="uploaded")
+        if job['status'] == "uploaded":
+            batch = self.client.batches.create(
+                input_file_id=job['input_file_id'],
+                endpoint="/v1/embeddings",
+                completion_window=self.completion_window,
+            )
+            job = self._update(job['id'], batch_id=batch.id, status="submitted")
+            logger.info(f"Submitted batch {batch.id} ({job['inputs']} inputs)")
+        return job
+
+    @backoff.on_exception(backoff.expo, RETRYABLE_ERRORS, max_tries=8)
+    def _retrieve(self, batch_id: str):
+        return self.client.batches.retrieve(batch_id)
+
+    def wait(self) -> dict:
+        """
+        Submit anything not yet submitted, then poll until every job has
+        finished, storing results in the embedding cache as each one completes.
+        """
+        totals = {'jobs_completed': 0, 'jobs_failed': 0, 'embeddings_stored': 0, 'requests_failed': 0}
+        while True:
+            jobs = self._unfinished_jobs()
+            if not jobs:
+                return totals
+            in_progress = []
+            for job in jobs:
+                if job['status'] != "submitted":
+                    job = self._submit(job)
+                batch = self._retrieve(job['batch_id'])
+                if batch.status not in TERMINAL_STATUSES:
+                    counts = batch.request_counts
+                    in_progress.append(f"{batch.id} {batch.status}"
+                                       + (f" {counts.completed}/{counts.total}" if counts is not None else ""))
+                    continue
+                stored, failed = self._collect(job, batch)
+                totals['embeddings_stored'] += stored
+                totals['requests_failed'] += failed
+                totals['jobs_completed' if batch.status == "completed" else 'jobs_failed'] += 1
+            if in_progress:
+                logger.info(f"Waiting on {len(in_progress)} batch jobs: {', '.join(in_progress)}")
+                time.sleep(self.poll_seconds)
+
+    def _collect(self, job: dict, batch) -> tuple[int, int]:
+        """Stream a finished job's output into the cache and retire it. Returns (embeddings stored, requests failed)."""
+        with self._lock:
+            keys_by_request = {
+                custom_id: json.loads(keys)
+                for custom_id, keys in self._conn.execute("SELECT custom_id, keys FROM requests WHERE job_id = ?", (job['id'],))
+            }
+        stored = 0
+        failed = 0
+        # Expired or cancelled batches still return whatever completed before they stopped
+        if batch.output_file_id:
+            pending_keys, pending_embeddings = [], []
+            with self.client.files.with_streaming_response.content(batch.output_file_id) as response:
+                for line in response.iter_lines():
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    keys = keys_by_request.pop(result.get("custom_id"), None)
+                    response_body = (result.get("response") or {}).get("body") or {}
+                    if keys is None or (result.get("response") or {}).get("status_code") != 200:
+                        failed += 1
+                        continue
+                    data = sorted(response_body["data"], key=lambda item: item["index"])
+                    pending_keys.extend(keys)
+                    pending_embeddings.extend(_decode_embedding(item["embedding"]) for item in data)
+                    if len(pending_keys) >= RESULT_WRITE_BATCH:
+                        self.cache.put_keys(self.space, pending_keys, pending_embeddings)
+                        stored += len(pending_keys)
+                        pending_keys, pending_embeddings = [], []
+            if pending_keys:
+                self.cache.put_keys(self.space, pending_keys, pending_embeddings)
+                stored += len(pending_keys)
+        failed += len(keys_by_request)  # Requests with no output line failed or never ran
+
+        if failed:
+            logger.warning(f"Batch {batch.id} ended {batch.status} with {failed} failed requests; "
+                           f"their chunks will be embedded synchronously")
+        logger.info(f"Batch {batch.id} {batch.status}: stored {stored} embeddings")
+        with self._lock:
+            self._conn.execute("DELETE FROM requests WHERE job_id = ?", (job['id'],))
+            self._conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?",
+                               (batch.status, time.time(), job['id']))
+            self._conn.commit()
+        if os.path.exists(job['request_path']):
+            os.remove(job['request_path'])
+        return stored, failed
+
+    # --- Checkpoint state ---
+
+    def _job(self, job_id: int) -> dict:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            return dict(zip((column[0] for column in cursor.description), cursor.fetchone()))
+
+    def _update(self, job_id: int, **fields) -> dict:
+        with self._lock:
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+        return self._job(job_id)
+
+    def _unfinished_jobs(self) -> list[dict]:
+        with self._lock:
+            job_ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('written', 'uploaded', 'submitted') ORDER BY id")]
+        return [self._job(job_id) for job_id in job_ids]
+
+    def _pending_keys(self) -> set[str]:
+        """Cache keys already in an unfinished job, so a resumed run does not submit them again."""
+        keys = set()
+        with self._lock:
+            for (encoded,) in self._conn.execute("SELECT keys FROM requests"):
+                keys.update(json.loads(encoded))
+        return keys
+
+    def _remove_orphaned_files(self):
+        """Delete request files that were being written when a previous run stopped."""
+        with self._lock:
+            known = {path for (path,) in self._conn.execute("SELECT request_path FROM jobs")}
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            if file_name.startswith("requests_") and file_name.endswith(".jsonl") and path not in known:
+                os.remove(path)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,486 @@
+"""
+Reproducible Phase 2 benchmark.
+
+Generates synthetic filings into a scratch directory, starts the mock
+OpenAI/Pinecone server (`mock_api_server.py`) and runs
+`process_and_upsert_filings` against it in a fresh subprocess, so every run
+starts with cold caches and the reported peak RSS is the pipeline's own.
+Results are saved as JSON so runs can be compared:
+
+    python benchmark.py --files 40 --words-per-section 6000
+    python benchmark.py --set EMBEDDING_BATCH_SIZE=128 --compare bench_results/baseline.json
+    python benchmark.py --rpm 500 --error-rate-5xx 0.02
+    python benchmark.py --mode batch --batch-latency 5
+    python ingestion_e2e.py bench --files 40    # The same, through the pipeline's command line
+    LOCAL_EMBEDDING_MODEL=models/all-MiniLM-L6-v2 python benchmark.py --embedding-backend local
+
+With `--embedding-backend local` the pipeline embeds with a local CPU model
+(configured through the LOCAL_EMBEDDING_* environment variables, see
+ingestion_e2e.py) instead of the mock API, giving a local throughput baseline
+to compare API runs against.
+
+Startup cost is measured as well: `import_seconds` (importing the pipeline
+module), `startup_seconds` (creating its clients before the run) and
+`cli_startup_seconds` (a whole `ingestion_e2e.py status` process), so changes
+that make every command slower to start show up in comparisons.
+"""
+
+import argparse
+import ast
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from filing_store import FilingStore
+from mock_api_server import MockApiServer
+
+BENCH_RESULTS_DIR = os.path.join(os.path.dirname(__file__), "bench_results")
+
+# Settings read when Phase 2 starts, so they can be overridden per run with --set
+TUNABLES = (
+    "MAX_CONCURRENT_FILES",
+    "PARSE_PROCESSES",
+    "CHUNK_CONCURRENCY",
+    "EMBEDDING_CONCURRENCY",
+    "UPSERT_CONCURRENCY",
+    "PIPELINE_QUEUE_SIZE",
+    "EMBEDDING_BATCH_SIZE",
+    "EMBEDDING_BATCH_TOKEN_BUDGET",
+    "PINECONE_BATCH_SIZE",
+    "CHUNK_UNIT",
+    "CHUNK_SIZE",
+    "CHUNK_OVERLAP",
+    "BATCH_POLL_SECONDS",
+    "BATCH_ROUND_MAX_CHUNKS",
+    "PARSE_SPLIT_BYTES",
+    "SCHEDULE_LARGEST_FIRST",
+    "AUTOTUNE",
+    "AUTOTUNE_INTERVAL_SECONDS",
+    "PARTITION_SCHEME",
+)
+
+# Metrics compared by --compare, and whether higher is better
+COMPARED_METRICS = {
+    "chunks_per_second": True,
+    "vectors_per_second": True,
+    "embedding_latency_ms.p50": False,
+    "embedding_latency_ms.p99": False,
+    "upsert_latency_ms.p50": False,
+    "upsert_latency_ms.p99": False,
+    "peak_rss_mb": False,
+    "cpu_us_per_vector": False,
+    "embedding_requests": False,
+    "import_seconds": False,
+    "startup_seconds": False,
+    "cli_startup_seconds": False,
+}
+
+_VOCABULARY = (
+    "revenue margin customer product market competition regulation supply chain "
+    "liquidity capital expenditure operating income net loss fiscal year segment "
+    "growth demand pricing inventory cost risk uncertainty cybersecurity litigation "
+    "interest rate inflation currency exchange debt covenant acquisition integration "
+    "goodwill impairment tax jurisdiction employee retention technology platform "
+    "subscription license service agreement contract backlog forecast guidance "
+    "dividend share repurchase cash flow working capital reserve obligation"
+).split()
+SECTIONS = ("business", "risk_factors", "management_discussion")
+
+
+# --- Synthetic filings ---
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    sentences = []
+    count = 0
+    while count < words:
+        length = rng.randint(8, 30)
+        sentence = " ".join(rng.choice(_VOCABULARY) for _ in range(length))
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+        count += length
+    return " ".join(sentences)
+
+
+def _section(rng: random.Random, words: int) -> str:
+    paragraphs = []
+    count = 0
+    while count < words:
+        paragraphs.append(_paragraph(rng, rng.randint(60, 250)))
+        count += paragraphs[-1].count(" ") + 1
+    return "\n\n".join(paragraphs)
+
+
+def generate_filings(directory: str, files: int, words_per_section: int, boilerplate: float, seed: int = 0,
+                     large_files: int = 0, large_factor: int = 1):
+    """
+    Store `files` synthetic filings in a filing store at `directory`. A `boilerplate` share of
+    sections is copied, with the company name prepended, from a small shared
+    pool - like the risk-factor language filers repeat year after year - so the
+    near-duplicate path sees realistic traffic. The last `large_files` filings
+    (by name, so an in-order run reaches them last) get `large_factor` times
+    the words per section. Forms and filing years alternate (10-K/10-Q, 2022-2024)
+    so that partition schemes have something to split on.
+    """
+    store = FilingStore(directory)
+    rng = random.Random(seed)
+    shared_sections = {section: [_section(rng, words_per_section) for _ in range(3)] for section in SECTIONS}
+    for i in range(files):
+        company = f"Synthetic Corp {i}"
+        words = words_per_section * (large_factor if i >= files - large_files else 1)
+        sections = {}
+        for section in SECTIONS:
+            if rng.random() < boilerplate:
+                sections[section] = f"{company}.\n\n{rng.choice(shared_sections[section])}"
+            else:
+                sections[section] = _section(rng, words)
+        accession_number = f"0000000000-24-{i:06d}"
+        filing = {
+            "company": company,
+            "cik": 1_000_000 + i,
+            "form": ("10-K", "10-Q")[i % 2],
+            "filing_date": f"{2022 + i // 2 % 3}-03-01",
+            "accession_number": accession_number,
+            "sections": sections,
+        }
+        store.put(filing)
+    store.close()
+
+
+# --- Worker (runs inside the benchmark subprocess) ---
+
+def _timed(fn, samples: list):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            samples.append((time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_worker(config_path: str, result_path: str):
+    with open(config_path) as f:
+        config = json.load(f)
+
+    import_start = time.perf_counter()
+    import ingestion_e2e
+    import_seconds = time.perf_counter() - import_start
+
+    ingestion_e2e.setup_logging()
+    for name, value in config["overrides"].items():
+        setattr(ingestion_e2e, name, value)
+    startup_start = time.perf_counter()
+    ingestion_e2e.open_clients()
+    startup_seconds = time.perf_counter() - startup_start
+    # Latency of each logical call, including limiter waits and retries
+    embedding_latencies, upsert_latencies = [], []
+    ingestion_e2e.request_embeddings = _timed(ingestion_e2e.request_embeddings, embedding_latencies)
+    ingestion_e2e.upsert_vectors = _timed(ingestion_e2e.upsert_vectors, upsert_latencies)
+
+    start = time.perf_counter()
+    cpu_start = _cpu_seconds()  # This process only - parse pool workers are children
+    if config["mode"] == "batch":
+        summary = ingestion_e2e.run_batch_backfill()
+    else:
+        summary = ingestion_e2e.process_and_upsert_filings()
+    wall_seconds = time.perf_counter() - start
+    cpu_seconds = _cpu_seconds() - cpu_start
+    metrics = ingestion_e2e.registry.snapshot()
+    ingestion_e2e.close_clients()
+
+    with open(result_path, "w") as f:
+        json.dump({
+            "summary": summary,
+            "import_seconds": import_seconds,
+            "startup_seconds": startup_seconds,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": cpu_seconds,
+            "peak_rss_mb": _peak_rss_mb(),
+            "embedding_latencies_ms": embedding_latencies,
+            "upsert_latencies_ms": upsert_latencies,
+            "metrics": metrics,
+        }, f)
+
+
+# --- Harness ---
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0, "p50": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {"count": len(ordered), "p50": pick(0.50), "p99": pick(0.99), "max": round(ordered[-1], 2)}
+
+
+def parse_overrides(assignments: list[str]) -> dict:
+    overrides = {}
+    for assignment in assignments:
+        name, _, raw_value = assignment.partition("=")
+        if name not in TUNABLES:
+            raise SystemExit(f"--set {name}: not a tunable setting (choose from {', '.join(TUNABLES)})")
+        try:
+            overrides[name] = ast.literal_eval(raw_value)
+        except (ValueError, SyntaxError):
+            overrides[name] = raw_value  # Bare strings, e.g. CHUNK_UNIT=tokens
+    return overrides
+
+
+def measure_cli_startup(env: dict) -> float:
+    """Wall time of a complete `ingestion_e2e.py status` process: interpreter start, imports and a local-state read."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "ingestion_e2e.py", "status"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                   env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def run_benchmark(args) -> dict:
+    scratch = tempfile.mkdtemp(prefix="edgar_bench_")
+    filings_dir = os.path.join(scratch, "filings_data")
+    generate_filings(filings_dir, args.files, args.words_per_section, args.boilerplate, args.seed,
+                     args.large_files, args.large_factor)
+
+    server = MockApiServer(
+        dimension=args.dimension,
+        embedding_latency_ms=args.embedding_latency_ms,
+        upsert_latency_ms=args.upsert_latency_ms,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        batch_latency_seconds=args.batch_latency,
+        seed=args.seed,
+    ).start()
+
+    overrides = parse_overrides(args.set)
+    if args.mode == "batch":
+        overrides.setdefault("BATCH_POLL_SECONDS", 0.5)
+    config = {"mode": args.mode, "overrides": overrides}
+    config_path = os.path.join(scratch, "config.json")
+    result_path = os.path.join(scratch, "result.json")
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+    env = dict(
+        os.environ,
+        FILINGS_DATA_DIR=filings_dir,
+        INGESTION_CACHE_DIR=os.path.join(scratch, "cache"),
+        INGESTION_LOG_DIR=os.path.join(scratch, "logs"),
+        EDGAR_IDENTITY=os.environ.get("EDGAR_IDENTITY") or "Benchmark bench@example.com",
+        OPENAI_API_KEY="mock",
+        OPENAI_BASE_URL=f"{server.url}/v1",
+        PINECONE_API_KEY="mock",
+        PINECONE_INDEX_NAME="mock",
+        PINECONE_INDEX_HOST=server.url,
+        PINECONE_GRPC="0",  # The mock speaks the REST API only
+        VECTOR_SINK=args.sink,
+        EMBEDDING_DIMENSIONS=str(args.embedding_dimensions or ""),
+        EMBEDDING_BACKEND=args.embedding_backend,
+        EMBEDDING_ENCODING=args.embedding_encoding,
+    )
+    worker_log = os.path.join(scratch, "worker.log")
+    print(f"Running Phase 2 on {args.files} synthetic filings (scratch: {scratch})")
+    try:
+        cli_startup_seconds = measure_cli_startup(env)
+        with open(worker_log, "w") as log:
+            process = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", config_path, result_path],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        if process.returncode != 0:
+            with open(worker_log) as log:
+                sys.stderr.write(log.read()[-4000:])
+            raise SystemExit(f"Benchmark worker failed with exit code {process.returncode}")
+        with open(result_path) as f:
+            worker = json.load(f)
+    finally:
+        server_stats = server.stats()
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    summary = worker["summary"] or {}
+    elapsed = worker["wall_seconds"]
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "config": {
+            "files": args.files,
+            "words_per_section": args.words_per_section,
+            "boilerplate": args.boilerplate,
+            "large_files": args.large_files,
+            "large_factor": args.large_factor,
+            "seed": args.seed,
+            "sink": args.sink,
+            "mode": args.mode,
+            "embedding_dimensions": args.embedding_dimensions,
+            "embedding_backend": args.embedding_backend,
+            "embedding_encoding": args.embedding_encoding,
+            "mock": {
+                "embedding_latency_ms": args.embedding_latency_ms,
+                "upsert_latency_ms": args.upsert_latency_ms,
+                "rpm": args.rpm,
+                "tpm": args.tpm,
+                "error_rate_429": args.error_rate_429,
+                "error_rate_5xx": args.error_rate_5xx,
+                "batch_latency_seconds": args.batch_latency,
+            },
+            "overrides": config["overrides"],
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "import_seconds": round(worker["import_seconds"], 3),
+        "startup_seconds": round(worker["startup_seconds"], 3),
+        "cli_startup_seconds": round(cli_startup_seconds, 3),
+        "files_succeeded": summary.get("files_processed_successfully", 0),
+        "files_failed": summary.get("files_with_errors", 0),
+        "chunks": summary.get("chunks_processed", 0),
+        "chunks_deduplicated": summary.get("chunks_deduplicated", 0),
+        "vectors": summary.get("vectors_upserted", 0),
+        "chunks_per_second": round(summary.get("chunks_processed", 0) / elapsed, 2) if elapsed else 0.0,
+        "vectors_per_second": round(summary.get("vectors_upserted", 0) / elapsed, 2) if elapsed else 0.0,
+        "embedding_requests": summary.get("embedding_requests", 0),
+        "namespaces": summary.get("namespaces", 0),
+        "embedding_latency_ms": percentiles(worker["embedding_latencies_ms"]),
+        "upsert_latency_ms": percentiles(worker["upsert_latencies_ms"]),
+        "peak_rss_mb": round(worker["peak_rss_mb"], 1),
+        "cpu_seconds": round(worker["cpu_seconds"], 3),
+        "cpu_us_per_vector": (round(worker["cpu_seconds"] * 1e6 / summary["vectors_upserted"], 1)
+                              if summary.get("vectors_upserted") else None),
+        "stage_seconds": {
+            entry["labels"]["stage"]: round(entry["sum"], 3)
+            for entry in worker["metrics"]["histograms"].get("stage_seconds", [])
+        },
+        "retries": {
+            entry["labels"]["api"]: entry["value"] for entry in worker["metrics"]["counters"].get("retries_total", [])
+        },
+        "autotuned_settings": {  # Final values when AUTOTUNE is on
+            entry["labels"]["setting"]: entry["value"]
+            for entry in worker["metrics"]["gauges"].get("pipeline_setting", [])
+        },
+        "server": server_stats,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metric(result: dict, path: str):
+    value = result
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def compare(result: dict, baseline: dict):
+    print(f"\nCompared with baseline from {baseline.get('timestamp')} ({baseline.get('git_commit')}):")
+    for path, higher_is_better in COMPARED_METRICS.items():
+        new, old = _metric(result, path), _metric(baseline, path)
+        if new is None or old is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        verdict = "" if abs(change) < 0.05 else (" better" if better else " WORSE")
+        print(f"  {path:28} {old:>10} -> {new:>10} ({change:+.1%}){verdict}")
+
+
+def print_result(result: dict):
+    print(f"\nFiles: {result['files_succeeded']} ok, {result['files_failed']} failed in {result['elapsed_seconds']}s "
+          f"(import {result['import_seconds']}s, client startup {result.get('startup_seconds')}s, "
+          f"`status` command {result.get('cli_startup_seconds')}s)")
+    print(f"Chunks: {result['chunks']} ({result['chunks_per_second']}/s), {result['chunks_deduplicated']} deduplicated")
+    print(f"Vectors: {result['vectors']} ({result['vectors_per_second']}/s) in {result.get('namespaces', 1)} namespaces")
+    for name in ("embedding_latency_ms", "upsert_latency_ms"):
+        stats = result[name]
+        print(f"{name}: p50 {stats['p50']}, p99 {stats['p99']}, max {stats['max']} over {stats['count']} calls")
+    print(f"Peak RSS: {result['peak_rss_mb']}MB, CPU: {result['cpu_seconds']}s "
+          f"({result['cpu_us_per_vector']}us per vector, excluding the parse pool)")
+    print(f"Worker seconds by stage: {json.dumps(result['stage_seconds'])}, retries: {json.dumps(result['retries'])}")
+    if result["autotuned_settings"]:
+        print(f"Autotuned settings: {json.dumps(result['autotuned_settings'])}")
+    print(f"Server: {json.dumps(result['server'])}")
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Benchmark Phase 2 against a mock OpenAI/Pinecone server.")
+    parser.add_argument("--files", type=int, default=20, help="Synthetic filings to generate")
+    parser.add_argument("--words-per-section", type=int, default=5000)
+    parser.add_argument("--boilerplate", type=float, default=0.2, help="Share of sections repeated across filings")
+    parser.add_argument("--large-files", type=int, default=0,
+                        help="Make the last N filings larger, to measure straggler handling")
+    parser.add_argument("--large-factor", type=int, default=10, help="How many times larger (with --large-files)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sink", choices=["pinecone", "local"], default="pinecone",
+                        help="'pinecone' upserts to the mock server, 'local' to the local vector store")
+    parser.add_argument("--mode", choices=["sync", "batch"], default="sync",
+                        help="Run the pipeline as is, or as an OpenAI Batch API backfill (--mode batch)")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--embedding-dimensions", type=int,
+                        help="Request shortened embeddings (sets EMBEDDING_DIMENSIONS for the pipeline)")
+    parser.add_argument("--embedding-backend", choices=["openai", "local"], default="openai",
+                        help="'openai' embeds through the mock API, 'local' with the LOCAL_EMBEDDING_MODEL on this CPU")
+    parser.add_argument("--embedding-encoding", choices=["base64", "float"], default="base64",
+                        help="Response encoding requested from the embeddings API")
+    parser.add_argument("--embedding-latency-ms", type=float, default=150.0)
+    parser.add_argument("--upsert-latency-ms", type=float, default=40.0)
+    parser.add_argument("--rpm", type=int, help="Mock OpenAI requests-per-minute limit")
+    parser.add_argument("--tpm", type=int, help="Mock OpenAI tokens-per-minute limit")
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    parser.add_argument("--batch-latency", type=float, default=2.0, help="Seconds until a mock batch job completes")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help=f"Override a pipeline setting for this run ({', '.join(TUNABLES)})")
+    parser.add_argument("--output", help="Result JSON path (default: bench_results/<timestamp>.json)")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="Print changes against an earlier result")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory for inspection")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    result = run_benchmark(args)
+    print_result(result)
+    output_path = args.output or os.path.join(BENCH_RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved results to {output_path}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        run_worker(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+    sys.exit(main())
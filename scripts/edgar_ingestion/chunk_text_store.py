@@ -0,0 +1,241 @@
+"""
+Compressed, memory-mapped store for full chunk text, keyed by vector ID.
+
+Keeping ~1000 words of text in every vector's metadata makes upserts many
+times larger than the vectors themselves and runs into per-record metadata
+limits. With the text store enabled, vector metadata carries only a short
+preview plus filterable fields, and the full text lives here instead.
+
+Layout (inside `directory`):
+    blocks.dat      append-only compressed blocks, read through mmap
+    index.sqlite3   vector_id -> (block offset, block length, start, length)
+
+Texts are buffered and written as blocks of roughly `block_size` bytes. Each
+block starts with a one-byte codec tag (zstd when the `zstandard` package is
+installed, zlib otherwise) so stores stay readable either way. Rewriting a
+vector ID simply points the index at the new copy.
+
+`serve_chunk_texts` exposes the store over HTTP so the query edge function can
+fetch full texts for the matches it gets back from Pinecone. It listens on
+localhost only unless it is given another host and an API key.
+"""
+
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+_CODEC_ZLIB = b"d"
+_CODEC_ZSTD = b"z"
+
+
+class ChunkTextStore:
+    """Thread-safe append-only text store with an offset index."""
+
+    def __init__(self, directory: str, block_size: int = 64 * 1024, cached_blocks: int = 64):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.block_size = block_size
+        self._data_path = os.path.join(directory, "blocks.dat")
+        self._lock = threading.Lock()
+        self._writer = open(self._data_path, "ab")
+        self._mmap = None
+        self._pending = []  # (vector_id, encoded text)
+        self._pending_bytes = 0
+        self._block_cache = OrderedDict()
+        self._cached_blocks = cached_blocks
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                vector_id TEXT PRIMARY KEY,
+                block_offset INTEGER NOT NULL,
+                block_length INTEGER NOT NULL,
+                start INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        if zstandard is not None:
+            self._compress = zstandard.ZstdCompressor(level=3).compress
+            self._codec = _CODEC_ZSTD
+        else:
+            self._compress = lambda data: zlib.compress(data, 6)
+            self._codec = _CODEC_ZLIB
+
+    # --- Writing ---
+
+    def put(self, vector_id: str, text: str):
+        """Buffer a text; it is written with the next full block or on flush()."""
+        encoded = text.encode("utf-8")
+        with self._lock:
+            self._pending.append((vector_id, encoded))
+            self._pending_bytes += len(encoded)
+            if self._pending_bytes >= self.block_size:
+                self._write_block_locked()
+
+    def flush(self):
+        """Write any buffered texts and make them durable."""
+        with self._lock:
+            self._write_block_locked()
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+
+    def _write_block_locked(self):
+        if not self._pending:
+            return
+        payload = b"".join(encoded for _, encoded in self._pending)
+        block = self._codec + self._compress(payload)
+        block_offset = self._writer.seek(0, os.SEEK_END)
+        self._writer.write(block)
+        self._writer.flush()
+        os.fsync(self._writer.fileno())  # The index must never point at bytes a crash could lose
+
+        rows = []
+        start = 0
+        for vector_id, encoded in self._pending:
+            rows.append((vector_id, block_offset, len(block), start, len(encoded)))
+            start += len(encoded)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunks (vector_id, block_offset, block_length, start, length) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        self._conn.commit()
+        self._pending = []
+        self._pending_bytes = 0
+
+    def delete(self, vector_ids: list[str]):
+        """Forget vector IDs. Their bytes stay in blocks.dat until the store is rebuilt."""
+        deleted = set(vector_ids)
+        with self._lock:
+            self._pending = [(vector_id, encoded) for vector_id, encoded in self._pending if vector_id not in deleted]
+            self._conn.executemany("DELETE FROM chunks WHERE vector_id = ?", [(vector_id,) for vector_id in vector_ids])
+            self._conn.commit()
+
+    # --- Reading ---
+
+    def get_many(self, vector_ids: list[str]) -> dict[str, str]:
+        """Return {vector_id: text} for every ID present in the store."""
+        texts = {}
+        wanted = set(vector_ids)
+        with self._lock:
+            # Newest copy wins, and unflushed texts are newer than anything on disk
+            for vector_id, encoded in reversed(self._pending):
+                if vector_id in wanted and vector_id not in texts:
+                    texts[vector_id] = encoded.decode("utf-8")
+            for i in range(0, len(vector_ids), 500):
+                id_batch = vector_ids[i:i+500]
+                placeholders = ",".join("?" * len(id_batch))
+                rows = self._conn.execute(
+                    f"SELECT vector_id, block_offset, block_length, start, length FROM chunks WHERE vector_id IN ({placeholders})",
+                    id_batch,
+                ).fetchall()
+                for vector_id, block_offset, block_length, start, length in rows:
+                    if vector_id in texts:
+                        continue
+                    payload = self._read_block_locked(block_offset, block_length)
+                    texts[vector_id] = payload[start:start+length].decode("utf-8")
+        return texts
+
+    def get(self, vector_id: str) -> str | None:
+        return self.get_many([vector_id]).get(vector_id)
+
+    def _read_block_locked(self, block_offset: int, block_length: int) -> bytes:
+        key = (block_offset, block_length)
+        payload = self._block_cache.get(key)
+        if payload is not None:
+            self._block_cache.move_to_end(key)
+            return payload
+
+        if self._mmap is None or block_offset + block_length > len(self._mmap):
+            # The file has grown since it was mapped
+            if self._mmap is not None:
+                self._mmap.close()
+            self._writer.flush()
+            with open(self._data_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        block = self._mmap[block_offset:block_offset + block_length]
+        codec, compressed = block[:1], block[1:]
+        if codec == _CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("Chunk text store contains zstd blocks but zstandard is not installed")
+            payload = zstandard.ZstdDecompressor().decompress(compressed)
+        else:
+            payload = zlib.decompress(compressed)
+
+        self._block_cache[key] = payload
+        if len(self._block_cache) > self._cached_blocks:
+            self._block_cache.popitem(last=False)
+        return payload
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._writer.close()
+            self._conn.close()
+
+
+def is_loopback_host(host: str) -> bool:
+    """Whether `host` only accepts connections from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False  # A host name, which may resolve to any interface
+
+
+def serve_chunk_texts(store: ChunkTextStore, host: str = "127.0.0.1", port: int = 8765, api_key: str | None = None):
+    """
+    Serve `POST /chunks` with body {"ids": [...]} -> {"texts": {id: text}}.
+    If `api_key` is set, requests must send it in the `Authorization: Bearer` header.
+    Any host other than localhost requires `api_key`, so the store is never open to the network.
+    """
+    if not api_key and not is_loopback_host(host):
+        raise ValueError(f"Serving chunk texts on {host} requires an API key")
+
+    class ChunkTextHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/chunks":
+                self.send_error(404)
+                return
+            if api_key and self.headers.get("Authorization") != f"Bearer {api_key}":
+                self.send_error(401)
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                vector_ids = json.loads(body)["ids"]
+            except (ValueError, KeyError):
+                self.send_error(400)
+                return
+            response = json.dumps({"texts": store.get_many(vector_ids)}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), ChunkTextHandler)
+    logger.info(f"Serving chunk texts from {store.directory} on http://{host}:{port}/chunks")
+    server.serve_forever()
@@ -0,0 +1,134 @@
+"""
+Sentence- and paragraph-aware chunking by character offsets.
+
+The section text is scanned once with a compiled boundary regex to find
+sentence and paragraph ends. Sentences are then packed greedily into chunks of
+about `chunk_size` words (or tokens), preferring to close a chunk at a paragraph
+break once it is reasonably full, with roughly `overlap` words/tokens of whole
+sentences shared between consecutive chunks.
+
+Chunks are returned as (start, end) offsets into the original string, so no
+text is copied until a chunk is actually needed, whitespace (and therefore
+table layout) is preserved, and the offsets can be stored in vector metadata
+for citation highlighting.
+"""
+
+import re
+
+from token_batcher import count_tokens
+
+CHUNKER_VERSION = "sentence-v1"
+
+# A sentence ends at . ! or ? (plus any closing quotes/brackets) followed by
+# whitespace; a paragraph ends at a blank line. The 'gap' group is the
+# whitespace separating two units.
+_BOUNDARY_RE = re.compile(r"[.!?][\"'”’)\]]*(?P<gap>\s+)|(?P<para>\n[ \t]*\n\s*)")
+_WORD_RE = re.compile(r"\S+")
+
+
+def _iter_units(text: str):
+    """Yield (start, end, ends_paragraph) for each sentence-like unit of `text`."""
+    position = _WORD_RE.search(text)
+    if position is None:
+        return
+    start = position.start()
+    for match in _BOUNDARY_RE.finditer(text, start):
+        group = "gap" if match.group("gap") is not None else "para"
+        gap_start, gap_end = match.span(group)
+        if gap_start > start:
+            yield start, gap_start, text.count("\n", gap_start, gap_end) >= 2
+        start = gap_end
+    end = len(text.rstrip())
+    if end > start:
+        yield start, end, True
+
+
+def _measure(text: str, start: int, end: int, unit: str, model: str) -> int:
+    if unit == "tokens":
+        return count_tokens(text[start:end], model)
+    return len(_WORD_RE.findall(text, start, end))
+
+
+def _split_long_unit(text: str, start: int, end: int, limit: int, unit: str, model: str):
+    """Split a unit with no usable sentence breaks (e.g. a table) at word boundaries."""
+    words = [match.span() for match in _WORD_RE.finditer(text, start, end)]
+    piece_start = 0
+    size = 0
+    for i, (word_start, word_end) in enumerate(words):
+        # Per-word token counts slightly overestimate the joined count, which keeps us under the limit
+        word_size = count_tokens(text[word_start:word_end], model) if unit == "tokens" else 1
+        if size and size + word_size > limit:
+            yield words[piece_start][0], words[i - 1][1], size
+            piece_start, size = i, 0
+        size += word_size
+    if size:
+        yield words[piece_start][0], words[-1][1], size
+
+
+def iter_chunk_spans(
+    text: str,
+    chunk_size: int = 1000,
+    overlap: int = 100,
+    unit: str = "words",
+    model: str = "text-embedding-3-small",
+    min_fill: float = 0.75,
+):
+    """
+    Yield (start, end) character offsets of overlapping chunks of `text`.
+
+    `unit` is "words" or "tokens" and applies to both `chunk_size` and `overlap`.
+    A chunk is closed early at a paragraph break once it holds `min_fill` of
+    `chunk_size`.
+    """
+    if not text:
+        return
+
+    starts, ends, paragraph_ends, sizes = [], [], [], []
+    for start, end, ends_paragraph in _iter_units(text):
+        size = _measure(text, start, end, unit, model)
+        if size <= chunk_size:
+            pieces = [(start, end, size)]
+        else:
+            pieces = list(_split_long_unit(text, start, end, chunk_size, unit, model))
+        for piece_start, piece_end, piece_size in pieces:
+            starts.append(piece_start)
+            ends.append(piece_end)
+            paragraph_ends.append(False)
+            sizes.append(piece_size)
+        paragraph_ends[-1] = ends_paragraph
+
+    count = len(sizes)
+    i = 0
+    while i < count:
+        j = i
+        total = 0
+        while j < count:
+            if total and total + sizes[j] > chunk_size:
+                break
+            total += sizes[j]
+            j += 1
+            if paragraph_ends[j - 1] and total >= min_fill * chunk_size:
+                break
+
+        yield starts[i], ends[j - 1]
+        if j >= count:
+            break
+
+        # Step back over whole units to carry roughly `overlap` into the next chunk
+        k = j
+        carried = 0
+        while k - 1 > i and carried + sizes[k - 1] <= overlap:
+            k -= 1
+            carried += sizes[k]
+        i = k
+
+
+def split_span_by_tokens(text: str, start: int, end: int, max_tokens: int, model: str = "text-embedding-3-small"):
+    """Split one chunk span into spans of at most `max_tokens` tokens, at word boundaries."""
+    for piece_start, piece_end, _ in _split_long_unit(text, start, end, max_tokens, "tokens", model):
+        yield piece_start, piece_end
+
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100, unit: str = "words") -> list[str]:
+    """Convenience wrapper returning chunk strings instead of offsets."""
+    return [text[start:end] for start, end in iter_chunk_spans(text, chunk_size, overlap, unit)]
@@ -0,0 +1,116 @@
+"""
+Dead-letter spool for vector batches that could not be upserted.
+
+Embeddings cost money, so a batch that still fails after every retry is not
+dropped: it is appended (fsynced) to a JSON-lines spool together with its
+metadata, namespace and the error, and `replay` upserts it on a later run without
+re-embedding anything. Vector values are stored as base64 float32, about a
+quarter of the size of JSON floats.
+
+Replay runs before any new upserts, so a newer version of a vector written
+later in the same run is never overwritten by an older spooled copy.
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_vector(vector: dict) -> dict:
+    encoded = {"id": vector["id"], "values": base64.b64encode(np.asarray(vector["values"], dtype=np.float32).tobytes()).decode("ascii")}
+    if vector.get("metadata") is not None:
+        encoded["metadata"] = vector["metadata"]
+    return encoded
+
+
+def _decode_vector(encoded: dict) -> dict:
+    vector = {"id": encoded["id"], "values": np.frombuffer(base64.b64decode(encoded["values"]), dtype=np.float32)}
+    if "metadata" in encoded:
+        vector["metadata"] = encoded["metadata"]
+    return vector
+
+
+class DeadLetterSpool:
+    """Thread-safe append-only spool of failed upsert batches."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, vectors: list[dict], error: str, namespace: str = ""):
+        record = {
+            "spooled_at": time.time(),
+            "error": error,
+            "namespace": namespace,
+            "vectors": [_encode_vector(vector) for vector in vectors],
+        }
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        logger.warning(f"Spooled {len(vectors)} vectors to {self.path} after upsert failure: {error}")
+
+    def pending(self) -> int:
+        """Number of vectors waiting to be replayed."""
+        with self._lock:
+            return sum(len(record["vectors"]) for record in self._read_locked())
+
+    def _read_locked(self) -> list[dict]:
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt line in {self.path}")  # Torn write from a crash
+        return records
+
+    def replay(self, upsert_fn) -> tuple[int, int]:
+        """
+        Upsert every spooled batch with `upsert_fn(vectors, namespace)`. After the first
+        failure the remaining batches are kept without being tried, since the
+        sink is evidently still unavailable. Returns (vectors replayed, vectors
+        still pending).
+        """
+        with self._lock:
+            records = self._read_locked()
+            if not records:
+                return 0, 0
+            remaining = []
+            replayed = 0
+            for record in records:
+                if remaining:
+                    remaining.append(record)
+                    continue
+                vectors = [_decode_vector(encoded) for encoded in record["vectors"]]
+                try:
+                    upsert_fn(vectors, record.get("namespace", ""))  # Spooled before namespaces: the default one
+                    replayed += len(vectors)
+                except Exception as e:
+                    record["error"] = str(e)
+                    remaining.append(record)
+
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                for record in remaining:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            if not remaining:
+                os.remove(self.path)
+            still_pending = sum(len(record["vectors"]) for record in remaining)
+        logger.info(f"Replayed {replayed} spooled vectors from {self.path}, {still_pending} still pending")
+        return replayed, still_pending
@@ -0,0 +1,193 @@
+"""
+Phase 1: bulk fetch of SEC filings into the filing store.
+
+Filings for a year (optionally a single quarter), a list of form types and an
+optional list of CIKs are downloaded and parsed by a pool of worker threads.
+All workers share one request limiter so the pool as a whole stays within
+SEC's fair-access limit of 10 requests per second.
+
+Each filing is appended to the filing store (see filing_store.py) and made
+durable before it is indexed, and every finished accession number is appended
+to a checkpoint file, so a crashed or interrupted fetch resumes where it stopped.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import backoff
+from edgar import get_filings
+from tqdm import tqdm
+
+from filing_store import FilingStore
+from metrics import registry
+from rate_limiter import RequestRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Sections extracted per form type: output section name -> attribute on filing.obj()
+SECTION_ATTRIBUTES = {
+    "10-K": {
+        "business": "business",
+        "risk_factors": "risk_factors",
+        "management_discussion": "management_discussion",
+    },
+    "10-Q": {
+        "management_discussion": "management_discussion",
+        "risk_factors": "risk_factors",
+    },
+}
+
+# Downloading and parsing one filing costs a few HTTP requests (index, main
+# document, sometimes exhibits); reserve this many from the limiter per filing.
+SEC_REQUESTS_PER_FILING = 3
+
+
+class FetchCheckpoint:
+    """Append-only JSON-lines record of accession numbers that are done."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Torn final line from a crash
+                    if record.get("status") in ("saved", "no_sections"):
+                        self.completed.add(record["accession_number"])
+
+    def record(self, accession_number: str, status: str, error: str | None = None):
+        entry = {"accession_number": accession_number, "status": status, "time": time.time()}
+        if error:
+            entry["error"] = error
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if status in ("saved", "no_sections"):
+                self.completed.add(accession_number)
+
+
+def extract_sections(filing) -> dict:
+    """Return the non-empty text sections we index for this filing's form type."""
+    attributes = SECTION_ATTRIBUTES.get(filing.form, SECTION_ATTRIBUTES["10-K"])
+    document = filing.obj()
+    sections = {}
+    for section_name, attribute in attributes.items():
+        try:
+            content = getattr(document, attribute, None)
+        except Exception as e:
+            logger.debug(f"Could not extract {section_name} from {filing.accession_number}: {e}")
+            continue
+        if content:
+            sections[section_name] = str(content)
+    return sections
+
+
+def _count_sec_retry(details):
+    registry.inc("retries_total", api="sec")
+
+
+@backoff.on_exception(backoff.expo, Exception, max_tries=3, on_backoff=_count_sec_retry)
+def fetch_one(filing, limiter: RequestRateLimiter) -> dict:
+    with registry.timer("sec_rate_limiter_wait_seconds"):
+        limiter.acquire(SEC_REQUESTS_PER_FILING)
+    with registry.timer("sec_fetch_seconds"):
+        return {
+            "company": filing.company,
+            "cik": str(filing.cik),
+            "form": filing.form,
+            "filing_date": str(filing.filing_date),
+            "accession_number": filing.accession_number,
+            "sections": extract_sections(filing),
+        }
+
+
+def list_filings(year: int, quarter: int | None, forms: list[str], ciks: list[int] | None) -> list:
+    """List matching filings from the EDGAR full index."""
+    filings = get_filings(year=year, quarter=quarter, form=forms)
+    if filings is None:
+        return []
+    if ciks:
+        wanted = {int(cik) for cik in ciks}
+        return [filing for filing in filings if int(filing.cik) in wanted]
+    return list(filings)
+
+
+def fetch_filings(
+    year: int,
+    store: FilingStore,
+    checkpoint_path: str,
+    quarter: int | None = None,
+    forms: list[str] | None = None,
+    ciks: list[int] | None = None,
+    max_workers: int = 8,
+    requests_per_second: float = 8,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Download and save every matching filing not already recorded in the checkpoint.
+    With `dry_run` the matching filings are only listed. Returns summary statistics.
+    """
+    forms = forms or ["10-K"]
+    logger.info(f"=== Phase 1: Fetching {', '.join(forms)} filings for {year}"
+                f"{f' Q{quarter}' if quarter else ''}{f' ({len(ciks)} CIKs)' if ciks else ''} ===")
+
+    limiter = RequestRateLimiter(requests_per_second)
+    checkpoint = FetchCheckpoint(checkpoint_path)
+    limiter.acquire()  # The index listing itself is a request
+    filings = list_filings(year, quarter, forms, ciks)
+    pending = [filing for filing in filings if filing.accession_number not in checkpoint.completed]
+    logger.info(f"Found {len(filings)} filings, {len(filings) - len(pending)} already fetched, {len(pending)} to fetch")
+
+    stats = {"saved": 0, "no_sections": 0, "failed": 0, "skipped": len(filings) - len(pending)}
+    if dry_run:
+        for filing in pending[:20]:
+            logger.info(f"Would fetch {filing.company} {filing.form} ({filing.accession_number})")
+        if len(pending) > 20:
+            logger.info(f"... and {len(pending) - 20} more")
+        return {**stats, "pending": len(pending)}
+    fetch_start_time = time.time()
+
+    def fetch_and_save(filing):
+        content = fetch_one(filing, limiter)
+        if not content["sections"]:
+            return "no_sections"
+        store.put(content)
+        return "saved"
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="EdgarFetcher") as executor:
+        future_to_filing = {executor.submit(fetch_and_save, filing): filing for filing in pending}
+        progress_bar = tqdm(total=len(pending), desc="Fetching filings")
+        for future in as_completed(future_to_filing):
+            filing = future_to_filing[future]
+            try:
+                status = future.result()
+                checkpoint.record(filing.accession_number, status)
+                stats[status] += 1
+                registry.inc("sec_filings_total", status=status)
+                if status == "no_sections":
+                    logger.warning(f"No target sections extracted from {filing.company} ({filing.accession_number})")
+            except Exception as e:
+                logger.error(f"✗ Failed to fetch {filing.company} ({filing.accession_number}): {e}")
+                checkpoint.record(filing.accession_number, "failed", str(e))
+                stats["failed"] += 1
+                registry.inc("sec_filings_total", status="failed")
+            progress_bar.update(1)
+        progress_bar.close()
+
+    total_time = time.time() - fetch_start_time
+    logger.info("=== Phase 1 Summary ===")
+    logger.info(f"Filings saved: {stats['saved']}, without sections: {stats['no_sections']}, "
+                f"failed: {stats['failed']}, already fetched: {stats['skipped']}")
+    logger.info(f"Total fetch time: {total_time:.2f}s ({total_time/60:.1f} minutes)")
+    return stats
@@ -0,0 +1,311 @@
+"""
+Embedding backends for the ingestion pipeline.
+
+The pipeline only needs `embed(texts)` returning one float32 row per text, so
+anything implementing `Embedder` can produce its vectors:
+
+    OpenAIEmbedder   the OpenAI embeddings API (rate limiting and retries are
+                     left to the caller, which shares them across threads)
+    LocalEmbedder    a sentence embedding model run on the local CPU, through
+                     ONNX Runtime or sentence-transformers; no network, no quota
+
+Each backend names the vector space it produces (`space`, see
+`embedding_cache.embedding_space`), which keys the embedding cache and is
+recorded with every vector, so vectors from different models never mix.
+
+Local inference is fastest when a batch's texts have similar lengths, since
+every text is padded to the longest one. `LocalEmbedder` therefore sorts each
+call's texts by estimated length and cuts them into buckets bounded by a padded
+token budget. Buckets run in-process (one at a time, each using
+`threads` intra-op threads) or are spread over forked worker processes, each
+with its own copy of the model.
+
+onnxruntime + tokenizers, or sentence-transformers, are optional dependencies,
+only imported when a local model is loaded.
+"""
+
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from embedding_cache import embedding_space
+
+logger = logging.getLogger(__name__)
+
+RUNTIMES = ("onnx", "sentence-transformers")
+DEFAULT_MAX_SEQ_LENGTH = 256  # Tokens; longer texts are truncated by the model
+CHARS_PER_TOKEN = 4  # Length estimate used for bucketing
+
+
+class Embedder(ABC):
+    """
+    Interface for embedding backends. `embed` is called from several pipeline
+    threads at once. A backend without `embed` fails when it is constructed.
+    """
+
+    remote = False  # True for APIs whose requests count against a shared rate limit
+    model: str
+    dimensions: int | None = None
+
+    @property
+    def space(self) -> str:
+        return embedding_space(self.model, self.dimensions)
+
+    def start(self):
+        """Start any worker processes. Call before the pipeline starts its threads."""
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        ...
+
+    def close(self):
+        pass
+
+
+def decode_embeddings(data) -> np.ndarray:
+    """
+    Decode an embeddings response into one (n, dimension) float32 block. With
+    base64 encoding each vector is copied straight from its decoded bytes, so
+    no Python float is ever created for it.
+    """
+    data = sorted(data, key=lambda item: item.index)
+    if not data:
+        return np.empty((0, 0), dtype=np.float32)
+    if not isinstance(data[0].embedding, str):
+        return np.asarray([item.embedding for item in data], dtype=np.float32)
+    first = np.frombuffer(base64.b64decode(data[0].embedding), dtype="<f4")
+    block = np.empty((len(data), len(first)), dtype=np.float32)
+    block[0] = first
+    for row, item in enumerate(data[1:], start=1):
+        block[row] = np.frombuffer(base64.b64decode(item.embedding), dtype="<f4")
+    return block
+
+
+class OpenAIEmbedder(Embedder):
+    """
+    One OpenAI embeddings request per call. `on_headers` receives each
+    response's headers (e.g. to correct a rate limiter from them).
+    """
+
+    remote = True
+
+    def __init__(self, client, model: str, dimensions: int | None = None, encoding_format: str = "base64",
+                 on_headers=None):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.encoding_format = encoding_format
+        self.on_headers = on_headers
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        dimensions = {"dimensions": self.dimensions} if self.dimensions else {}
+        raw_response = self.client.embeddings.with_raw_response.create(
+            input=texts, model=self.model, encoding_format=self.encoding_format, **dimensions)
+        if self.on_headers is not None:
+            self.on_headers(raw_response.headers)
+        return decode_embeddings(raw_response.parse().data)
+
+
+# --- Local models ---
+
+class _OnnxModel:
+    """A transformer exported to ONNX (e.g. a quantized model_qint8_*.onnx), mean-pooled over real tokens."""
+
+    def __init__(self, directory: str, onnx_file: str, threads: int | None, max_seq_length: int):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(os.path.join(directory, onnx_file), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_seq_length)
+        self.tokenizer.enable_padding()  # To the longest text of each batch
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        output = self.session.run(None, feeds)[0]
+        if output.ndim == 3:  # Token embeddings; exports that pool in-graph return (batch, dimension)
+            mask = attention_mask[:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return output.astype(np.float32, copy=False)
+
+
+class _SentenceTransformerModel:
+    def __init__(self, model: str, threads: int | None, max_seq_length: int):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model, device="cpu")
+        self.model.max_seq_length = max_seq_length
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True).astype(np.float32, copy=False)
+
+
+def _load_model(config: dict):
+    if config['runtime'] == "onnx":
+        return _OnnxModel(config['model'], config['onnx_file'], config['threads'], config['max_seq_length'])
+    return _SentenceTransformerModel(config['model'], config['threads'], config['max_seq_length'])
+
+
+# Worker process state; set by the pool initializer
+_worker_model = None
+
+
+def _init_worker(config: dict):
+    global _worker_model
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is the parent's to handle
+    _worker_model = _load_model(config)
+
+
+def _encode_in_worker(texts: list[str]) -> np.ndarray:
+    return _worker_model.encode(texts)
+
+
+def _max_seq_length(model: str) -> int:
+    """The model's own limit when its directory says (sentence-transformers config), else a common default."""
+    config_path = os.path.join(model, "sentence_bert_config.json")
+    if os.path.isfile(config_path):
+        with open(config_path) as f:
+            return json.load(f).get("max_seq_length", DEFAULT_MAX_SEQ_LENGTH)
+    return DEFAULT_MAX_SEQ_LENGTH
+
+
+class LocalEmbedder(Embedder):
+    """
+    Embeds with a local model on the CPU. `model` is a model directory (ONNX:
+    holding `onnx_file` and tokenizer.json) or, for sentence-transformers, a
+    directory or Hub name. Vectors are L2-normalised like OpenAI's; with
+    `dimensions` they are truncated first (only meaningful for models trained
+    for it, e.g. Matryoshka models).
+    """
+
+    def __init__(
+        self,
+        model: str,
+        runtime: str = "onnx",
+        onnx_file: str = "model.onnx",
+        threads: int | None = None,
+        processes: int = 0,
+        batch_token_budget: int = 16_384,
+        max_batch_size: int = 64,
+        max_seq_length: int | None = None,
+        dimensions: int | None = None,
+    ):
+        if runtime not in RUNTIMES:
+            raise ValueError(f"Unknown local embedding runtime {runtime!r} (expected one of {', '.join(RUNTIMES)})")
+        name = os.path.basename(os.path.normpath(model)) if os.path.isdir(model) else model
+        if runtime == "onnx":
+            # Quantized and full-precision exports give slightly different vectors, so they are different spaces
+            name = f"{name}/{os.path.splitext(os.path.basename(onnx_file))[0]}"
+        self.model = f"local:{name}"
+        self.dimensions = dimensions
+        self.processes = processes
+        self.batch_token_budget = batch_token_budget
+        self.max_batch_size = max_batch_size
+        self._config = {
+            'runtime': runtime,
+            'model': model,
+            'onnx_file': onnx_file,
+            'threads': threads,
+            'max_seq_length': max_seq_length or _max_seq_length(model),
+        }
+        self._lock = threading.Lock()
+        self._model = None
+        self._pool = None
+
+    @property
+    def max_seq_length(self) -> int:
+        """Tokens of the model's own tokenizer it reads per text; the rest is cut off."""
+        return self._config['max_seq_length']
+
+    def missing_files(self) -> list[str]:
+        """
+        Files the ONNX runtime loads that do not exist, e.g. because `model` is
+        a Hub name. Checked up front, as the model is only loaded on first use.
+        """
+        if self._config['runtime'] != "onnx":
+            return []  # sentence-transformers also takes Hub names, downloaded when loaded
+        paths = [os.path.join(self._config['model'], self._config['onnx_file']),
+                 os.path.join(self._config['model'], "tokenizer.json")]
+        return [path for path in paths if not os.path.isfile(path)]
+
+    def start(self):
+        """Fork the worker processes, if any. The model is loaded in each worker, never in this process."""
+        if self._pool is not None or self.processes <= 0 or "fork" not in multiprocessing.get_all_start_methods():
+            return
+        self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("fork"),
+                                         initializer=_init_worker, initargs=(self._config,))
+        self._pool.submit(int).result()  # Fork and load every worker now, before the pipeline starts its threads
+        logger.info(f"Local embedding model {self.model} running in {self.processes} processes")
+
+    def _buckets(self, texts: list[str]) -> list[list[int]]:
+        """Indices of `texts` grouped by similar length, each group within the padded token budget."""
+        limit = self._config['max_seq_length']
+        lengths = [min(len(text) // CHARS_PER_TOKEN + 1, limit) for text in texts]
+        buckets, current = [], []
+        for index in sorted(range(len(texts)), key=lengths.__getitem__):
+            # Sorted ascending, so this text is the longest of the bucket and sets its padded length
+            if current and ((len(current) + 1) * lengths[index] > self.batch_token_budget
+                            or len(current) >= self.max_batch_size):
+                buckets.append(current)
+                current = []
+            current.append(index)
+        if current:
+            buckets.append(current)
+        return buckets
+
+    def _encode_in_process(self, texts: list[str]) -> np.ndarray:
+        # One batch at a time: each already uses every intra-op thread
+        with self._lock:
+            if self._model is None:
+                self._model = _load_model(self._config)
+                logger.info(f"Loaded local embedding model {self.model}")
+            return self._model.encode(texts)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        buckets = self._buckets(texts)
+        batches = [[texts[i] for i in bucket] for bucket in buckets]
+        if self._pool is not None:
+            results = self._pool.map(_encode_in_worker, batches)
+        else:
+            results = map(self._encode_in_process, batches)
+        block = None
+        for bucket, vectors in zip(buckets, results):
+            if self.dimensions:
+                vectors = vectors[:, :self.dimensions]
+            if block is None:
+                block = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            block[bucket] = vectors
+        if block is None:
+            return np.empty((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        block /= norms
+        return block
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,218 @@
+"""
+Persistent, content-addressed cache for OpenAI embeddings.
+
+Each entry is keyed by sha256(model, chunk text), so a chunk is only ever sent
+to OpenAI once per model no matter how many times the corpus is re-ingested.
+Entries live in a local SQLite database and are evicted least-recently-used
+once the cache grows past `max_entries`.
+
+Lookups sit on the hot path, so they write nothing: access times are kept in
+memory and written in batches (and before any eviction, which needs them), and
+the row count is tracked as entries are added rather than counted. Eviction
+runs only once the count passes the cap, and then removes a chunk of entries,
+so it is not repeated by every following write.
+
+Vectors are stored as raw float32 bytes and come back as read-only NumPy views
+of those bytes, so a cache hit costs no per-element conversion.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOUCH_FLUSH_ENTRIES = 1000  # Access times buffered in memory before they are written
+EVICTION_CHUNK_FRACTION = 0.05  # Of max_entries, evicted beyond the overflow so the next writes need no eviction
+
+
+def embedding_space(model: str, dimensions: int | None = None) -> str:
+    """
+    Name the vector space a model produces at a given output size, e.g.
+    "text-embedding-3-small@512". Pass it as `model` wherever a cache key is
+    built, so shortened and full-size embeddings of a text never collide.
+    """
+    return f"{model}@{dimensions}" if dimensions else model
+
+
+def cache_key(model: str, text: str) -> str:
+    """Return the content address for a (model, text) pair."""
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Thread-safe SQLite-backed embedding cache with LRU eviction.
+    Vectors are stored as packed float32 blobs.
+    """
+
+    def __init__(self, path: str, max_entries: int = 500_000):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._touched = {}  # key -> last access time not yet written
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        (self._count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()  # Kept current from here on
+
+    def get_many(self, model: str, texts: list[str]) -> list[np.ndarray | None]:
+        """
+        Look up embeddings for `texts`. Returns a list aligned with `texts`
+        holding the cached vector or None for each miss.
+        """
+        keys = [cache_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                key_batch = keys[i:i+500]
+                placeholders = ",".join("?" * len(key_batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", key_batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                self._touch_locked(found)
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for vector in results if vector is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def get_by_key(self, key: str) -> np.ndarray | None:
+        """Fetch a vector by its content address without counting a hit or miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._touch_locked([key])
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def contains_keys(self, keys: list[str]) -> set[str]:
+        """Return the subset of `keys` that are cached, without counting hits or touching entries."""
+        found = set()
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                key_batch = keys[i:i+500]
+                placeholders = ",".join("?" * len(key_batch))
+                rows = self._conn.execute(f"SELECT key FROM embeddings WHERE key IN ({placeholders})", key_batch)
+                found.update(key for (key,) in rows)
+        return found
+
+    def put_many(self, model: str, texts: list[str], embeddings: list[list[float]] | np.ndarray):
+        """Store freshly computed embeddings and evict the oldest entries if over capacity."""
+        self.put_keys(model, [cache_key(model, text) for text in texts], embeddings)
+
+    def put_keys(self, model: str, keys: list[str], embeddings: list[list[float]] | np.ndarray):
+        """Like `put_many`, for callers that only have the content addresses (e.g. batch results)."""
+        now = time.time()
+        rows = [
+            (key, model, np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for key, embedding in zip(keys, embeddings)
+        ]
+        with self._lock:
+            # Replaced entries do not grow the table; looking them up by key is cheap, unlike counting rows
+            unique_keys = list(dict.fromkeys(keys))
+            existing = 0
+            for i in range(0, len(unique_keys), 500):
+                key_batch = unique_keys[i:i+500]
+                placeholders = ",".join("?" * len(key_batch))
+                (found,) = self._conn.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})", key_batch).fetchone()
+                existing += found
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._count += len(unique_keys) - existing
+            for key in unique_keys:
+                self._touched.pop(key, None)  # Just written with a newer access time
+            if self._count > self.max_entries:
+                self._evict_locked()
+            self._conn.commit()
+
+    def _touch_locked(self, keys):
+        """Note that `keys` were just used; written with the next batch. Caller must hold the lock."""
+        now = time.time()
+        for key in keys:
+            self._touched[key] = now
+        if len(self._touched) >= TOUCH_FLUSH_ENTRIES:
+            self._write_touches_locked()
+            self._conn.commit()
+
+    def _write_touches_locked(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()],
+            )
+            self._touched = {}
+
+    def _evict_locked(self):
+        """
+        Drop the least-recently-used entries beyond `max_entries`, plus a chunk
+        of EVICTION_CHUNK_FRACTION more. Caller must hold the lock.
+        """
+        self._write_touches_locked()  # Recent hits must count before choosing what to drop
+        excess = self._count - self.max_entries + int(self.max_entries * EVICTION_CHUNK_FRACTION)
+        evicted = self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (excess,),
+        ).rowcount
+        self._count -= evicted
+        self.evictions += evicted
+        logger.debug(f"Embedding cache evicted {evicted} entries")
+
+    def stats(self) -> dict:
+        """Return hit/miss counters for the current run."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": self._count,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def flush(self):
+        """Write the buffered access times, e.g. before the process exits."""
+        with self._lock:
+            self._write_touches_locked()
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._write_touches_locked()
+            self._conn.commit()
+            self._conn.close()
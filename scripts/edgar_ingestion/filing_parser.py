@@ -0,0 +1,231 @@
+"""
+CPU-bound filing preparation for Phase 2, run in a process pool.
+
+Decompressing and decoding sections, finding chunk boundaries, counting
+tokens and computing MinHash signatures are all pure Python and would contend
+for the GIL with the pipeline's I/O threads. `prepare_filing` does all of it in
+a worker process and returns a compact payload instead of pickled chunk
+strings:
+
+    filing           the filing's metadata fields (no section texts)
+    section_hashes   {section name: hash}, in filing order
+    spans            {section name: array('q') of char start, end, tokens triples}
+                     for new or changed sections only
+    signatures       {section name: array('Q') of MinHash bins, num_bins per chunk}
+    shm_name         shared memory block holding the UTF-8 text of those sections,
+    text_offsets     with each section's (byte start, byte end) in it
+
+The section texts cross the process boundary once, through shared memory,
+rather than through the executor's result pipe (which a single thread drains
+for every worker). The parent copies them out with `take_section_texts`, which
+also unlinks the block.
+
+Filings come from the filing store (see filing_store.py), whose index already
+holds every section's hash, so only the sections that changed since the last
+ingest are read from their shard at all.
+
+A large filing would keep one worker busy while the others sit idle at the end
+of a run, so `prepare_filing_in_parts` splits it into `parts` pool tasks. Each
+task reads and chunks only its share of the changed sections. Shares are
+balanced by section length, and every task computes the same split. Whichever worker is free takes the next task from the
+pool's queue, and the parent merges the results into one payload.
+
+Worker processes are forked so the ingestion script's module-level setup
+(clients, SQLite connections) is not re-run in each of them; the functions here
+must therefore stay free of logging and shared locks.
+"""
+
+import multiprocessing
+import os
+import signal
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+from chunker import iter_chunk_spans, split_span_by_tokens
+from filing_store import read_sections
+from near_duplicates import minhash_signature
+from token_batcher import MAX_INPUT_TOKENS, count_tokens
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (respects affinity masks and container cpusets)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_parse_processes() -> int:
+    """Leave one core for the event loop and I/O threads; 0 means parse in-thread."""
+    return available_cpus() - 1
+
+
+def start_parse_pool(processes: int, model: str) -> ProcessPoolExecutor | None:
+    """
+    Start `processes` forked parse workers, or return None when `processes` is
+    0 (or fork is unavailable) so callers parse in their own thread instead.
+    """
+    if processes <= 0 or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    count_tokens("", model)  # Load the tokenizer once here so the workers inherit it
+    # Workers must share the parent's resource tracker, otherwise each one's
+    # tracker would unlink shared memory blocks the parent has not read yet
+    resource_tracker.ensure_running()
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("fork"),
+                               initializer=_ignore_interrupts)
+    pool.submit(int).result()  # Fork every worker now, before the pipeline starts its threads
+    return pool
+
+
+def _ignore_interrupts():
+    """Ctrl-C reaches the whole process group; workers leave it to the parent, which drains them."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def prepare_filing(
+    header: dict,
+    previous_section_hashes: dict,
+    chunk_size: int,
+    chunk_overlap: int,
+    chunk_unit: str,
+    model: str,
+    signature_bins: int | None = None,
+    shared: bool = True,
+    part: tuple[int, int] = (0, 1),
+) -> dict:
+    """
+    Read and chunk one filing, given its filing store `header` (see
+    `FilingStore.headers`). Sections whose hash matches
+    `previous_section_hashes` are neither read nor chunked. `signature_bins`
+    enables MinHash signatures per chunk. With `shared=False` the section texts
+    are returned as bytes in `text` instead of shared memory. `part` (index,
+    count) reads and chunks only that share of the changed sections.
+    """
+    timings = {}
+    section_hashes = {name: section['hash'] for name, section in header['sections'].items()}
+    changed = [name for name in section_hashes if previous_section_hashes.get(name) != section_hashes[name]]
+    part_index, part_count = part
+    if part_count > 1:
+        sizes = {name: section['raw_bytes'] for name, section in header['sections'].items()}
+        changed = _share_of_sections(changed, sizes, part_index, part_count)
+
+    start = time.perf_counter()
+    sections, bytes_read = read_sections(header, changed)
+    timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    spans = {}
+    signatures = {}
+    text_offsets = {}
+    encoded_texts = []
+    offset = 0
+    for section_name in changed:
+        section_text = sections[section_name]
+        section_spans = array("q")
+        for chunk_start, chunk_end in iter_chunk_spans(section_text, chunk_size, chunk_overlap, chunk_unit, model):
+            tokens = count_tokens(section_text[chunk_start:chunk_end], model)
+            if tokens <= MAX_INPUT_TOKENS:
+                section_spans.extend((chunk_start, chunk_end, tokens))
+                continue
+            # Over the model's input limit - split before IDs are assigned
+            for piece_start, piece_end in split_span_by_tokens(section_text, chunk_start, chunk_end, MAX_INPUT_TOKENS, model):
+                section_spans.extend((piece_start, piece_end, count_tokens(section_text[piece_start:piece_end], model)))
+        spans[section_name] = section_spans
+
+        if signature_bins:
+            section_signatures = array("Q")
+            for i in range(0, len(section_spans), 3):
+                section_signatures.extend(
+                    minhash_signature(section_text[section_spans[i]:section_spans[i + 1]], signature_bins))
+            signatures[section_name] = section_signatures
+
+        encoded = section_text.encode("utf-8")
+        text_offsets[section_name] = (offset, offset + len(encoded))
+        encoded_texts.append(encoded)
+        offset += len(encoded)
+    timings['chunk'] = time.perf_counter() - start
+
+    text = b"".join(encoded_texts)
+    del encoded_texts
+    payload = {
+        'bytes': bytes_read,
+        'content_hash': header['content_hash'],
+        'timings': timings,
+        'filing': header['filing'],
+        'section_hashes': section_hashes,
+        'spans': spans,
+        'signatures': signatures,
+        'text_offsets': text_offsets,
+        'shm_name': None,
+        'text': None,
+    }
+    if not shared:
+        payload['text'] = text
+    elif text:
+        block = shared_memory.SharedMemory(create=True, size=len(text))
+        block.buf[:len(text)] = text
+        payload['shm_name'] = block.name
+        block.close()  # The parent unlinks it once the texts are copied out
+    return payload
+
+
+def take_section_texts(payload: dict) -> dict[str, str]:
+    """Decode the section texts of a `prepare_filing` payload, releasing its shared memory."""
+    offsets = payload['text_offsets']
+    if payload['shm_name'] is None:
+        text = payload['text'] or b""
+        return {name: text[start:end].decode("utf-8") for name, (start, end) in offsets.items()}
+    block = shared_memory.SharedMemory(name=payload['shm_name'])
+    try:
+        return {name: bytes(block.buf[start:end]).decode("utf-8") for name, (start, end) in offsets.items()}
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _share_of_sections(names: list[str], sizes: dict[str, int], part_index: int, part_count: int) -> list[str]:
+    """
+    The sections of `names` that part `part_index` of `part_count` chunks:
+    longest first, each to the least loaded part. Deterministic, so every part
+    computes the same split. Returned in filing order.
+    """
+    loads = [0] * part_count
+    owner = {}
+    for name in sorted(names, key=lambda name: (-sizes[name], names.index(name))):
+        target = loads.index(min(loads))
+        owner[name] = target
+        loads[target] += sizes[name]
+    return [name for name in names if owner[name] == part_index]
+
+
+def prepare_filing_in_parts(pool: ProcessPoolExecutor, args: tuple, parts: int) -> tuple[dict, dict[str, str]]:
+    """
+    Run `prepare_filing(*args)` as `parts` pool tasks and merge their results.
+    Returns the merged payload and its section texts (already taken out of
+    shared memory, so nothing is left to release).
+    """
+    futures = [pool.submit(prepare_filing, *args, part=(index, parts)) for index in range(parts)]
+    payloads, error = [], None
+    for future in futures:
+        try:
+            payloads.append(future.result())
+        except Exception as e:
+            error = error or e
+    # Release every part's shared memory even if another part failed
+    section_texts = {}
+    for payload in payloads:
+        section_texts.update(take_section_texts(payload))
+    if error is not None:
+        raise error
+
+    merged = payloads[0]
+    for payload in payloads[1:]:
+        merged['bytes'] += payload['bytes']
+        merged['spans'].update(payload['spans'])
+        merged['signatures'].update(payload['signatures'])
+        for step, seconds in payload['timings'].items():
+            merged['timings'][step] = merged['timings'].get(step, 0.0) + seconds
+    merged['text_offsets'] = {}
+    merged['shm_name'] = None
+    return merged, section_texts
@@ -0,0 +1,341 @@
+"""
+Sharded, compressed store for fetched filings, indexed by accession number.
+
+One pretty-printed JSON file per filing means a directory listing of tens of
+thousands of entries on every run, files inflated by whitespace, and a full
+parse of each file even when only one section or the header fields are needed.
+`FilingStore` instead appends filings to a few large shards:
+
+    shards/shard-00000.jsonl.zst   JSON lines: per filing a header line (every field
+                                   but the sections, plus the section names), then
+                                   one {"accession_number", "section", "text"} line
+                                   per section
+    index.sqlite3                  accession number -> header fields, content hash,
+                                   and the shard, offset and length of each line
+
+Every line is compressed as its own zstd frame (a gzip member in `.jsonl.gz`
+shards when `zstandard` is not installed), so one filing or one section is read
+with a single seek and decompressed on its own, while a whole shard still
+decompresses to plain JSONL with `zstdcat`. `headers` answers what incremental
+planning needs - which filings exist, their sizes, content hash and per-section
+hashes - from the index alone, without opening a shard.
+
+Shards are append-only and a new one is started at `shard_max_bytes`. Storing
+an accession number again appends the new copy and points the index at it;
+identical content is not written twice. `migrate_directory` imports a directory
+of `{accession_number}.json` files, the layout used before this store.
+
+Forked worker processes must not share the parent's SQLite connection, so
+`read_sections` reads from a shard given only the picklable header returned
+by `headers`.
+"""
+
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from ingestion_manifest import hash_bytes, hash_text
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+FILING_FIELDS = ("company", "cik", "form", "filing_date", "accession_number")
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+_ZSTD_SUFFIX = ".jsonl.zst"
+_GZIP_SUFFIX = ".jsonl.gz"
+
+
+def _decompress(path: str, frame: bytes) -> bytes:
+    if path.endswith(_ZSTD_SUFFIX):
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(frame)
+    return gzip.decompress(frame)
+
+
+def read_sections(header: dict, section_names: list[str]) -> tuple[dict[str, str], int]:
+    """
+    Read the named sections of the filing described by `header` (one entry of
+    `FilingStore.headers`). Returns {section name: text} and the number of
+    compressed bytes read.
+    """
+    texts = {}
+    bytes_read = 0
+    with open(header['shard_path'], "rb") as f:
+        for name in section_names:
+            section = header['sections'][name]
+            f.seek(section['offset'])
+            frame = f.read(section['length'])
+            bytes_read += len(frame)
+            texts[name] = json.loads(_decompress(header['shard_path'], frame))['text']
+    return texts, bytes_read
+
+
+class FilingStore:
+    """Thread-safe append-only filing shards with an accession-number index."""
+
+    def __init__(self, directory: str, shard_max_bytes: int = SHARD_MAX_BYTES, level: int = 3):
+        self.directory = directory
+        self.shard_directory = os.path.join(directory, "shards")
+        os.makedirs(self.shard_directory, exist_ok=True)
+        self.shard_max_bytes = shard_max_bytes
+        if zstandard is not None:
+            self._compress = zstandard.ZstdCompressor(level=level).compress
+            self._suffix = _ZSTD_SUFFIX
+        else:
+            self._compress = lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+            self._suffix = _GZIP_SUFFIX
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_shard = None
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS filings (
+                accession_number TEXT PRIMARY KEY,
+                company TEXT,
+                cik TEXT,
+                form TEXT,
+                filing_date TEXT,
+                shard TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                raw_bytes INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sections (
+                accession_number TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                section TEXT NOT NULL,
+                section_hash TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                raw_bytes INTEGER NOT NULL,
+                PRIMARY KEY (accession_number, section)
+            );
+            """
+        )
+        self._conn.commit()
+
+    # --- Writing ---
+
+    def put(self, filing: dict) -> bool:
+        """
+        Store a filing ({..., "accession_number", "sections": {name: text}}).
+        Returns False if the same content is already stored under its accession number.
+        """
+        accession_number = filing['accession_number']
+        sections = {name: text or "" for name, text in filing.get('sections', {}).items()}
+        header = {key: value for key, value in filing.items() if key != 'sections'}
+        header['sections'] = list(sections)
+        lines = [json.dumps(header).encode("utf-8") + b"\n"] + [
+            json.dumps({"accession_number": accession_number, "section": name, "text": text}).encode("utf-8") + b"\n"
+            for name, text in sections.items()
+        ]
+        content_hash = hash_bytes(b"".join(lines))
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM filings WHERE accession_number = ?",
+                                     (accession_number,)).fetchone()
+        if row is not None and row[0] == content_hash:
+            return False
+        frames = [self._compress(line) for line in lines]
+
+        with self._lock:
+            writer, shard = self._writer_locked()
+            offset = writer.seek(0, os.SEEK_END)
+            writer.write(b"".join(frames))
+            writer.flush()
+            os.fsync(writer.fileno())  # The index must never point at bytes a crash could lose
+
+            section_rows = []
+            position = offset + len(frames[0])
+            for index, (name, text) in enumerate(sections.items()):
+                frame = frames[index + 1]
+                section_rows.append((accession_number, index, name, hash_text(text), position, len(frame),
+                                     len(lines[index + 1])))
+                position += len(frame)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO filings (accession_number, company, cik, form, filing_date, shard, offset, "
+                "length, raw_bytes, content_hash, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    accession_number,
+                    header.get('company'),
+                    str(header['cik']) if header.get('cik') is not None else None,
+                    header.get('form'),
+                    header.get('filing_date'),
+                    shard,
+                    offset,
+                    position - offset,
+                    sum(len(line) for line in lines),
+                    content_hash,
+                    time.time(),
+                ),
+            )
+            self._conn.execute("DELETE FROM sections WHERE accession_number = ?", (accession_number,))
+            self._conn.executemany(
+                "INSERT INTO sections (accession_number, position, section, section_hash, offset, length, raw_bytes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                section_rows,
+            )
+            self._conn.commit()
+        return True
+
+    def _writer_locked(self):
+        """The shard to append to, starting a new one when the current one is full."""
+        if self._writer is not None and self._writer.tell() < self.shard_max_bytes:
+            return self._writer, self._writer_shard
+        shards = self._shard_names()
+        number = len(shards)
+        if self._writer is None and shards and shards[-1].endswith(self._suffix):
+            last_path = os.path.join(self.shard_directory, shards[-1])
+            if os.path.getsize(last_path) < self.shard_max_bytes:
+                number -= 1  # Keep filling the last shard of an earlier run
+        if self._writer is not None:
+            self._writer.close()
+        self._writer_shard = f"shard-{number:05d}{self._suffix}"
+        self._writer = open(os.path.join(self.shard_directory, self._writer_shard), "ab")
+        self._writer.seek(0, os.SEEK_END)
+        return self._writer, self._writer_shard
+
+    def _shard_names(self) -> list[str]:
+        return sorted(name for name in os.listdir(self.shard_directory) if name.startswith("shard-"))
+
+    def migrate_directory(self, directory: str, delete: bool = False) -> dict:
+        """
+        Import every `*.json` filing in `directory`. With `delete`, each file is
+        removed once its filing is stored. Returns counts and `accession_numbers`,
+        mapping every imported file name to its accession number.
+        """
+        stats = {'migrated': 0, 'unchanged': 0, 'failed': 0, 'deleted': 0, 'accession_numbers': {}}
+        with os.scandir(directory) as entries:
+            file_names = sorted(entry.name for entry in entries if entry.is_file() and entry.name.endswith(".json"))
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            try:
+                with open(path, "rb") as f:
+                    filing = json.loads(f.read())
+                filing.setdefault('accession_number', file_name[:-len(".json")])
+                stats['migrated' if self.put(filing) else 'unchanged'] += 1
+            except (OSError, ValueError, AttributeError) as e:
+                logger.error(f"Could not migrate {file_name}: {e}")
+                stats['failed'] += 1
+                continue
+            stats['accession_numbers'][file_name] = filing['accession_number']
+            if delete:
+                os.remove(path)
+                stats['deleted'] += 1
+        return stats
+
+    # --- Reading ---
+
+    def headers(self, accession_numbers: list[str] | None = None) -> dict[str, dict]:
+        """
+        Index entries for the given filings (all when None), read without
+        touching the shards: {accession number: {"filing": header fields,
+        "content_hash", "raw_bytes", "shard_path", "sections": {name: {"hash",
+        "offset", "length", "raw_bytes"}} in filing order}}. Unknown accession
+        numbers are left out.
+        """
+        headers = {}
+        with self._lock:
+            if accession_numbers is None:
+                rows = self._conn.execute(
+                    "SELECT accession_number, company, cik, form, filing_date, shard, raw_bytes, content_hash "
+                    "FROM filings").fetchall()
+                section_rows = self._conn.execute(
+                    "SELECT accession_number, section, section_hash, offset, length, raw_bytes FROM sections "
+                    "ORDER BY accession_number, position").fetchall()
+            else:
+                rows, section_rows = [], []
+                for i in range(0, len(accession_numbers), 500):
+                    batch = accession_numbers[i:i + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows += self._conn.execute(
+                        "SELECT accession_number, company, cik, form, filing_date, shard, raw_bytes, content_hash "
+                        f"FROM filings WHERE accession_number IN ({placeholders})", batch).fetchall()
+                    section_rows += self._conn.execute(
+                        "SELECT accession_number, section, section_hash, offset, length, raw_bytes FROM sections "
+                        f"WHERE accession_number IN ({placeholders}) ORDER BY accession_number, position",
+                        batch).fetchall()
+        for accession_number, company, cik, form, filing_date, shard, raw_bytes, content_hash in rows:
+            values = (company, cik, form, filing_date, accession_number)
+            headers[accession_number] = {
+                'filing': {field: value for field, value in zip(FILING_FIELDS, values) if value is not None},
+                'content_hash': content_hash,
+                'raw_bytes': raw_bytes,
+                'shard_path': os.path.join(self.shard_directory, shard),
+                'sections': {},
+            }
+        for accession_number, section, section_hash, offset, length, raw_bytes in section_rows:
+            headers[accession_number]['sections'][section] = {
+                'hash': section_hash, 'offset': offset, 'length': length, 'raw_bytes': raw_bytes,
+            }
+        return headers
+
+    def accession_numbers(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT accession_number FROM filings ORDER BY accession_number")]
+
+    def get(self, accession_number: str) -> dict | None:
+        """The filing as it was stored, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT shard, offset, length FROM filings WHERE accession_number = ?",
+                                     (accession_number,)).fetchone()
+        header = self.headers([accession_number]).get(accession_number)
+        if row is None or header is None:
+            return None
+        _, offset, length = row
+        # The header line is the filing's first frame, followed directly by its sections
+        header_end = min((section['offset'] for section in header['sections'].values()), default=offset + length)
+        with open(header['shard_path'], "rb") as f:
+            f.seek(offset)
+            frame = f.read(header_end - offset)
+        filing = json.loads(_decompress(header['shard_path'], frame))
+        filing['sections'], _ = read_sections(header, filing['sections'])
+        return filing
+
+    def get_section(self, accession_number: str, section: str) -> str | None:
+        """One section's text, read and decompressed on its own, or None."""
+        header = self.headers([accession_number]).get(accession_number)
+        if header is None or section not in header['sections']:
+            return None
+        return read_sections(header, [section])[0][section]
+
+    def __contains__(self, accession_number: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM filings WHERE accession_number = ?",
+                                      (accession_number,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM filings").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            filings, raw_bytes, stored_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(length), 0) FROM filings").fetchone()
+        shard_bytes = sum(os.path.getsize(os.path.join(self.shard_directory, name)) for name in self._shard_names())
+        return {
+            'filings': filings,
+            'shards': len(self._shard_names()),
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+            'shard_bytes': shard_bytes,  # Includes copies superseded by later puts
+        }
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._conn.close()
@@ -1,388 +1,1331 @@
+"""
+Fetch SEC filings and ingest them into Pinecone (or a local vector store).
+
+    python ingestion_e2e.py fetch --year 2024 --forms 10-K,10-Q   # Phase 1: EDGAR -> filing store
+    python ingestion_e2e.py upsert                                 # Phase 2: filing store -> vector sink
+    python ingestion_e2e.py embed --mode batch                     # Phase 2's embeddings only, into the cache
+    python ingestion_e2e.py status                                 # What is stored, ingested and pending
+    python ingestion_e2e.py bench --files 40                       # benchmark.py against the mock API server
+
+`--dry-run` (fetch, embed, upsert) reports what a command would do without
+writing anything. Importing this module has no side effects: settings are
+read from the environment, but clients and stores are created on first use
+(see lazy.py) and logging is set up by the command line, so tests, the
+benchmark and other tools can import it without credentials or a network.
+Running it as a script loads `.env` first.
+"""
+
 import os
+import sys
 import json
+import re
+import argparse
 import time
 import logging
+import signal
 from datetime import datetime
-from dotenv import load_dotenv
-from edgar import set_identity, get_filings
-from pinecone import Pinecone
-from openai import OpenAI
 from tqdm import tqdm
 import backoff  # For exponential backoff
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading  # For thread-safe operations
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+import numpy as np
+import psutil
+from autotuner import Autotuner
+from chunk_text_store import ChunkTextStore, is_loopback_host, serve_chunk_texts
+from chunker import CHUNKER_VERSION
+from dead_letter_spool import DeadLetterSpool
+from embedders import LocalEmbedder, OpenAIEmbedder
+from embedding_cache import EmbeddingCache, cache_key
+from filing_parser import (default_parse_processes, prepare_filing, prepare_filing_in_parts, start_parse_pool,
+                            take_section_texts)
+from filing_store import FilingStore
+from ingestion_manifest import IngestionManifest
+from ingestion_pipeline import FileJob, IngestionPipeline
+from lazy import Lazy
+from local_vector_store import LocalVectorStore
+from metrics import MetricsExporter, registry, tracer
+from near_duplicates import NearDuplicateIndex
+from partitions import PartitionManifest, Partitioner, namespace_name, summarize_filings
+from rate_limiter import AdaptiveRateLimiter
+from run_journal import RunJournal
+from token_batcher import count_tokens
+from vector_sinks import PineconeSink
+
+if TYPE_CHECKING:
+    from batch_embedder import BatchEmbedder  # Imports openai; loaded by batch mode only
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()  # Before the settings below read the environment; importing the module leaves .env alone
+
+
+class ConfigurationError(RuntimeError):
+    """
+    A setting a command needs is missing or invalid. Raised by check_settings()
+    before a command runs, or when the client or store needing it is first used.
+    """
+
+
+# --- Logging ---
+LOG_DIR = os.environ.get("INGESTION_LOG_DIR", os.path.join(os.path.dirname(__file__), "logs"))
+LOG_LEVEL = os.environ.get("INGESTION_LOG_LEVEL", "INFO")  # DEBUG adds per-batch and per-section lines
+logger = logging.getLogger(__name__)
+
+def setup_logging(log_file: bool = True):
+    """Set up comprehensive logging for the ingestion process: the console, plus a timestamped file with `log_file`."""
+    handlers = [logging.StreamHandler()]  # Also log to console
+    if log_file:
+        # Create logs directory if it doesn't exist
+        os.makedirs(LOG_DIR, exist_ok=True)
+        # Create log filename with timestamp
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_file = os.path.join(LOG_DIR, f"edgar_ingestion_{timestamp}.log")
+        handlers.insert(0, logging.FileHandler(log_file))
 
-# --- Setup Logging ---
-def setup_logging():
-    """Set up comprehensive logging for the ingestion process."""
-    # Create logs directory if it doesn't exist
-    logs_dir = os.path.join(os.path.dirname(__file__), "logs")
-    os.makedirs(logs_dir, exist_ok=True)
-    
-    # Create log filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = os.path.join(logs_dir, f"edgar_ingestion_{timestamp}.log")
-    
     # Configure logging
     logging.basicConfig(
-        level=logging.INFO,
+        level=LOG_LEVEL,
         format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()  # Also log to console
-        ]
+        handlers=handlers,
     )
-    
-    logger = logging.getLogger(__name__)
+
     logger.info(f"=== Edgar Ingestion Process Started ===")
-    logger.info(f"Log file: {log_file}")
+    if log_file:
+        logger.info(f"Log file: {log_file}")
     return logger
 
-# Initialize logger
-logger = setup_logging()
-
 # --- Setup ---
-# Load environment variables from the root .env file
-load_dotenv()
-logger.info("Environment variables loaded")
+# Persistent state (caches, manifest, checkpoints). Overridable so benchmarks can use a scratch directory.
+CACHE_DIR = os.environ.get("INGESTION_CACHE_DIR", os.path.join(os.path.dirname(__file__), "cache"))
 
-# Set your identity for SEC EDGAR
-try:
-    set_identity(os.environ["EDGAR_IDENTITY"])
-    logger.info(f"SEC EDGAR identity set successfully")
-except KeyError:
-    logger.error("EDGAR_IDENTITY environment variable not set. Please set it in your .env file.")
-    exit(1)
+# Your identity for SEC EDGAR - only needed to fetch
+EDGAR_IDENTITY = os.environ.get("EDGAR_IDENTITY")
 
-# Pinecone setup
+# Vector sink - Pinecone, or a local memory-mapped store for offline runs and benchmarks
+VECTOR_SINK = os.environ.get("VECTOR_SINK", "pinecone")  # "pinecone" or "local"
+LOCAL_VECTOR_STORE_DIR = os.path.join(CACHE_DIR, "local_vectors")
+LOCAL_VECTOR_DTYPE = "float16"  # "float32", "float16", "int8" or "binary"
+LOCAL_VECTOR_INDEX_DIMENSION = None  # Search on only the leading dimensions (None = all)
+LOCAL_VECTOR_RERANK = False  # Keep full-precision copies and re-rank the best matches with them
+LOCAL_VECTOR_IVF_MIN_VECTORS = 20_000  # Below this an exact scan is fast enough
+LOCAL_VECTOR_IVF_REBUILD_FRACTION = 0.25  # New rows are added to the IVF lists; retrained past this fraction (or `build-index`)
+PINECONE_BATCH_SIZE = 100  # Reduced from 500 - more reliable for Pinecone
 PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME")
-if not PINECONE_API_KEY:
-    logger.error("PINECONE_API_KEY environment variable not set.")
-    exit(1)
-if not PINECONE_INDEX_NAME:
-    logger.error("PINECONE_INDEX_NAME environment variable not set.")
-    exit(1)
-
-logger.info(f"Connecting to Pinecone index: {PINECONE_INDEX_NAME}")
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(PINECONE_INDEX_NAME)
-logger.info("Pinecone connection established")
-
-# OpenAI setup
+PINECONE_INDEX_HOST = os.environ.get("PINECONE_INDEX_HOST")  # Skips the control-plane lookup when set
+# gRPC sends vector values as packed binary floats instead of JSON text; "0" falls back to REST
+PINECONE_GRPC = os.environ.get("PINECONE_GRPC", "1") != "0"
+# Pinecone rejects requests over 2MB: ~250 vectors as packed gRPC floats, far fewer as REST JSON
+UPSERT_BATCH_SIZE_MAX = 1000 if VECTOR_SINK == "local" else 250 if PINECONE_GRPC else PINECONE_BATCH_SIZE
+
+def new_vector_sink():
+    """The configured sink. For Pinecone this connects to the index (a control-plane lookup unless its host is set)."""
+    check_settings()
+    if VECTOR_SINK == "local":
+        sink = LocalVectorStore(LOCAL_VECTOR_STORE_DIR, dtype=LOCAL_VECTOR_DTYPE,
+                                index_dimension=LOCAL_VECTOR_INDEX_DIMENSION, rerank=LOCAL_VECTOR_RERANK)
+        logger.info(f"Writing vectors to local store: {LOCAL_VECTOR_STORE_DIR} ({sink.dtype}"
+                    f"{', re-ranked' if sink.rerank else ''})")
+        return sink
+    if not PINECONE_API_KEY:
+        raise ConfigurationError("PINECONE_API_KEY environment variable not set.")
+    if not PINECONE_INDEX_NAME:
+        raise ConfigurationError("PINECONE_INDEX_NAME environment variable not set.")
+    from pinecone import Pinecone
+
+    logger.info(f"Connecting to Pinecone index: {PINECONE_INDEX_NAME} ({'gRPC' if PINECONE_GRPC else 'REST'})")
+    # Half the pool is kept alive between requests: enough for every upsert worker the autotuner may run,
+    # so none of them reconnects per batch
+    pc = Pinecone(api_key=PINECONE_API_KEY, connection_pool_maxsize=2 * UPSERT_CONCURRENCY_MAX)
+    pinecone_index = pc.index(name=PINECONE_INDEX_NAME, host=PINECONE_INDEX_HOST or "", grpc=PINECONE_GRPC)
+    logger.info("Pinecone connection established")
+    return PineconeSink(pinecone_index, batch_size=PINECONE_BATCH_SIZE)
+
+vector_sink = Lazy(new_vector_sink)
+
+# Embedding backend - the OpenAI API, or a local CPU model for air-gapped, quota-free runs (see embedders.py)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "openai")  # "openai" or "local"
+# Shortened embeddings (text-embedding-3 `dimensions` parameter), e.g. 512 or 256; None = full 1536.
+# The query side must request the same size (EMBEDDING_DIMENSIONS in the Supabase function).
+EMBEDDING_DIMENSIONS = int(os.environ["EMBEDDING_DIMENSIONS"]) if os.environ.get("EMBEDDING_DIMENSIONS") else None
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.error("OPENAI_API_KEY environment variable not set.")
-    exit(1)
-client = OpenAI(api_key=OPENAI_API_KEY)
-EMBEDDING_MODEL = "text-embedding-3-small"
-logger.info(f"OpenAI client initialized with model: {EMBEDDING_MODEL}")
-
-# Local data storage
-FILINGS_DATA_DIR = os.path.join(os.path.dirname(__file__), "filings_data")
-os.makedirs(FILINGS_DATA_DIR, exist_ok=True)
-logger.info(f"Filings data directory: {FILINGS_DATA_DIR}")
+
+def new_openai_client():
+    """One client for every embedding thread and the Batch API, sharing its connection pool."""
+    if not OPENAI_API_KEY:
+        raise ConfigurationError("OPENAI_API_KEY environment variable not set.")
+    from openai import OpenAI
+
+    return OpenAI(api_key=OPENAI_API_KEY, max_retries=0)  # Retries are handled by our limiter + backoff
+
+openai_client = Lazy(new_openai_client)
+
+if EMBEDDING_BACKEND == "openai":
+    # "base64" decodes each response straight into a float32 block; "float" has the SDK build Python lists (slower)
+    EMBEDDING_ENCODING = os.environ.get("EMBEDDING_ENCODING", "base64")
+    embedder = OpenAIEmbedder(openai_client, "text-embedding-3-small", EMBEDDING_DIMENSIONS, EMBEDDING_ENCODING,
+                              on_headers=lambda headers: openai_rate_limiter.update_from_headers(headers))
+elif EMBEDDING_BACKEND == "local":
+    # A model directory (ONNX: the .onnx file plus tokenizer.json) or, for sentence-transformers, a Hub name
+    LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    LOCAL_EMBEDDING_RUNTIME = os.environ.get("LOCAL_EMBEDDING_RUNTIME", "onnx")  # "onnx" or "sentence-transformers"
+    LOCAL_EMBEDDING_ONNX_FILE = os.environ.get("LOCAL_EMBEDDING_ONNX_FILE", "model.onnx")  # e.g. onnx/model_qint8_avx512.onnx
+    LOCAL_EMBEDDING_THREADS = int(os.environ["LOCAL_EMBEDDING_THREADS"]) if os.environ.get("LOCAL_EMBEDDING_THREADS") else None  # Per process; None = all cores
+    LOCAL_EMBEDDING_PROCESSES = int(os.environ.get("LOCAL_EMBEDDING_PROCESSES", "0"))  # 0 = infer in this process
+    LOCAL_EMBEDDING_BATCH_TOKENS = 16_384  # Padded tokens per inference batch; texts are bucketed by length
+    # Chunks are sized to this fraction of the model's max_seq_length (tiktoken tokens), leaving room for the
+    # [CLS]/[SEP] tokens and for its WordPiece tokenizer splitting text finer than tiktoken does
+    LOCAL_EMBEDDING_CHUNK_FRACTION = 0.8
+    # The model itself is loaded by the first embedding request (or by start(), in each worker process)
+    embedder = LocalEmbedder(LOCAL_EMBEDDING_MODEL, LOCAL_EMBEDDING_RUNTIME, LOCAL_EMBEDDING_ONNX_FILE,
+                             threads=LOCAL_EMBEDDING_THREADS, processes=LOCAL_EMBEDDING_PROCESSES,
+                             batch_token_budget=LOCAL_EMBEDDING_BATCH_TOKENS, dimensions=EMBEDDING_DIMENSIONS)
+else:
+    embedder = None  # Reported by check_settings() before any command uses it
+EMBEDDING_MODEL = embedder.model if embedder is not None else EMBEDDING_BACKEND
+EMBEDDING_SPACE = embedder.space if embedder is not None else EMBEDDING_BACKEND  # Keys the embedding cache and is recorded with every vector
+
+def check_settings():
+    """Raise ConfigurationError for settings no command can run with, rather than failing at import."""
+    if VECTOR_SINK not in ("pinecone", "local"):
+        raise ConfigurationError(f"Unknown VECTOR_SINK: {VECTOR_SINK!r} (expected 'pinecone' or 'local')")
+    if embedder is None:
+        raise ConfigurationError(f"Unknown EMBEDDING_BACKEND: {EMBEDDING_BACKEND!r} (expected 'openai' or 'local')")
+    if EMBEDDING_BACKEND == "local" and embedder.missing_files():
+        raise ConfigurationError(
+            f"LOCAL_EMBEDDING_MODEL={LOCAL_EMBEDDING_MODEL!r} is not an ONNX model directory (missing "
+            f"{', '.join(embedder.missing_files())}); point it at one, or set "
+            f"LOCAL_EMBEDDING_RUNTIME=sentence-transformers to load a Hub model")
+
+# Local data storage - fetched filings live in compressed shards with an accession-number index (see filing_store.py)
+FILINGS_DATA_DIR = os.environ.get("FILINGS_DATA_DIR", os.path.join(os.path.dirname(__file__), "filings_data"))
+FILING_STORE_SHARD_MAX_BYTES = 256 * 1024 * 1024
+filing_store = Lazy(lambda: FilingStore(FILINGS_DATA_DIR, shard_max_bytes=FILING_STORE_SHARD_MAX_BYTES))
+FETCH_CHECKPOINT_PATH = os.path.join(CACHE_DIR, "fetch_checkpoint.jsonl")
 
 # Rate limiting configuration - OPTIMIZED FOR SPEED
-SEC_DELAY = 1.0  # Increased from 0.3 to be more conservative with SEC
-OPENAI_DELAY = 0.1  # Small delay between OpenAI requests
-OPENAI_BATCH_DELAY = 0.1 # Shorter delay between batches
-MAX_CONCURRENT_FILES = 10  # Number of files to process concurrently
-EMBEDDING_BATCH_SIZE = 20  # Reduced from 100 - more reliable for OpenAI API
-PINECONE_BATCH_SIZE = 100  # Reduced from 500 - more reliable for Pinecone
-logger.info(f"Rate limiting configured - SEC: {SEC_DELAY}s, OpenAI: {OPENAI_DELAY}s, Batch: {OPENAI_BATCH_DELAY}s")
-logger.info(f"Concurrent processing enabled - Max files: {MAX_CONCURRENT_FILES}")
-logger.info(f"🚀 SPEED OPTIMIZED - Embedding batch: {EMBEDDING_BATCH_SIZE}, Pinecone batch: {PINECONE_BATCH_SIZE}")
+SEC_REQUESTS_PER_SECOND = 8  # Shared across all fetch workers - SEC fair access allows 10/s
+FETCH_WORKERS = 8  # Filings downloaded and parsed concurrently in Phase 1
+OPENAI_REQUESTS_PER_MINUTE = 3000  # Starting limits - corrected from OpenAI's rate-limit headers
+OPENAI_TOKENS_PER_MINUTE = 1_000_000
+MAX_CONCURRENT_FILES = 10  # Number of files loaded (read + parsed) concurrently - raised to PARSE_PROCESSES if lower
+PARSE_PROCESSES = None  # Processes parsing and chunking filings; None = available cores - 1, 0 = in the load threads
+CHUNK_CONCURRENCY = 2  # Files being chunked concurrently
+EMBEDDING_CONCURRENCY = 8  # Embedding requests in flight
+UPSERT_CONCURRENCY = 4  # Pinecone upserts in flight
+UPSERT_MAX_TRIES = 5  # Per batch, with exponential backoff, before the batch is spooled
+UPSERT_MAX_RETRY_SECONDS = 120
+PIPELINE_QUEUE_SIZE = 32  # Max items waiting between pipeline stages
+EMBEDDING_BATCH_SIZE = 256  # Max chunks per embedding request - the token budget usually binds first
+EMBEDDING_BATCH_TOKEN_BUDGET = 60_000  # Max tokens per embedding request, packed across sections and files
 
-# Memory optimization
-import gc
-import psutil
+# Autotuning - embedding and upsert batch sizes and requests in flight follow observed latency, throttling
+# and errors (see autotuner.py); the values above are starting points and the final ones are kept for the next run
+AUTOTUNE = True
+AUTOTUNE_INTERVAL_SECONDS = 5.0
+AUTOTUNE_STATE_PATH = os.path.join(CACHE_DIR, f"autotune_{VECTOR_SINK}_{EMBEDDING_BACKEND}.json")
+EMBEDDING_CONCURRENCY_MAX = 32
+UPSERT_CONCURRENCY_MAX = 16
+EMBEDDING_BATCH_TOKEN_BUDGET_MAX = 250_000  # OpenAI allows 300K tokens per request
+autotuner = None  # Created by process_and_upsert_filings
+
+# Dead-letter spool - batches that fail every upsert retry are kept here and replayed next run
+DEAD_LETTER_PATH = os.path.join(CACHE_DIR, "dead_letter", f"upserts_{VECTOR_SINK}.jsonl")
+dead_letter_spool = Lazy(lambda: DeadLetterSpool(DEAD_LETTER_PATH))
+
+# Parse pool - forked processes that read, parse and chunk filings (see filing_parser.py)
+parse_pool = None  # Started by process_and_upsert_filings, sized by PARSE_PROCESSES
+parse_pool_processes = 0
+PARSE_SPLIT_BYTES = 500_000  # Filings larger than this are chunked by several parse processes at once (None = never)
+SCHEDULE_LARGEST_FIRST = True  # Load filings in descending size order, so no large one is left for the end
+
+# Embedding cache - skips chunks already embedded with the same model on earlier runs
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = 500_000  # LRU-evicted beyond this (~3KB per 1536-dim vector)
+embedding_cache = Lazy(lambda: EmbeddingCache(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES))
+
+# Batch mode (--mode batch) - embeds through the OpenAI Batch API into the embedding cache, then ingests
+BATCH_DIR = os.path.join(CACHE_DIR, "batch")  # Request files and the job checkpoint
+BATCH_POLL_SECONDS = 60
+BATCH_ROUND_MAX_CHUNKS = EMBEDDING_CACHE_MAX_ENTRIES // 2  # Per round, so results are upserted before LRU eviction
+
+# Near-duplicate detection - reuse the embedding of an almost identical chunk seen before
+NEAR_DUPLICATE_DETECTION = True
+NEAR_DUPLICATE_THRESHOLD = 0.9  # Estimated Jaccard similarity of word 5-grams
+# Matches point at cache entries, so each embedding model and size gets its own index
+if EMBEDDING_BACKEND == "openai":
+    NEAR_DUPLICATE_INDEX_PATH = os.path.join(
+        CACHE_DIR, f"near_duplicates_{EMBEDDING_DIMENSIONS}.sqlite3" if EMBEDDING_DIMENSIONS else "near_duplicates.sqlite3")
+else:
+    NEAR_DUPLICATE_INDEX_PATH = os.path.join(
+        CACHE_DIR, f"near_duplicates_{re.sub(r'[^A-Za-z0-9_.@-]+', '_', EMBEDDING_SPACE)}.sqlite3")
+near_duplicate_index = (
+    Lazy(lambda: NearDuplicateIndex(NEAR_DUPLICATE_INDEX_PATH, threshold=NEAR_DUPLICATE_THRESHOLD))
+    if NEAR_DUPLICATE_DETECTION else None
+)
+
+# External chunk-text store - keeps full chunk text out of Pinecone metadata
+CHUNK_TEXT_STORE_ENABLED = False  # Requires the query function to look texts up (see README)
+CHUNK_TEXT_STORE_DIR = os.path.join(CACHE_DIR, "chunk_texts")
+TEXT_PREVIEW_CHARS = 300  # Preview kept in metadata when the text store is enabled
+chunk_text_store = Lazy(lambda: ChunkTextStore(CHUNK_TEXT_STORE_DIR)) if CHUNK_TEXT_STORE_ENABLED else None
+
+# Chunking parameters - recorded in the manifest so a change forces re-ingestion
+CHUNK_UNIT = "words"  # "words" or "tokens" - unit for CHUNK_SIZE and CHUNK_OVERLAP
+CHUNK_SIZE = 1000  # Max words (or tokens) per chunk, snapped to sentence/paragraph ends
+CHUNK_OVERLAP = 100  # Roughly this many words (or tokens) of whole sentences shared between chunks
+if EMBEDDING_BACKEND == "local":
+    # Local models read at most max_seq_length tokens (often 256) and silently drop the rest, which would lose
+    # most of a 1000-word chunk, so chunks are sized in tokens to fit
+    CHUNK_UNIT = "tokens"
+    CHUNK_SIZE = int(embedder.max_seq_length * LOCAL_EMBEDDING_CHUNK_FRACTION)
+    CHUNK_OVERLAP = CHUNK_SIZE // 10
+CHUNK_PARAMS = {
+    "chunker": CHUNKER_VERSION,
+    "unit": CHUNK_UNIT,
+    "chunk_size": CHUNK_SIZE,
+    "overlap": CHUNK_OVERLAP,
+    "model": EMBEDDING_MODEL,
+    "text_store": CHUNK_TEXT_STORE_ENABLED,  # Metadata layout differs, so switching re-upserts
+}
+if EMBEDDING_DIMENSIONS:
+    CHUNK_PARAMS["dimensions"] = EMBEDDING_DIMENSIONS  # Vectors of another size must all be replaced
+
+# Ingestion manifest - lets re-runs skip unchanged filings/sections and clean up stale vectors.
+# Each sink gets its own, so switching sinks never skips filings the other one has not seen.
+MANIFEST_PATH = (
+    os.path.join(LOCAL_VECTOR_STORE_DIR, "ingestion_manifest.sqlite3") if VECTOR_SINK == "local"
+    else os.path.join(CACHE_DIR, "ingestion_manifest.sqlite3")
+)
+manifest = Lazy(lambda: IngestionManifest(MANIFEST_PATH))
+
+# Partitions - each filing's vectors go to the namespace of its partition (see partitions.py), so the
+# query side can search only the partitions a question can match. Changing the scheme builds the new
+# partitions beside the live ones; queries switch to them once every filing is in them.
+PARTITION_SCHEME = os.environ.get("PARTITION_SCHEME", "none")  # "none", "form", "year", "form_year" or "cik_range"
+PARTITION_CIK_RANGE_SIZE = 100_000  # CIKs per partition with "cik_range"
+PARTITION_RETIRE_GRACE_SECONDS = 15 * 60  # Replaced namespaces are deleted by the first run this long after the switch
+PARTITION_MANIFEST_PATH = os.path.join(os.path.dirname(MANIFEST_PATH), "partitions.sqlite3")
+PARTITION_EXPORT_PATH = os.path.join(os.path.dirname(MANIFEST_PATH), "partitions.json")  # Publish for PARTITION_MANIFEST_URL
+partition_manifest = Lazy(lambda: PartitionManifest(PARTITION_MANIFEST_PATH))
+
+# Run journal - per-file and per-upsert-batch progress of the current run, for --resume
+RUN_JOURNAL_PATH = os.path.join(os.path.dirname(MANIFEST_PATH), "run_journal.sqlite3")
+run_journal = Lazy(lambda: RunJournal(RUN_JOURNAL_PATH))
+current_run_id = None  # Set while process_and_upsert_filings runs
+written_vector_ids = {}  # (file name, content hash) -> vector IDs an interrupted run already wrote
+
+# Metrics and tracing - per-stage timings, queue depths and retries (see metrics.py)
+METRICS_PATH = os.environ.get("INGESTION_METRICS_PATH", os.path.join(LOG_DIR, "metrics.prom"))  # .prom or .jsonl
+METRICS_EXPORT_INTERVAL = 15  # Seconds between metric file writes during a run
+TRACE_PATH = os.environ.get("INGESTION_TRACE_PATH")  # Per-filing spans as JSON lines; unset disables tracing
 
-# Thread-safe counters and locks - REMOVED PINECONE LOCK FOR SPEED
-embedding_request_lock = threading.Lock()
-# pinecone_upsert_lock = threading.Lock()  # REMOVED - Pinecone can handle concurrent upserts
-stats_lock = threading.Lock()
+# Shared OpenAI limiter - every embedding worker waits here instead of on fixed sleeps
+openai_rate_limiter = AdaptiveRateLimiter(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE)
 
-def log_memory_usage(thread_id: str, context: str):
-    """Log memory usage for performance monitoring"""
+def log_settings():
+    """Log the configuration a Phase 2 command runs with."""
+    logger.info(f"Vector sink: {VECTOR_SINK}" + (f" ({LOCAL_VECTOR_STORE_DIR})" if VECTOR_SINK == "local" else
+                                                 f" (index {PINECONE_INDEX_NAME}, {'gRPC' if PINECONE_GRPC else 'REST'})"))
+    logger.info(f"Embedding with {EMBEDDING_BACKEND} model: {EMBEDDING_SPACE}")
+    if not embedder.remote and (CHUNK_UNIT != "tokens" or CHUNK_SIZE > embedder.max_seq_length):
+        logger.warning(f"Chunks of up to {CHUNK_SIZE} {CHUNK_UNIT} exceed what {EMBEDDING_MODEL} reads "
+                       f"({embedder.max_seq_length} tokens): the rest of each chunk is left out of its embedding")
+    logger.info(f"Filing store: {FILINGS_DATA_DIR} ({filing_store.stats()['filings']} filings)")
+    logger.info(f"Rate limiting configured - SEC: {SEC_REQUESTS_PER_SECOND} req/s, OpenAI: {OPENAI_REQUESTS_PER_MINUTE} RPM / {OPENAI_TOKENS_PER_MINUTE} TPM")
+    logger.info(f"Pipeline concurrency - Load: {MAX_CONCURRENT_FILES}, Chunk: {CHUNK_CONCURRENCY}, "
+                f"Embed: {EMBEDDING_CONCURRENCY}, Upsert: {UPSERT_CONCURRENCY}")
+    logger.info(f"🚀 SPEED OPTIMIZED - Embedding batch: {EMBEDDING_BATCH_SIZE} chunks / {EMBEDDING_BATCH_TOKEN_BUDGET} tokens, Pinecone batch: {PINECONE_BATCH_SIZE}")
+    logger.info(f"Embedding cache: {EMBEDDING_CACHE_PATH} (max {EMBEDDING_CACHE_MAX_ENTRIES} entries)")
+    logger.info(f"Near-duplicate detection: {'enabled' if NEAR_DUPLICATE_DETECTION else 'disabled'} (threshold {NEAR_DUPLICATE_THRESHOLD})")
+    logger.info(f"Chunk text store: {CHUNK_TEXT_STORE_DIR if CHUNK_TEXT_STORE_ENABLED else 'disabled (full text in metadata)'}")
+    logger.info(f"Ingestion manifest: {MANIFEST_PATH}")
+    logger.info(f"Metrics: {METRICS_PATH}, traces: {TRACE_PATH or 'disabled'}")
+
+def open_clients(sink: bool = True):
+    """
+    Create the embedding client and, with `sink`, connect to the vector sink
+    now rather than on first use, so a missing key or an unreachable index
+    stops a command before any work is done.
+    """
+    check_settings()
+    if embedder.remote:
+        openai_client.get()
+    if sink:
+        vector_sink.get()
+
+def close_clients():
+    """
+    Stop local embedding workers, and close the vector sink and flush the
+    embedding cache and near-duplicate index if this process opened them.
+    """
+    embedder.close()
+    if vector_sink.created:
+        vector_sink.close()
+    if embedding_cache.created:
+        embedding_cache.flush()  # Access times of recent hits, which later evictions go by
+    if near_duplicate_index is not None and near_duplicate_index.created:
+        near_duplicate_index.flush()  # Chunks registered since the last batch was committed
+
+@contextmanager
+def exporting_telemetry():
+    """Write metrics to METRICS_PATH every METRICS_EXPORT_INTERVAL seconds, and spans to TRACE_PATH, while the block runs."""
+    tracer.configure(TRACE_PATH)
+    metrics_exporter = MetricsExporter(METRICS_PATH, METRICS_EXPORT_INTERVAL).start()
+    try:
+        yield
+    finally:
+        metrics_exporter.stop()
+        tracer.close()
+
+
+peak_memory_mb = 0.0
+
+def log_memory_usage(thread_id: str, context: str) -> float:
+    """Log memory usage for performance monitoring and track the run's peak RSS"""
+    global peak_memory_mb
     process = psutil.Process(os.getpid())
     memory_mb = process.memory_info().rss / 1024 / 1024
+    peak_memory_mb = max(peak_memory_mb, memory_mb)  # Races only lose a sample, never corrupt
     logger.debug(f"[{thread_id}] {context} - Memory: {memory_mb:.1f}MB")
+    return memory_mb
+
+def count_retry(api: str):
+    """backoff on_backoff handler that counts retries per API."""
+    def on_backoff(details):
+        registry.inc("retries_total", api=api)
+    return on_backoff
+
+def observe_request(kind: str, start_time: float, items: int, outcome: str = "ok"):
+    """Report one embedding or upsert request to the autotuner, if it is running."""
+    if autotuner is not None:
+        autotuner.observe(kind, time.perf_counter() - start_time, items, outcome)
+
+# --- Embedding requests (rate-limited when they go to OpenAI) ---
+def is_retryable_embedding_error(e: Exception) -> bool:
+    """OpenAI rate limit, connection and 5xx errors. openai is only imported once a remote request has failed."""
+    if not embedder.remote:
+        return False
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
 
-# --- Rate-limited OpenAI embedding function ---
-@backoff.on_exception(backoff.expo, Exception, max_tries=3)
-def get_embeddings_with_retry(chunks):
+    return isinstance(e, (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError))
+
+@backoff.on_exception(backoff.expo, Exception, max_tries=5, giveup=lambda e: not is_retryable_embedding_error(e),
+                      on_backoff=count_retry("openai"))
+def request_embeddings(chunks) -> np.ndarray:
     """
-    Get embeddings with exponential backoff retry on rate limit errors.
-    Thread-safe with rate limiting.
+    Embed chunks with the configured backend. OpenAI requests are throttled by
+    the shared adaptive rate limiter and retried with exponential backoff on
+    rate limit, connection and 5xx errors only; local inference is neither.
     """
-    with embedding_request_lock:  # Serialize embedding requests to avoid rate limits
+    if not embedder.remote:
+        start_time = time.perf_counter()
         try:
-            thread_id = threading.current_thread().name
-            logger.info(f"[{thread_id}] 🔄 Requesting embeddings for {len(chunks)} chunks")
-            start_time = time.time()
-            response = client.embeddings.create(input=chunks, model=EMBEDDING_MODEL)
-            embeddings = [item.embedding for item in response.data]
-            elapsed_time = time.time() - start_time
-            logger.info(f"[{thread_id}] ✅ Embeddings received in {elapsed_time:.2f}s ({len(embeddings)} vectors)")
-            time.sleep(OPENAI_DELAY)  # Rate limit delay inside the lock
-            return embeddings
-        except Exception as e:
-            if "rate_limit" in str(e).lower() or "429" in str(e):
-                logger.warning(f"[{thread_id}] ⚠️ Rate limit hit: {str(e)}")
-                time.sleep(5)  # Additional delay for rate limits
-            else:
-                logger.error(f"[{thread_id}] ❌ Error getting embeddings: {str(e)}")
-            raise e
+            with registry.timer("local_embedding_seconds"):
+                embeddings = embedder.embed(chunks)
+        except Exception:
+            observe_request("embed", start_time, len(chunks), "error")
+            raise
+        observe_request("embed", start_time, len(chunks))
+        registry.inc("local_embedding_texts_total", len(chunks))
+        return embeddings
 
-# --- Phase 2: Process Local Files and Upsert to Pinecone ---
+    from openai import RateLimitError  # Loaded for the client anyway
 
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> list[str]:
-    """
-    Splits text into overlapping chunks based on word count.
-    OPTIMIZED for speed with minimal string operations.
-    """
-    if not text:
-        return []
-    words = text.split()
-    if not words:
-        return []
-    
-    chunks = []
-    
-    start = 0
-    step = chunk_size - overlap
-    while start < len(words):
-        end = min(start + chunk_size, len(words))
-        # Use slice and join in one operation for speed
-        chunks.append(" ".join(words[start:end]))
-        if end >= len(words):
-            break
-        start += step
-    
-    return chunks
+    thread_id = threading.current_thread().name
+    token_count = sum(count_tokens(chunk, EMBEDDING_MODEL) for chunk in chunks)
+    with registry.timer("openai_rate_limiter_wait_seconds"):
+        openai_rate_limiter.acquire(token_count)
+    start_time = time.perf_counter()
+    try:
+        logger.debug(f"[{thread_id}] Requesting embeddings for {len(chunks)} chunks")
+        embeddings = embedder.embed(chunks)  # Feeds the response headers to the limiter
+        elapsed_time = time.perf_counter() - start_time
+        registry.observe("openai_request_seconds", elapsed_time, status="ok")
+        registry.inc("openai_requests_total", status="ok")
+        registry.inc("openai_tokens_total", token_count)
+        observe_request("embed", start_time, len(chunks))
+        logger.debug(f"[{thread_id}] Embeddings received in {elapsed_time:.2f}s ({len(embeddings)} vectors)")
+        return embeddings
+    except RateLimitError as e:
+        registry.observe("openai_request_seconds", time.perf_counter() - start_time, status="rate_limited")
+        registry.inc("openai_requests_total", status="rate_limited")
+        observe_request("embed", start_time, len(chunks), "throttled")
+        logger.warning(f"[{thread_id}] ⚠️ Rate limit hit: {str(e)}")
+        openai_rate_limiter.on_rate_limited(e.response.headers if e.response is not None else None)
+        raise e
+    except Exception as e:
+        registry.observe("openai_request_seconds", time.perf_counter() - start_time, status="error")
+        registry.inc("openai_requests_total", status="error")
+        observe_request("embed", start_time, len(chunks), "error")
+        logger.error(f"[{thread_id}] ❌ Error getting embeddings: {str(e)}")
+        raise e
 
-def process_single_filing(file_path: str, file_name: str, file_index: int, total_files: int) -> dict:
+def get_embeddings_with_retry(chunks) -> np.ndarray:
     """
-    Process a single filing file and upsert its vectors to Pinecone.
-    Returns statistics about the processing.
+    Get embeddings for chunks, serving what we can from the local embedding cache.
+    Only cache misses are embedded; their results are written back to the cache.
+    Returns one float32 row per chunk, in order.
     """
-    thread_id = threading.current_thread().name
-    file_start_time = time.time()
-    
-    # Initialize stats for this file
-    stats = {
+    embeddings = embedding_cache.get_many(EMBEDDING_SPACE, chunks)
+    miss_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    registry.inc("embedding_cache_lookups_total", len(chunks) - len(miss_indices), result="hit")
+    registry.inc("embedding_cache_lookups_total", len(miss_indices), result="miss")
+    if not miss_indices:
+        logger.debug(f"[{threading.current_thread().name}] 💾 All {len(chunks)} embeddings served from cache")
+        return np.stack(embeddings)
+    if len(miss_indices) == len(chunks):
+        fresh_embeddings = request_embeddings(chunks)
+        embedding_cache.put_many(EMBEDDING_SPACE, chunks, fresh_embeddings)
+        return fresh_embeddings
+
+    miss_chunks = [chunks[i] for i in miss_indices]
+    fresh_embeddings = request_embeddings(miss_chunks)
+    embedding_cache.put_many(EMBEDDING_SPACE, miss_chunks, fresh_embeddings)
+    block = np.empty((len(chunks), fresh_embeddings.shape[1]), dtype=np.float32)
+    block[miss_indices] = fresh_embeddings
+    for i, embedding in enumerate(embeddings):
+        if embedding is not None:
+            block[i] = embedding
+    return block
+
+# --- Phase 2: Process Local Files and Upsert to the Vector Sink ---
+
+def new_file_stats(file_name: str) -> dict:
+    return {
         'file_name': file_name,
+        'company': None,
         'success': False,
+        'skipped': False,
+        'interrupted': False,
         'vectors_upserted': 0,
+        'vectors_unwritten': 0,  # Spooled instead; the filing is finished by the run that replays them
+        'vectors_deleted': 0,
         'chunks_processed': 0,
+        'chunks_deduplicated': 0,
+        'chunks_resumed': 0,
         'sections_processed': 0,
+        'sections_skipped': 0,
         'embedding_requests': 0,
         'processing_time': 0,
+        'namespace': "",
         'error': None
     }
-    
-    logger.info(f"[{thread_id}] === Starting file {file_index}/{total_files}: {file_name} ===")
-    
-    try:
-        with open(file_path, "r") as f:
-            filing_data = json.load(f)
-
-        company = filing_data.get("company", "Unknown")
-        accession_number = filing_data.get("accession_number", "Unknown")
-        logger.info(f"[{thread_id}] Processing {company} (Accession: {accession_number})")
-
-        vectors_to_upsert = []
-        chunk_id_counter = 0
-
-        # STEP 1: Collect ALL chunks from ALL sections first
-        all_chunks_with_metadata = []
-        
-        logger.info(f"[{thread_id}] 📊 Collecting chunks from all sections...")
-        for section_name, section_text in filing_data.get("sections", {}).items():
-            chunks = chunk_text(section_text)
-            if not chunks:
-                logger.debug(f"[{thread_id}] No chunks generated for section: {section_name}")
+
+def plan_namespaces(headers: dict, register: bool = True) -> dict[str, str]:
+    """
+    The namespace each filing's vectors are written to: its PARTITION_SCHEME
+    partition's live or building one. Without `register` (dry runs) partitions
+    seen for the first time are not recorded, just given the namespace they would get.
+    """
+    if register and partition_manifest.scheme is None and manifest.known_files():
+        partition_manifest.target_namespace("none", "")  # Ingested before partitions, so all in the default namespace
+    known = {} if register else partition_manifest.partitions(PARTITION_SCHEME)
+    partitioner = Partitioner(PARTITION_SCHEME, PARTITION_CIK_RANGE_SIZE)
+    targets = {}
+    namespaces = {}
+    for file_name, header in headers.items():
+        partition = partitioner(header['filing'])
+        if partition not in targets:
+            if register:
+                targets[partition] = partition_manifest.target_namespace(PARTITION_SCHEME, partition)
+            elif partition in known:
+                targets[partition] = known[partition]['building'] or known[partition]['namespace']
+            else:
+                targets[partition] = namespace_name(partition, 0)
+        namespaces[file_name] = targets[partition]
+    return namespaces
+
+def new_file_jobs(file_names: list[str]) -> list[FileJob]:
+    """
+    Jobs for the given filings, planned from the filing store's index alone:
+    each carries its header, its uncompressed size as the scheduler's
+    estimate of how much work it is, and the namespace of its partition.
+    """
+    headers = filing_store.headers(file_names)
+    namespaces = plan_namespaces(headers)
+    jobs = []
+    for file_index, file_name in enumerate(file_names, 1):
+        stats = new_file_stats(file_name)
+        stats['namespace'] = namespaces.get(file_name, "")
+        jobs.append(FileJob(headers.get(file_name), file_name, file_index, stats,
+                            size=headers[file_name]['raw_bytes'] if file_name in headers else 0,
+                            partition=stats['namespace']))
+    return jobs
+
+# Pipeline stage functions. Each runs in a pipeline worker thread and works on one FileJob.
+
+def load_filing(job: FileJob) -> bool:
+    """
+    Load a filing unless the ingestion manifest says it is unchanged. Reading
+    the changed sections from the filing store and chunking them happen in the
+    parse pool (see filing_parser.py); this thread only waits for the compact
+    result. Returns False when the filing can be skipped.
+    """
+    thread_id = threading.current_thread().name
+    stats = job.stats
+    logger.debug(f"[{thread_id}] Starting file {job.file_index}: {job.file_name}")
+    header = job.source
+    if header is None:
+        raise KeyError(f"{job.file_name} is not in the filing store")
+
+    previous = manifest.get_filing(job.file_name)
+    replaced_vectors = 0  # Vectors of this filing already in the namespace, for its vector count
+    if previous and previous['namespace'] == job.partition:
+        replaced_vectors = sum(len(state['vector_ids']) for state in previous['sections'].values())
+    if previous and (previous['chunk_params'] != CHUNK_PARAMS or previous['namespace'] != job.partition):
+        previous = None  # Chunked differently, or written to another namespace (a partition being rebuilt): reuse nothing
+    # Fast path: the store's content hash is the one last ingested, so nothing needs reading
+    if previous and previous['content_hash'] == header['content_hash']:
+        logger.debug(f"[{thread_id}] Unchanged since last run, skipping {job.file_name}")
+        stats['skipped'] = True
+        return False
+
+    args = (
+        header,
+        {section_name: state['hash'] for section_name, state in previous['sections'].items()} if previous else {},
+        CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_UNIT, EMBEDDING_MODEL,
+        near_duplicate_index.num_bins if near_duplicate_index is not None else None,
+    )
+    parts = min(job.size // PARSE_SPLIT_BYTES, parse_pool_processes) if PARSE_SPLIT_BYTES else 0
+    section_texts = None  # Taken out of shared memory below, unless the parts were merged already
+    if parse_pool is None:
+        payload = prepare_filing(*args, shared=False)
+    elif parts > 1:
+        payload, section_texts = prepare_filing_in_parts(parse_pool, args, parts)
+        registry.inc("filings_split_total")
+    else:
+        payload = parse_pool.submit(prepare_filing, *args).result()
+    registry.inc("filing_bytes_total", payload['bytes'])
+    for step, seconds in payload['timings'].items():
+        registry.observe(f"filing_{step}_seconds", seconds)
+
+    filing_data = payload['filing']
+    stats['company'] = filing_data.get("company", "Unknown")
+    job.data = {
+        'filing': filing_data,
+        'content_hash': payload['content_hash'],
+        'section_hashes': payload['section_hashes'],
+        'spans': payload['spans'],
+        'signatures': payload['signatures'],
+        'section_texts': section_texts if section_texts is not None else take_section_texts(payload),  # Only the new or changed sections
+        'previous_sections': previous['sections'] if previous else {},
+        'section_states': {},  # Manifest state per section once this file is done
+        'stale_vector_ids': [],
+        'replaced_vectors': replaced_vectors,
+        'written_vector_ids': written_vector_ids.get((job.file_name, payload['content_hash']), set()),
+    }
+    journal_file(job.file_name, "loaded", payload['content_hash'])
+    log_memory_usage(thread_id, f"Loaded {job.file_name}")
+    logger.debug(f"[{thread_id}] Processing {filing_data.get('company', 'Unknown')} "
+                 f"(Accession: {filing_data.get('accession_number', 'Unknown')})")
+    return True
+
+def iter_filing_chunks(job: FileJob, reuse_duplicates: bool = True):
+    """
+    Lazily turn the chunk spans computed by the parse pool into chunk items,
+    yielding one at a time so only the chunks currently in flight are held in
+    memory. Also works out which previously written vectors have become stale.
+    With `reuse_duplicates` off, near-duplicate lookups are skipped.
+    """
+    thread_id = threading.current_thread().name
+    stats = job.stats
+    previous_sections = job.data['previous_sections']
+    section_states = job.data['section_states']
+    stale_vector_ids = job.data['stale_vector_ids']
+    accession_number = job.data['filing'].get("accession_number", "Unknown")
+    already_written = job.data['written_vector_ids']
+    num_bins = near_duplicate_index.num_bins if near_duplicate_index is not None else 0
+
+    for section_name, section_hash in job.data['section_hashes'].items():
+        previous_state = previous_sections.get(section_name)
+        if section_name not in job.data['spans']:
+            section_states[section_name] = previous_state
+            stats['sections_skipped'] += 1
+            continue
+
+        # Chunk IDs are per section so one section changing does not renumber the others
+        section_text = job.data['section_texts'].pop(section_name)
+        spans = job.data['spans'].pop(section_name)
+        signatures = job.data['signatures'].pop(section_name, None)
+        vector_ids = []
+        for i in range(0, len(spans), 3):
+            span_start, span_end, span_tokens = spans[i], spans[i + 1], spans[i + 2]
+            vector_id = f"{accession_number}#{section_name}#{len(vector_ids)}"
+            vector_ids.append(vector_id)
+            item = {
+                'chunk': section_text[span_start:span_end],
+                'tokens': span_tokens,
+                'char_start': span_start,
+                'char_end': span_end,
+                'section_name': section_name,
+                'vector_id': vector_id
+            }
+            if vector_id in already_written:
+                stats['chunks_resumed'] += 1  # Written from these same contents before the last run stopped
                 continue
-            
-            stats['chunks_processed'] += len(chunks)
-            logger.info(f"[{thread_id}] 📄 Section '{section_name}': {len(chunks)} chunks")
-            
-            # Store chunks with their metadata for later processing
-            for chunk in chunks:
-                all_chunks_with_metadata.append({
-                    'chunk': chunk,
-                    'section_name': section_name,
-                    'chunk_id': chunk_id_counter
-                })
-                chunk_id_counter += 1
-            
-            stats['sections_processed'] += 1
-
-        logger.info(f"[{thread_id}] 📊 Total chunks collected: {len(all_chunks_with_metadata)} from {stats['sections_processed']} sections")
-
-        # STEP 2: Process ALL chunks in efficient batches
-        if all_chunks_with_metadata:
-            total_batches = (len(all_chunks_with_metadata) + EMBEDDING_BATCH_SIZE - 1) // EMBEDDING_BATCH_SIZE
-            
-            for i in range(0, len(all_chunks_with_metadata), EMBEDDING_BATCH_SIZE):
-                batch_metadata = all_chunks_with_metadata[i:i+EMBEDDING_BATCH_SIZE]
-                batch_chunks = [item['chunk'] for item in batch_metadata]
-                batch_num = i // EMBEDDING_BATCH_SIZE + 1
-                
-                logger.info(f"[{thread_id}] 📦 Processing batch {batch_num}/{total_batches} ({len(batch_chunks)} chunks)")
-                
-                try:
-                    embeddings = get_embeddings_with_retry(batch_chunks)
-                    stats['embedding_requests'] += 1
-                    logger.info(f"[{thread_id}] ✅ Batch {batch_num}/{total_batches} completed successfully")
-                except Exception as e:
-                    logger.error(f"[{thread_id}] ❌ Error getting embeddings for batch {batch_num}: {e}")
-                    stats['error'] = str(e)
-                    continue
-
-                # Create vectors for this batch
-                for j, (embedding, metadata_item) in enumerate(zip(embeddings, batch_metadata)):
-                    vector_id = f"{filing_data['accession_number']}#{metadata_item['section_name']}#{metadata_item['chunk_id']}"
-                    
-                    metadata = {
-                        "company": filing_data.get("company", ""),
-                        "cik": str(filing_data.get("cik", "")),
-                        "form": filing_data.get("form", ""),
-                        "filing_date": filing_data.get("filing_date", ""),
-                        "accession_number": filing_data.get("accession_number", ""),
-                        "section": metadata_item['section_name'],
-                        "text": metadata_item['chunk']
-                    }
-                    
-                    vectors_to_upsert.append({"id": vector_id, "values": embedding, "metadata": metadata})
-
-        # Upsert vectors to Pinecone - OPTIMIZED FOR SPEED
-        if vectors_to_upsert:
-            logger.info(f"[{thread_id}] Upserting {len(vectors_to_upsert)} vectors for {company}")
-            try:
-                # REMOVED LOCK - Pinecone handles concurrent upserts well
-                # Upsert in LARGER batches for speed (5x larger than before)
-                upsert_batches = 0
-                for i in range(0, len(vectors_to_upsert), PINECONE_BATCH_SIZE):
-                    batch = vectors_to_upsert[i:i+PINECONE_BATCH_SIZE]
-                    upsert_start = time.time()
-                    index.upsert(vectors=batch)
-                    upsert_time = time.time() - upsert_start
-                    upsert_batches += 1
-                    logger.debug(f"[{thread_id}] Upserted batch {upsert_batches} ({len(batch)} vectors) in {upsert_time:.2f}s")
-                    # Removed sleep for maximum speed
-                
-                stats['vectors_upserted'] = len(vectors_to_upsert)
-                logger.info(f"[{thread_id}] 🚀 Successfully upserted {len(vectors_to_upsert)} vectors in {upsert_batches} batches")
-                stats['success'] = True
-            except Exception as e:
-                logger.error(f"[{thread_id}] Error upserting vectors for {file_name}: {e}")
-                stats['error'] = str(e)
+            if near_duplicate_index is not None and reuse_duplicates:
+                chunk_index = len(vector_ids) - 1
+                signature = list(signatures[chunk_index * num_bins:(chunk_index + 1) * num_bins])
+                embedding = find_reusable_embedding(item['chunk'], signature)
+                if embedding is not None:
+                    item['embedding'] = embedding  # Skips the embedding stage entirely
+                    stats['chunks_deduplicated'] += 1
+                    registry.inc("chunks_deduplicated_total")
+            yield item
+
+        section_states[section_name] = {'hash': section_hash, 'vector_ids': vector_ids}
+        if previous_state:
+            stale_vector_ids.extend(set(previous_state['vector_ids']) - set(vector_ids))
+        if not vector_ids:
+            logger.debug(f"[{thread_id}] No chunks generated for section: {section_name}")
+            continue
+
+        stats['chunks_processed'] += len(vector_ids)
+        stats['sections_processed'] += 1
+        logger.debug(f"[{thread_id}] Section '{section_name}': {len(vector_ids)} chunks")
+
+    # Sections that disappeared from the filing entirely
+    for section_name, previous_state in previous_sections.items():
+        if section_name not in section_states:
+            stale_vector_ids.extend(previous_state['vector_ids'])
+
+    logger.debug(f"[{thread_id}] Total chunks collected: {stats['chunks_processed']} from "
+                 f"{stats['sections_processed']} sections ({stats['sections_skipped']} unchanged)")
+
+def find_reusable_embedding(chunk: str, signature: list[int]) -> np.ndarray | None:
+    """
+    Look for an earlier exact or near-duplicate chunk whose embedding is still
+    cached. Chunks without one are registered so later chunks can match them.
+    """
+    match = near_duplicate_index.find(signature)
+    if match:
+        embedding = embedding_cache.get_by_key(match[0])
+        if embedding is not None:
+            return embedding
+    near_duplicate_index.add(cache_key(EMBEDDING_SPACE, chunk), signature)
+    return None
+
+def build_vectors(job: FileJob, batch_items: list[dict], embeddings) -> list[dict]:
+    """
+    Pair each embedding with its ID and filing metadata. Values stay float32
+    NumPy rows; sinks convert them only if their transport needs to.
+    """
+    filing_data = job.data['filing']
+    vectors = []
+    for embedding, item in zip(embeddings, batch_items):
+        metadata = {
+            "company": filing_data.get("company", ""),
+            "cik": str(filing_data.get("cik", "")),
+            "form": filing_data.get("form", ""),
+            "filing_date": filing_data.get("filing_date", ""),
+            "accession_number": filing_data.get("accession_number", ""),
+            "section": item['section_name'],
+            "embedding_model": EMBEDDING_SPACE,  # Queries must embed with the same model and size
+            "embedding_dimension": len(embedding),
+            "char_start": item['char_start'],  # Offsets into the section text, for citation highlighting
+            "char_end": item['char_end'],
+        }
+        if chunk_text_store is not None:
+            chunk_text_store.put(item['vector_id'], item['chunk'])
+            metadata["text_preview"] = item['chunk'][:TEXT_PREVIEW_CHARS]
         else:
-            logger.warning(f"[{thread_id}] No vectors to upsert for {file_name}")
-            stats['success'] = True  # No error, just no vectors
+            metadata["text"] = item['chunk']
+        vectors.append({"id": item['vector_id'], "values": embedding, "metadata": metadata})
+    return vectors
 
-        stats['processing_time'] = time.time() - file_start_time
-        logger.info(f"[{thread_id}] Completed {company} in {stats['processing_time']:.2f}s - {stats['sections_processed']} sections processed")
+def error_status(e: Exception) -> int | None:
+    status = getattr(e, "status", None) or getattr(e, "status_code", None)
+    return status if isinstance(status, int) else None
 
+def is_permanent_upsert_error(e: Exception) -> bool:
+    """Client errors (bad request, auth, payload too large) will not succeed on retry; 429s might."""
+    status = error_status(e)
+    return isinstance(e, ValueError) or (status is not None and 400 <= status < 500 and status != 429)
+
+@backoff.on_exception(backoff.expo, Exception, max_tries=UPSERT_MAX_TRIES, max_time=UPSERT_MAX_RETRY_SECONDS,
+                      giveup=is_permanent_upsert_error, on_backoff=count_retry("vector_sink"))
+def write_vectors(vectors: list[dict], namespace: str = ""):
+    """Upsert one batch to a namespace of the configured sink, retrying transient failures with exponential backoff."""
+    start_time = time.perf_counter()
+    try:
+        with registry.timer("vector_sink_seconds", operation="upsert", sink=VECTOR_SINK):
+            vector_sink.upsert(vectors, namespace)
     except Exception as e:
-        stats['processing_time'] = time.time() - file_start_time
-        stats['error'] = str(e)
-        logger.error(f"[{thread_id}] Error processing file {file_name}: {e}")
-    
+        observe_request("upsert", start_time, len(vectors), "throttled" if error_status(e) == 429 else "error")
+        raise
+    observe_request("upsert", start_time, len(vectors))
+
+def upsert_vectors(vectors: list[dict], namespace: str = "") -> int:
+    """
+    Upsert one batch of vectors to a namespace. A batch that still fails after
+    every retry is written to the dead-letter spool instead of failing the
+    file, so its embeddings are not lost. Returns the number of vectors
+    written to the sink: 0 for a spooled batch, which the pipeline then
+    neither journals nor lets its filing be finalized (see on_file_done).
+    """
+    try:
+        write_vectors(vectors, namespace)
+    except Exception as e:
+        dead_letter_spool.append(vectors, str(e), namespace)
+        registry.inc("vectors_spooled_total", len(vectors))
+        return 0
+    log_memory_usage(threading.current_thread().name, f"Upserted {len(vectors)} vectors")
+    return len(vectors)
+
+def replay_dead_letters():
+    """Upsert batches spooled by earlier runs, before anything newer is written."""
+    replayed, pending = dead_letter_spool.replay(write_vectors)
+    if replayed:
+        registry.inc("vectors_replayed_total", replayed)
+        vector_sink.flush()
+    if pending:
+        logger.warning(f"{pending} spooled vectors could not be replayed; they stay in {DEAD_LETTER_PATH}")
+
+def delete_vectors(vector_ids: list[str], thread_id: str, namespace: str = "") -> int:
+    """Delete vectors from a namespace of the configured sink. Returns the number of IDs deleted."""
+    if vector_ids:
+        with registry.timer("vector_sink_seconds", operation="delete", sink=VECTOR_SINK):
+            vector_sink.delete(vector_ids, namespace)
+        registry.inc("vectors_deleted_total", len(vector_ids))
+    if chunk_text_store is not None and vector_ids:
+        chunk_text_store.delete(vector_ids)
+    if vector_ids:
+        logger.info(f"[{thread_id}] 🧹 Deleted {len(vector_ids)} stale vectors")
+    return len(vector_ids)
+
+def finalize_filing(job: FileJob):
+    """
+    Runs once all of a filing's vectors are written. Only then are stale vectors
+    deleted and the manifest updated, otherwise the next run would skip sections
+    that never made it into the index.
+    """
+    thread_id = threading.current_thread().name
+    stats = job.stats
+    if stats['skipped'] or job.data is None:
+        return
+    filing_data = job.data['filing']
+    if stats['error'] is None:
+        if chunk_text_store is not None:
+            chunk_text_store.flush()  # Texts must be durable before the manifest says we are done
+        vector_sink.flush()
+        stats['vectors_deleted'] = delete_vectors(job.data['stale_vector_ids'], thread_id, job.partition)
+        section_states = job.data['section_states']
+        manifest.record_filing(job.file_name, filing_data.get("accession_number", "Unknown"), job.data['content_hash'],
+                               CHUNK_PARAMS, section_states, size=job.size, namespace=job.partition)
+        vectors = sum(len(state['vector_ids']) for state in section_states.values() if state)
+        partition_manifest.add_vectors(job.partition, vectors - job.data['replaced_vectors'])
+    logger.debug(f"[{thread_id}] Completed {filing_data.get('company', 'Unknown')} in {time.time() - job.start_time:.2f}s "
+                 f"- {stats['vectors_upserted']} vectors, {stats['sections_processed']} sections processed")
+
+def journal_file(file_name: str, state: str, content_hash: str | None = None):
+    """Record a file's progress in the run journal (a no-op outside process_and_upsert_filings)."""
+    if current_run_id is not None:
+        run_journal.record_file(current_run_id, file_name, state, content_hash)
+
+def record_progress(job: FileJob, state: str, vectors: list[dict] | None):
+    """Pipeline on_progress hook: journal each written upsert batch and each file state reached."""
+    if state != "batch_upserted":
+        journal_file(job.file_name, state)
+        return
+    if chunk_text_store is not None:
+        chunk_text_store.flush()  # The batch's texts must survive a crash as long as its record does
+    run_journal.record_batch(current_run_id, job.file_name, job.data['content_hash'],
+                             [vector['id'] for vector in vectors])
+
+def begin_run(file_names: list[str] | None, resume: bool) -> list[str]:
+    """
+    Open a run in the journal and return the files it should process. With
+    `resume` and no explicit `file_names`, the last interrupted run continues
+    with its unfinished files in their original order; either way, chunks
+    written by earlier unfinished runs are skipped.
+    """
+    global current_run_id, written_vector_ids
+    previous = run_journal.unfinished_run() if resume and file_names is None else None
+    if previous and previous['chunk_params'] != CHUNK_PARAMS:
+        logger.warning(f"Run {previous['id']} was chunked with different parameters; starting a new run instead")
+        previous = None
+
+    if previous:
+        current_run_id = previous['id']
+        file_names = run_journal.resume_run(current_run_id)
+        logger.info(f"Resuming run {current_run_id} ({previous['status']}): {len(file_names)} of "
+                    f"{len(previous['files'])} files left")
+    else:
+        if resume and file_names is None:
+            logger.info("No interrupted run to resume; starting a new run")
+        if file_names is None:
+            file_names = filing_store.accession_numbers()
+        current_run_id = run_journal.start_run(file_names, CHUNK_PARAMS, keep_batches=resume)
+    written_vector_ids = run_journal.written_vector_ids(CHUNK_PARAMS) if resume else {}
+    if written_vector_ids:
+        logger.info(f"Skipping {sum(len(ids) for ids in written_vector_ids.values())} vectors already written "
+                    f"for {len(written_vector_ids)} partly ingested filings")
+    return file_names
+
+@contextmanager
+def draining_on_signals(stop):
+    """
+    Call `stop()` on the first SIGINT or SIGTERM so in-flight filings can
+    finish; the previous handlers are restored, so a second signal aborts.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield  # Signal handlers can only be installed from the main thread
+        return
+    previous_handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+
+    def handle(signum, frame):
+        logger.warning(f"Received {signal.Signals(signum).name}: finishing filings in flight, then stopping "
+                       f"(send it again to abort)")
+        for restored, handler in previous_handlers.items():
+            signal.signal(restored, handler)
+        stop()
+
+    for signum in previous_handlers:
+        signal.signal(signum, handle)
+    try:
+        yield
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+@contextmanager
+def running_parse_pool():
+    """Run the block with the parse pool started (unless it already is). Yields the process count."""
+    global parse_pool, parse_pool_processes
+    parse_processes = default_parse_processes() if PARSE_PROCESSES is None else PARSE_PROCESSES
+    if parse_pool is not None:
+        yield parse_processes
+        return
+    parse_pool = start_parse_pool(parse_processes, EMBEDDING_MODEL)
+    parse_pool_processes = parse_processes if parse_pool is not None else 0
+    logger.info(f"Parsing and chunking in {f'{parse_processes} processes' if parse_pool else 'the load threads'}")
+    try:
+        yield parse_processes
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+            parse_pool = None
+            parse_pool_processes = 0
+
+def new_autotuner() -> Autotuner:
+    """Tunes the pipeline's batch sizes and requests in flight, starting from the last run's values."""
+    return Autotuner(
+        settings={
+            'embed_concurrency': {'value': EMBEDDING_CONCURRENCY, 'min': 1, 'max': EMBEDDING_CONCURRENCY_MAX, 'step': 1},
+            'embed_token_budget': {'value': EMBEDDING_BATCH_TOKEN_BUDGET, 'min': 4_000,
+                                   'max': EMBEDDING_BATCH_TOKEN_BUDGET_MAX, 'step': 4_000},
+            'upsert_concurrency': {'value': UPSERT_CONCURRENCY, 'min': 1, 'max': UPSERT_CONCURRENCY_MAX, 'step': 1},
+            'upsert_batch_size': {'value': PINECONE_BATCH_SIZE, 'min': 20,
+                                  'max': max(UPSERT_BATCH_SIZE_MAX, PINECONE_BATCH_SIZE), 'step': 20},
+        },
+        groups={
+            'embed': ('embed_concurrency', 'embed_token_budget'),
+            'upsert': ('upsert_concurrency', 'upsert_batch_size'),
+        },
+        state_path=AUTOTUNE_STATE_PATH,
+        interval=AUTOTUNE_INTERVAL_SECONDS,
+    )
+
+def warn_no_filings():
+    with os.scandir(FILINGS_DATA_DIR) as entries:
+        legacy_files = any(entry.name.endswith(".json") for entry in entries)
+    if legacy_files:
+        logger.warning(f"The filing store is empty but {FILINGS_DATA_DIR} holds filing JSON files - "
+                       f"import them with `migrate`")
+    else:
+        logger.warning(f"No filings to process in the filing store ({FILINGS_DATA_DIR}) - fetch some with `fetch`")
+
+def migrate_filings(delete: bool = False) -> dict | None:
+    """
+    Import the filing JSON files in FILINGS_DATA_DIR into the filing store and
+    re-key both sinks' manifests from file name to accession number, so
+    migrated filings are not ingested again. Refused while a run is
+    unfinished, since its journal still lists file names.
+    """
+    unfinished = run_journal.unfinished_run()
+    if unfinished:
+        logger.error(f"Run {unfinished['id']} is unfinished - complete it with `upsert --resume` before migrating filings")
+        return None
+    logger.info(f"=== Migrating filing JSON files in {FILINGS_DATA_DIR} to the filing store ===")
+    stats = filing_store.migrate_directory(FILINGS_DATA_DIR, delete=delete)
+    renamed = stats.pop('accession_numbers')
+    for manifest_path in (os.path.join(LOCAL_VECTOR_STORE_DIR, "ingestion_manifest.sqlite3"),
+                          os.path.join(CACHE_DIR, "ingestion_manifest.sqlite3")):  # One per sink
+        if manifest_path == MANIFEST_PATH:
+            manifest.rename(renamed)
+        elif os.path.exists(manifest_path):
+            other_manifest = IngestionManifest(manifest_path)
+            other_manifest.rename(renamed)
+            other_manifest.close()
+    store_stats = filing_store.stats()
+    logger.info(f"Filings migrated: {stats['migrated']}, already stored: {stats['unchanged']}, failed: {stats['failed']}, "
+                f"files deleted: {stats['deleted']}")
+    logger.info(f"Filing store: {store_stats['filings']} filings in {store_stats['shards']} shards, "
+                f"{store_stats['raw_bytes'] / 1e6:.1f}MB of JSON stored as {store_stats['stored_bytes'] / 1e6:.1f}MB")
     return stats
 
-def process_and_upsert_filings():
+def complete_partition_builds():
     """
-    Processes saved JSON filings concurrently, creates embeddings, and upserts them to Pinecone.
+    Switch each partition being built live once its building namespace holds
+    every one of its filings (after a scheme change, all partitions of the new
+    scheme at once), delete retired namespaces past their grace period, and
+    export the live partitions for the query side.
     """
-    logger.info("=== Phase 2: Processing local files and upserting to Pinecone (CONCURRENT) ===")
-    json_files = [f for f in os.listdir(FILINGS_DATA_DIR) if f.endswith('.json')]
-    total_files_to_process = len(json_files)
-    
-    if not json_files:
-        logger.warning("No JSON files found to process in `filings_data` directory.")
+    partitions = partition_manifest.partitions(PARTITION_SCHEME)
+    building = {name: partition['building'] for name, partition in partitions.items() if partition['building']}
+    headers = filing_store.headers()
+    ingested = manifest.namespaces()
+    if building:
+        partitioner = Partitioner(PARTITION_SCHEME, PARTITION_CIK_RANGE_SIZE)
+        incomplete = set()
+        for file_name, header in headers.items():
+            partition = partitioner(header['filing'])
+            if partition in building and ingested.get(file_name) != building[partition]:
+                incomplete.add(partition)
+        if partition_manifest.scheme != PARTITION_SCHEME:
+            if incomplete:
+                logger.info(f"Partition scheme {PARTITION_SCHEME}: {len(incomplete)} of {len(building)} partitions "
+                            f"still building; queries stay on the {partition_manifest.scheme} partitions")
+            else:
+                retired = partition_manifest.activate(PARTITION_SCHEME)
+                logger.info(f"Partition scheme {PARTITION_SCHEME} is live with {len(building)} partitions; "
+                            f"retired {len(retired)} namespaces of the previous scheme")
+        else:
+            for partition in sorted(set(building) - incomplete):
+                previous = partition_manifest.finish_rebuild(PARTITION_SCHEME, partition)
+                logger.info(f"Partition {partition or 'default'!r} rebuilt: namespace {building[partition]!r} is live, "
+                            f"{previous!r} retired")
+            for partition in sorted(incomplete):
+                logger.info(f"Partition {partition or 'default'!r} is still being rebuilt - run `upsert --rebuild-partition` again")
+    for namespace in partition_manifest.expired_retirements(PARTITION_RETIRE_GRACE_SECONDS):
+        vector_sink.delete_namespace(namespace)
+        partition_manifest.forget_retired(namespace)
+        logger.info(f"Deleted retired namespace {namespace!r}")
+
+    live = {partition['namespace'] for partition in partition_manifest.partitions(partition_manifest.scheme).values()}
+    filings_by_namespace = {}
+    for file_name, namespace in ingested.items():
+        if namespace in live and file_name in headers:
+            filings_by_namespace.setdefault(namespace, []).append(headers[file_name]['filing'])
+    partition_manifest.export(PARTITION_EXPORT_PATH, {namespace: summarize_filings(filings)
+                                                      for namespace, filings in filings_by_namespace.items()})
+
+def partition_file_names(partition: str) -> list[str]:
+    """Accession numbers of the stored filings in a partition of PARTITION_SCHEME."""
+    partitioner = Partitioner(PARTITION_SCHEME, PARTITION_CIK_RANGE_SIZE)
+    return [file_name for file_name, header in filing_store.headers().items() if partitioner(header['filing']) == partition]
+
+def rebuild_partition(partition: str, resume: bool = False) -> dict | None:
+    """
+    Rebuild one partition blue/green: its filings are ingested in full into a
+    fresh namespace while queries keep reading the live one, which is
+    switched and retired once every filing is in. An interrupted rebuild
+    continues where it stopped when this runs again.
+    """
+    file_names = partition_file_names(partition)
+    if not file_names:
+        logger.error(f"No stored filings are in partition {partition or 'default'!r} of scheme {PARTITION_SCHEME}")
+        return None
+    namespace = partition_manifest.start_rebuild(PARTITION_SCHEME, partition)
+    logger.info(f"=== Rebuilding partition {partition or 'default'!r} ({len(file_names)} filings) into namespace "
+                f"{namespace!r} ===")
+    return process_and_upsert_filings(file_names, resume=resume)
+
+def abort_partition_rebuild(partition: str):
+    """Give up a partition's rebuild. Its filings written to the building namespace are re-ingested into the live one."""
+    namespace = partition_manifest.abort_rebuild(PARTITION_SCHEME, partition)
+    if namespace is None:
+        logger.warning(f"Partition {partition or 'default'!r} is not being rebuilt")
         return
+    logger.info(f"Abandoned the rebuild of partition {partition or 'default'!r}; namespace {namespace!r} is retired")
+    complete_partition_builds()
+
+def log_partitions():
+    logger.info(f"=== Partitions (serving scheme: {partition_manifest.scheme}, configured: {PARTITION_SCHEME}) ===")
+    for name, partition in partition_manifest.partitions().items():
+        logger.info(f"- [{partition['scheme']}] {name or 'default'}: live {partition['namespace']!r} "
+                    f"({partition['vectors']} vectors)"
+                    + (f", building {partition['building']!r}" if partition['building'] else ""))
 
-    logger.info(f"Found {total_files_to_process} JSON files to process concurrently")
-    logger.info(f"Max concurrent workers: {MAX_CONCURRENT_FILES}")
+def plan_run(partition: str | None = None) -> dict:
+    """
+    --dry-run of embed and upsert: what a run would do with each stored filing,
+    worked out from the filing store's index and the manifests alone - nothing
+    is read from the shards, embedded, connected to or written. With
+    `partition`, what rebuilding that partition would do.
+    """
+    file_names = filing_store.accession_numbers() if partition is None else partition_file_names(partition)
+    headers = filing_store.headers(file_names)
+    namespaces = plan_namespaces(headers, register=False)
+    if partition is not None:
+        known = partition_manifest.partitions(PARTITION_SCHEME).get(partition)
+        rebuild_namespace = (known['building'] if known and known['building']
+                             else namespace_name(partition, (known['generation'] if known else 0) + 1))
+        namespaces = dict.fromkeys(namespaces, rebuild_namespace)
+    plan = {'files': len(file_names), 'new': 0, 'changed': 0, 'rechunked': 0, 'moved': 0, 'unchanged': 0,
+            'raw_bytes': 0, 'namespaces': {}}
+    for file_name, header in headers.items():
+        previous = manifest.get_filing(file_name)
+        namespace = namespaces[file_name]
+        if previous is None:
+            action = 'new'
+        elif previous['chunk_params'] != CHUNK_PARAMS:
+            action = 'rechunked'
+        elif previous['namespace'] != namespace:
+            action = 'moved'  # Partition scheme change or rebuild: re-ingested in full into another namespace
+        elif previous['content_hash'] != header['content_hash']:
+            action = 'changed'
+        else:
+            action = 'unchanged'
+        plan[action] += 1
+        if action != 'unchanged':
+            plan['raw_bytes'] += header['raw_bytes']
+            plan['namespaces'][namespace] = plan['namespaces'].get(namespace, 0) + 1
+    plan['spooled_vectors'] = dead_letter_spool.pending()
+    unfinished = run_journal.unfinished_run()
+    plan['unfinished_run'] = unfinished['id'] if unfinished else None
+    return plan
+
+def log_plan(plan: dict, command: str):
+    logger.info(f"=== Dry run: {command} ({VECTOR_SINK}, {EMBEDDING_SPACE}, partition scheme {PARTITION_SCHEME}) ===")
+    logger.info(f"Stored filings: {plan['files']} - new: {plan['new']}, changed: {plan['changed']}, "
+                f"chunked with other parameters: {plan['rechunked']}, moving namespace: {plan['moved']}, "
+                f"unchanged (skipped): {plan['unchanged']}")
+    logger.info(f"Would process {plan['files'] - plan['unchanged']} filings ({plan['raw_bytes'] / 1e6:.1f}MB of JSON)"
+                + (" into namespaces: " + ", ".join(f"{namespace or 'default'} {files}"
+                                                   for namespace, files in sorted(plan['namespaces'].items()))
+                   if plan['namespaces'] else ""))
+    if plan['spooled_vectors'] and command == "upsert":
+        logger.info(f"Would first replay {plan['spooled_vectors']} vectors from the dead-letter spool")
+    if plan['unfinished_run'] is not None:
+        logger.info(f"Run {plan['unfinished_run']} is unfinished; `upsert --resume` continues it")
+
+def log_status():
+    """`status`: what is stored, ingested and pending, from local state only."""
+    store_stats = filing_store.stats()
+    logger.info(f"Filing store: {store_stats['filings']} filings in {store_stats['shards']} shards "
+                f"({FILINGS_DATA_DIR}, {store_stats['raw_bytes'] / 1e6:.1f}MB of JSON stored as "
+                f"{store_stats['stored_bytes'] / 1e6:.1f}MB)")
+    ingested = manifest.namespaces()
+    logger.info(f"Ingested into {VECTOR_SINK}: {len(ingested)} filings ({MANIFEST_PATH})")
+    unfinished = run_journal.unfinished_run()
+    if unfinished:
+        done = sum(1 for state in unfinished['file_states'].values() if state in ("done", "skipped"))
+        logger.info(f"Unfinished run {unfinished['id']} ({unfinished['status']}): {done} of {len(unfinished['files'])} "
+                    f"files done - `upsert --resume` continues it")
+    spooled = dead_letter_spool.pending()
+    if spooled:
+        logger.info(f"Dead-letter spool: {spooled} vectors waiting to be replayed ({DEAD_LETTER_PATH})")
+    logger.info(f"Embedding cache: {embedding_cache.stats()['entries']} entries (max {EMBEDDING_CACHE_MAX_ENTRIES}, "
+                f"{EMBEDDING_CACHE_PATH})")
+    if os.path.exists(AUTOTUNE_STATE_PATH):
+        with open(AUTOTUNE_STATE_PATH) as f:
+            logger.info(f"Autotuned settings for the next run: {json.load(f).get('settings')}")
+    log_partitions()
+
+def process_and_upsert_filings(file_names: list[str] | None = None, resume: bool = False) -> dict | None:
+    """
+    Processes stored filings (all of them, or just `file_names`) through the
+    async ingestion pipeline: load, chunk, embed and upsert stages run
+    concurrently so work on different files overlaps. Progress is journaled;
+    `resume` continues the last interrupted run (see begin_run). SIGINT or
+    SIGTERM stops the run after the filings in flight are done.
+    Returns the run's totals, or None if there was nothing to process.
+    """
+    global current_run_id, autotuner
+    logger.info(f"=== Phase 2: Processing local files and upserting to {VECTOR_SINK} (PIPELINED) ===")
+    filing_names = begin_run(file_names, resume)
+    total_files_to_process = len(filing_names)
+    
+    if not filing_names:
+        run_journal.finish_run(current_run_id, "completed")
+        current_run_id = None
+        warn_no_filings()
+        return None
+
+    logger.info(f"Found {total_files_to_process} filings to process")
+    if partition_manifest.scheme not in (None, PARTITION_SCHEME):
+        logger.warning(f"PARTITION_SCHEME changed from {partition_manifest.scheme} to {PARTITION_SCHEME}: building the "
+                       f"new partitions beside the live ones, which queries use until every filing is in the new ones")
+    replay_dead_letters()
 
     process_start_time = time.time()
 
     # Initialize aggregated stats
-    files_processed_successfully = 0
-    files_with_errors = 0
-    total_vectors_upserted = 0
-    total_embedding_requests = 0
-    total_chunks_processed = 0
+    totals = {
+        'files_processed_successfully': 0,
+        'files_with_errors': 0,
+        'files_skipped': 0,
+        'files_interrupted': 0,
+        'files_spooled': 0,
+        'vectors_upserted': 0,
+        'vectors_deleted': 0,
+        'chunks_processed': 0,
+        'chunks_deduplicated': 0,
+        'chunks_resumed': 0,
+    }
     all_stats = []
+    vectors_by_namespace = {}
+    progress_bar = tqdm(total=total_files_to_process, desc="Processing filings")
 
-    # Process files concurrently using ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FILES, thread_name_prefix="FileProcessor") as executor:
-        # Submit all file processing tasks
-        future_to_file = {}
-        for file_index, file_name in enumerate(json_files, 1):
-            file_path = os.path.join(FILINGS_DATA_DIR, file_name)
-            future = executor.submit(process_single_filing, file_path, file_name, file_index, total_files_to_process)
-            future_to_file[future] = file_name
-
-        # Create progress bar
-        progress_bar = tqdm(total=total_files_to_process, desc="Processing filings concurrently")
-        
-        # Process completed tasks as they finish
-        for future in as_completed(future_to_file):
-            file_name = future_to_file[future]
-            try:
-                stats = future.result()
-                all_stats.append(stats)
-                
-                # Update aggregated stats in a thread-safe way
-                with stats_lock:
-                    if stats['success']:
-                        files_processed_successfully += 1
-                    else:
-                        files_with_errors += 1
-                    
-                    total_vectors_upserted += stats['vectors_upserted']
-                    total_embedding_requests += stats['embedding_requests']
-                    total_chunks_processed += stats['chunks_processed']
-                
-                # Update progress bar
-                progress_bar.update(1)
-                progress_bar.set_postfix({
-                    'Success': files_processed_successfully,
-                    'Errors': files_with_errors,
-                    'Vectors': total_vectors_upserted
-                })
-                
-                if stats['success']:
-                    logger.info(f"✓ Completed {file_name}: {stats['vectors_upserted']} vectors, {stats['processing_time']:.1f}s")
-                else:
-                    logger.error(f"✗ Failed {file_name}: {stats['error']}")
-                    
-            except Exception as e:
-                logger.error(f"Future exception for file {file_name}: {e}")
-                with stats_lock:
-                    files_with_errors += 1
-                progress_bar.update(1)
-        
-        progress_bar.close()
+    def on_file_done(stats: dict):
+        # Called from the pipeline's event loop thread, one file at a time
+        all_stats.append(stats)
+        if stats['success']:
+            totals['files_processed_successfully'] += 1
+        elif stats['interrupted']:
+            totals['files_interrupted'] += 1
+        elif stats['error'] is None and stats['vectors_unwritten']:
+            totals['files_spooled'] += 1
+        else:
+            totals['files_with_errors'] += 1
+        if stats['skipped']:
+            totals['files_skipped'] += 1
+        totals['vectors_upserted'] += stats['vectors_upserted']
+        totals['vectors_deleted'] += stats['vectors_deleted']
+        totals['chunks_processed'] += stats['chunks_processed']
+        totals['chunks_deduplicated'] += stats['chunks_deduplicated']
+        totals['chunks_resumed'] += stats['chunks_resumed']
+        if stats['vectors_upserted'] or stats['vectors_deleted']:
+            vectors_by_namespace[stats['namespace']] = vectors_by_namespace.get(stats['namespace'], 0) + stats['vectors_upserted']
+        # A filing with spooled vectors is not finalized: the next run replays them, then ingests it again
+        # (its embeddings come from the cache) and only that run records it in the manifest
+        journal_file(stats['file_name'], "skipped" if stats['skipped'] else "done" if stats['success']
+                     else "interrupted" if stats['interrupted'] else "failed" if stats['error'] is not None
+                     else "spooled")
+
+        progress_bar.update(1)
+        progress_bar.set_postfix({
+            'Success': totals['files_processed_successfully'],
+            'Errors': totals['files_with_errors'],
+            'Vectors': totals['vectors_upserted']
+        })
+        if stats['success']:
+            logger.info(f"✓ Completed {stats['file_name']}: {stats['vectors_upserted']} vectors, {stats['processing_time']:.1f}s")
+        elif stats['interrupted']:
+            logger.info(f"⏸ Interrupted {stats['file_name']} after {stats['vectors_upserted']} vectors")
+        elif stats['error'] is None and stats['vectors_unwritten']:
+            logger.warning(f"⚠ Incomplete {stats['file_name']}: {stats['vectors_unwritten']} vectors went to the "
+                           f"dead-letter spool; it is finished by the next run, after they are replayed")
+        else:
+            logger.error(f"✗ Failed {stats['file_name']}: {stats['error']}")
+
+    jobs = new_file_jobs(filing_names)
+    autotuner = new_autotuner() if AUTOTUNE else None
+    embedder.start()  # Forks local embedding workers, like the parse pool, before any pipeline thread exists
+    with running_parse_pool() as parse_processes:
+        pipeline = IngestionPipeline(
+            load_fn=load_filing,
+            chunk_fn=iter_filing_chunks,
+            embed_fn=get_embeddings_with_retry,
+            build_fn=build_vectors,
+            upsert_fn=upsert_vectors,
+            finalize_fn=finalize_filing,
+            on_file_done=on_file_done,
+            on_progress=record_progress,
+            load_workers=max(MAX_CONCURRENT_FILES, parse_processes),  # Enough waiting threads to keep every process busy
+            chunk_workers=CHUNK_CONCURRENCY,
+            # With the autotuner these are the most it may raise requests in flight to
+            embed_workers=EMBEDDING_CONCURRENCY_MAX if autotuner else EMBEDDING_CONCURRENCY,
+            upsert_workers=UPSERT_CONCURRENCY_MAX if autotuner else UPSERT_CONCURRENCY,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            embed_batch_size=EMBEDDING_BATCH_SIZE,
+            embed_token_budget=EMBEDDING_BATCH_TOKEN_BUDGET,
+            upsert_batch_size=PINECONE_BATCH_SIZE,
+            largest_first=SCHEDULE_LARGEST_FIRST,
+            tuner=autotuner,
+        )
+        with draining_on_signals(pipeline.stop):
+            pipeline.run(jobs)
+    if autotuner is not None:
+        autotuner.save()
+    progress_bar.close()
+    interrupted = pipeline.stopping
+    run_journal.finish_run(current_run_id, "interrupted" if interrupted else "completed")
+    current_run_id = None
+    vector_sink.flush()
+    if VECTOR_SINK == "local":
+        for namespace in vectors_by_namespace:  # Only the namespaces this run changed
+            store = vector_sink.namespace(namespace)
+            if store.stats()['live_vectors'] >= LOCAL_VECTOR_IVF_MIN_VECTORS:
+                store.update_index(LOCAL_VECTOR_IVF_REBUILD_FRACTION)  # Retrains only once enough rows are new
+    complete_partition_builds()
 
     total_process_time = time.time() - process_start_time
+    total_vectors_upserted = totals['vectors_upserted']
 
     # Log detailed summary
-    logger.info("=== Phase 2 Summary (CONCURRENT) ===")
-    logger.info(f"Files processed successfully: {files_processed_successfully}/{total_files_to_process}")
-    logger.info(f"Files with errors: {files_with_errors}/{total_files_to_process}")
-    logger.info(f"Total vectors upserted to Pinecone: {total_vectors_upserted}")
-    logger.info(f"Total chunks processed: {total_chunks_processed}")
-    logger.info(f"Total embedding requests: {total_embedding_requests}")
+    logger.info("=== Phase 2 Summary (PIPELINED) ===")
+    logger.info(f"Files processed successfully: {totals['files_processed_successfully']}/{total_files_to_process}")
+    logger.info(f"Files with errors: {totals['files_with_errors']}/{total_files_to_process}")
+    logger.info(f"Files skipped (unchanged): {totals['files_skipped']}/{total_files_to_process}")
+    if interrupted:
+        logger.warning(f"Stopped early: {totals['files_interrupted']} files interrupted, {len(pipeline.not_started)} "
+                       f"not started - run `upsert --resume` to continue")
+    if totals['chunks_resumed']:
+        logger.info(f"Chunks already written before the last run stopped: {totals['chunks_resumed']}")
+    logger.info(f"Total vectors upserted to {VECTOR_SINK}: {total_vectors_upserted}")
+    if len(vectors_by_namespace) > 1 or set(vectors_by_namespace) - {""}:
+        logger.info("Vectors upserted by namespace: " + ", ".join(
+            f"{namespace or 'default'} {vectors}" for namespace, vectors in sorted(vectors_by_namespace.items())))
+    spooled = dead_letter_spool.pending()
+    if spooled:
+        logger.warning(f"Vectors in the dead-letter spool: {spooled} - they will be replayed at the start of the next run")
+    if totals['files_spooled']:
+        logger.warning(f"Files left incomplete by spooled batches: {totals['files_spooled']} - not recorded as "
+                       f"ingested, so the next run finishes them once the spool is replayed")
+    logger.info(f"Total stale vectors deleted: {totals['vectors_deleted']}")
+    logger.info(f"Total chunks processed: {totals['chunks_processed']}")
+    if totals['chunks_processed']:
+        logger.info(f"Chunks reusing a duplicate's embedding: {totals['chunks_deduplicated']} "
+                    f"({totals['chunks_deduplicated']/totals['chunks_processed']:.1%})")
+    logger.info(f"Total embedding requests: {pipeline.embedding_requests}")
+    if autotuner is not None:
+        logger.info(f"Autotune: {autotuner.decisions} adjustments, final settings {autotuner.values()} "
+                    f"(saved to {AUTOTUNE_STATE_PATH})")
     logger.info(f"Total processing time: {total_process_time:.2f}s ({total_process_time/60:.1f} minutes)")
     logger.info(f"Average time per file: {total_process_time/total_files_to_process:.2f}s")
     if total_vectors_upserted > 0:
         logger.info(f"Average vectors per second: {total_vectors_upserted/total_process_time:.2f}")
+    logger.info(f"Peak memory (RSS): {peak_memory_mb:.1f}MB")
+    histograms = registry.snapshot()['histograms']
+    stage_seconds = {entry['labels']['stage']: entry['sum'] for entry in histograms.get('stage_seconds', [])}
+    if stage_seconds:
+        logger.info("Worker time by stage: " + ", ".join(
+            f"{stage} {seconds:.1f}s" for stage, seconds in sorted(stage_seconds.items(), key=lambda entry: -entry[1])))
+    openai_seconds = sum(entry['sum'] for entry in histograms.get('openai_request_seconds', []))
+    limiter_seconds = sum(entry['sum'] for entry in histograms.get('openai_rate_limiter_wait_seconds', []))
+    local_seconds = sum(entry['sum'] for entry in histograms.get('local_embedding_seconds', []))
+    sink_seconds = sum(entry['sum'] for entry in histograms.get('vector_sink_seconds', []))
+    if embedder.remote:
+        logger.info(f"Time in OpenAI requests: {openai_seconds:.1f}s, waiting on the OpenAI limiter: {limiter_seconds:.1f}s, "
+                    f"in {VECTOR_SINK}: {sink_seconds:.1f}s")
+    else:
+        logger.info(f"Time in local embedding: {local_seconds:.1f}s, in {VECTOR_SINK}: {sink_seconds:.1f}s")
+    cache_stats = embedding_cache.stats()
+    logger.info(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                f"({cache_stats['hit_rate']:.1%} hit rate), {cache_stats['evictions']} evicted, "
+                f"{cache_stats['entries']} entries stored")
+    limiter_stats = openai_rate_limiter.stats()
+    if embedder.remote:
+        logger.info(f"OpenAI rate limiter: {limiter_stats['throttled_calls']} throttled calls, "
+                    f"{limiter_stats['total_wait_seconds']:.1f}s waiting, {limiter_stats['rate_limit_hits']} 429s, "
+                    f"final limits {limiter_stats['requests_per_minute']:.0f} RPM / {limiter_stats['tokens_per_minute']:.0f} TPM")
     
+    # Dedup ratio per company - boilerplate-heavy filers show up here
+    company_chunks = {}
+    for stats in all_stats:
+        if stats['chunks_processed']:
+            chunks, deduplicated = company_chunks.get(stats['company'], (0, 0))
+            company_chunks[stats['company']] = (chunks + stats['chunks_processed'], deduplicated + stats['chunks_deduplicated'])
+    if near_duplicate_index is not None and company_chunks:
+        logger.info("=== Duplicate chunks by company ===")
+        for company, (chunks, deduplicated) in sorted(company_chunks.items(), key=lambda entry: -entry[1][1] / entry[1][0]):
+            logger.info(f"- {company}: {deduplicated}/{chunks} chunks ({deduplicated/chunks:.1%})")
+
     # Calculate efficiency improvement
     avg_file_time = sum(s['processing_time'] for s in all_stats) / len(all_stats) if all_stats else 0
     sequential_estimate = avg_file_time * total_files_to_process
@@ -390,17 +1333,353 @@ def process_and_upsert_filings():
     logger.info(f"Estimated speedup vs sequential: {speedup:.1f}x")
     
     # Log any files with errors
-    failed_files = [s for s in all_stats if not s['success']]
+    failed_files = [s for s in all_stats if s['error'] is not None and not s['interrupted']]
     if failed_files:
         logger.warning("=== Files with errors ===")
         for stats in failed_files:
             logger.warning(f"- {stats['file_name']}: {stats['error']}")
 
+    return {
+        **totals,
+        'files': total_files_to_process,
+        'files_not_started': len(pipeline.not_started),
+        'interrupted': interrupted,
+        'embedding_requests': pipeline.embedding_requests,
+        'namespaces': len(vectors_by_namespace),
+        'processing_time': total_process_time,
+        'peak_memory_mb': peak_memory_mb,
+    }
+
+def embed_filings() -> dict | None:
+    """
+    `embed`: run the pipeline over the stored filings without writing anything
+    - no vectors, manifest entries or journal records - so its only lasting
+    effect is an embedding cache holding every chunk the next upsert run
+    needs. Embedding, the slow and metered part, can then happen ahead of the
+    upsert run, which is served from the cache.
+    """
+    logger.info(f"=== Phase 2 (embed only): embedding new and changed filings into the cache ===")
+    file_names = filing_store.accession_numbers()
+    if not file_names:
+        warn_no_filings()
+        return None
+    process_start_time = time.time()
+    totals = {'files': len(file_names), 'files_skipped': 0, 'files_with_errors': 0, 'chunks_processed': 0,
+              'chunks_deduplicated': 0}
+    progress_bar = tqdm(total=len(file_names), desc="Embedding filings")
+
+    def on_file_done(stats: dict):
+        totals['files_skipped'] += stats['skipped']
+        totals['files_with_errors'] += stats['error'] is not None
+        totals['chunks_processed'] += stats['chunks_processed']
+        totals['chunks_deduplicated'] += stats['chunks_deduplicated']
+        if stats['error'] is not None:
+            logger.error(f"✗ Failed {stats['file_name']}: {stats['error']}")
+        progress_bar.update(1)
+
+    jobs = new_file_jobs(file_names)
+    embedder.start()
+    with running_parse_pool() as parse_processes:
+        pipeline = IngestionPipeline(
+            load_fn=load_filing,
+            chunk_fn=iter_filing_chunks,
+            embed_fn=get_embeddings_with_retry,  # Caches what it embeds
+            build_fn=lambda job, batch_items, embeddings: [],  # ... and that is all this command is for
+            upsert_fn=upsert_vectors,
+            finalize_fn=lambda job: None,
+            on_file_done=on_file_done,
+            load_workers=max(MAX_CONCURRENT_FILES, parse_processes),
+            chunk_workers=CHUNK_CONCURRENCY,
+            embed_workers=EMBEDDING_CONCURRENCY,
+            upsert_workers=1,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            embed_batch_size=EMBEDDING_BATCH_SIZE,
+            embed_token_budget=EMBEDDING_BATCH_TOKEN_BUDGET,
+            upsert_batch_size=PINECONE_BATCH_SIZE,
+            largest_first=SCHEDULE_LARGEST_FIRST,
+        )
+        with draining_on_signals(pipeline.stop):
+            pipeline.run(jobs)
+    progress_bar.close()
+
+    total_process_time = time.time() - process_start_time
+    cache_stats = embedding_cache.stats()
+    logger.info("=== Embed Summary ===")
+    logger.info(f"Filings embedded: {totals['files'] - totals['files_skipped'] - totals['files_with_errors']}, "
+                f"unchanged (skipped): {totals['files_skipped']}, with errors: {totals['files_with_errors']}")
+    logger.info(f"Chunks: {totals['chunks_processed']}, reusing a duplicate's embedding: {totals['chunks_deduplicated']}, "
+                f"embedding requests: {pipeline.embedding_requests}")
+    logger.info(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                f"{cache_stats['evictions']} evicted, {cache_stats['entries']} entries stored")
+    logger.info(f"Total processing time: {total_process_time:.2f}s")
+    return {
+        **totals,
+        'interrupted': pipeline.stopping,
+        'embedding_requests': pipeline.embedding_requests,
+        'processing_time': total_process_time,
+    }
+
+# --- Phase 2, batch mode: embed through the OpenAI Batch API, then ingest from the cache ---
+
+def load_for_batch(job: FileJob) -> FileJob | None:
+    return job if load_filing(job) else None
+
+def collect_batch_requests(batch_embedder: "BatchEmbedder", file_names: list[str], load_workers: int) -> tuple[int, int]:
+    """
+    Chunk filings in order and queue every chunk that is neither cached nor
+    already in a batch job. Stops after the file that takes the round past
+    BATCH_ROUND_MAX_CHUNKS. Returns (files covered, chunks queued).
+    """
+    queued = 0
+    with ThreadPoolExecutor(max_workers=load_workers, thread_name_prefix="BatchLoader") as executor:
+        for window_start in range(0, len(file_names), load_workers):
+            window = new_file_jobs(file_names[window_start:window_start + load_workers])
+            for offset, job in enumerate(executor.map(load_for_batch, window)):
+                if job is not None:
+                    items = list(iter_filing_chunks(job, reuse_duplicates=False))
+                    keys = [cache_key(batch_embedder.space, item['chunk']) for item in items]
+                    cached = embedding_cache.contains_keys(keys)
+                    for item, key in zip(items, keys):
+                        if key not in cached:
+                            queued += batch_embedder.add(item['chunk'], item['tokens'])
+                if queued >= BATCH_ROUND_MAX_CHUNKS:
+                    return window_start + offset + 1, queued
+    return len(file_names), queued
+
+def run_batch_backfill(resume: bool = False, ingest: bool = True) -> dict | None:
+    """
+    --mode batch: submit every chunk missing from the embedding cache as OpenAI
+    Batch API jobs, wait for them, then run the normal pipeline, which now finds
+    its embeddings in the cache (requests that failed in the batch are embedded
+    synchronously). Works in rounds of at most BATCH_ROUND_MAX_CHUNKS chunks so
+    results are upserted before the cache could evict them. Jobs left by an
+    interrupted run are collected first; nothing in them is resubmitted. A
+    signal during a round's ingest stops after that round (see
+    process_and_upsert_filings); `resume` is passed on to each round.
+    Without `ingest` (`embed --mode batch`) only the first round is embedded
+    and nothing is upserted.
+    """
+    from batch_embedder import BatchEmbedder
+
+    logger.info("=== Phase 2 (batch mode): embedding through the OpenAI Batch API ===")
+    if EMBEDDING_BACKEND != "openai":
+        logger.error(f"Batch mode embeds through OpenAI; EMBEDDING_BACKEND is {EMBEDDING_BACKEND!r}")
+        return None
+    filing_names = filing_store.accession_numbers()
+    if not filing_names:
+        warn_no_filings()
+        return None
+    batch_embedder = BatchEmbedder(openai_client.get(), EMBEDDING_MODEL, embedding_cache.get(), BATCH_DIR, EMBEDDING_BATCH_TOKEN_BUDGET,
+                             EMBEDDING_BATCH_SIZE, poll_seconds=BATCH_POLL_SECONDS, dimensions=EMBEDDING_DIMENSIONS)
+    batch_totals = batch_embedder.wait()
+    if batch_totals['jobs_completed'] or batch_totals['jobs_failed']:
+        logger.info(f"Collected batch jobs from an earlier run: {batch_totals}")
+
+    totals = {}
+    start = 0
+    with running_parse_pool() as parse_processes:
+        while start < len(filing_names):
+            covered, queued = collect_batch_requests(batch_embedder, filing_names[start:], max(MAX_CONCURRENT_FILES, parse_processes))
+            batch_embedder.flush()
+            logger.info(f"Batch round: {queued} chunks queued from {covered} files, waiting for results")
+            for key, value in batch_embedder.wait().items():
+                batch_totals[key] += value
+            if not ingest:
+                if covered < len(filing_names):
+                    logger.info(f"Embedded the chunks of {covered} of {len(filing_names)} filings, as many as one round "
+                                f"keeps cached (BATCH_ROUND_MAX_CHUNKS); `upsert --mode batch` embeds the rest")
+                totals['files'] = covered
+                break
+            summary = process_and_upsert_filings(filing_names[start:start + covered], resume=resume) or {}
+            for key, value in summary.items():
+                if key in ('peak_memory_mb', 'interrupted', 'namespaces'):
+                    totals[key] = max(totals.get(key, 0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+            start += covered
+            if summary.get('interrupted'):
+                break
+    batch_embedder.close()
+    logger.info(f"Batch API totals: {batch_totals}")
+    return {**totals, 'batch': batch_totals}
+
 # --- Main Execution ---
 
-if __name__ == "__main__":
-    target_year = 2024
-    process_and_upsert_filings()
+def partition_argument(name: str | None) -> str | None:
+    return "" if name == "default" else name  # The default namespace's partition has an empty name
 
+def command_fetch(args) -> int:
+    """Phase 1. Only this command needs EDGAR_IDENTITY, and only it imports edgartools."""
+    if not EDGAR_IDENTITY:
+        raise ConfigurationError("EDGAR_IDENTITY environment variable not set. Please set it in your .env file.")
+    from edgar import set_identity
+    from edgar_fetcher import fetch_filings
+
+    set_identity(EDGAR_IDENTITY)
+    logger.info(f"SEC EDGAR identity set successfully")
+    with exporting_telemetry():
+        fetch_filings(
+            year=args.year,
+            store=filing_store.get(),
+            checkpoint_path=FETCH_CHECKPOINT_PATH,
+            quarter=args.quarter,
+            forms=[form.strip() for form in args.forms.split(",") if form.strip()],
+            ciks=[int(cik) for cik in args.ciks.split(",")] if args.ciks else None,
+            max_workers=FETCH_WORKERS,
+            requests_per_second=SEC_REQUESTS_PER_SECOND,
+            dry_run=args.dry_run,
+        )
+    return 0
+
+def command_embed(args) -> int:
+    if args.dry_run:
+        log_plan(plan_run(), "embed")
+        return 0
+    log_settings()
+    open_clients(sink=False)
+    try:
+        with exporting_telemetry():
+            summary = run_batch_backfill(ingest=False) if args.mode == "batch" else embed_filings()
+    finally:
+        close_clients()
+    if summary and summary.get('interrupted'):
+        logger.warning("=== Embedding stopped early - run it again to continue ===")
+        return 130
+    return 0
+
+def command_upsert(args) -> int:
+    if args.abort_rebuild is not None:
+        if args.dry_run:
+            logger.info(f"Dry run: would abandon the rebuild of partition {args.abort_rebuild!r}")
+            return 0
+        abort_partition_rebuild(partition_argument(args.abort_rebuild))
+        return 0
+    partition = partition_argument(args.rebuild_partition)
+    if args.dry_run:
+        log_plan(plan_run(partition), "upsert")
+        return 0
+    log_settings()
+    open_clients()
+    try:
+        with exporting_telemetry():
+            if partition is not None:
+                summary = rebuild_partition(partition, resume=args.resume)
+            elif args.mode == "batch":
+                summary = run_batch_backfill(resume=args.resume)
+            else:
+                summary = process_and_upsert_filings(resume=args.resume)
+    finally:
+        close_clients()
+
+    if summary and summary.get('interrupted'):
+        logger.warning("=== Ingestion stopped early - run `upsert --resume` to continue ===")
+        print("\n--- Ingestion stopped early. Run `upsert --resume` to continue. ---")
+        return 130
     logger.info("=== Ingestion process complete ===")
-    print("\n--- Ingestion process complete. ---")
\ No newline at end of file
+    print("\n--- Ingestion process complete. ---")
+    return 0
+
+def command_status(args) -> int:
+    log_status()
+    return 0
+
+def command_migrate(args) -> int:
+    return 1 if migrate_filings(delete=args.delete) is None else 0
+
+def command_build_index(args) -> int:
+    """Retrain the local store's IVF indexes from scratch, e.g. after heavy churn within LOCAL_VECTOR_IVF_REBUILD_FRACTION."""
+    if VECTOR_SINK != "local":
+        raise ConfigurationError("build-index needs VECTOR_SINK=local; Pinecone maintains its own index")
+    for namespace in vector_sink.namespaces():
+        store = vector_sink.namespace(namespace)
+        if store.stats()['live_vectors'] >= LOCAL_VECTOR_IVF_MIN_VECTORS:
+            store.build_index()
+        else:
+            logger.info(f"Namespace {namespace or 'default'}: fewer than {LOCAL_VECTOR_IVF_MIN_VECTORS} vectors, "
+                        f"searched exactly without an index")
+    vector_sink.close()
+    return 0
+
+def command_serve_chunk_texts(args) -> int:
+    api_key = os.environ.get("CHUNK_TEXT_STORE_API_KEY")
+    if not api_key and not is_loopback_host(args.host):
+        raise ConfigurationError(f"serve-chunk-texts --host {args.host} needs CHUNK_TEXT_STORE_API_KEY; without it "
+                                 f"anyone who can reach the port can read every stored chunk")
+    serve_chunk_texts(chunk_text_store.get() if chunk_text_store is not None else ChunkTextStore(CHUNK_TEXT_STORE_DIR),
+                      host=args.host, port=args.port, api_key=api_key)
+    return 0
+
+COMMANDS = {
+    "fetch": command_fetch,
+    "embed": command_embed,
+    "upsert": command_upsert,
+    "status": command_status,
+    "migrate": command_migrate,
+    "build-index": command_build_index,
+    "serve-chunk-texts": command_serve_chunk_texts,
+}
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Fetch SEC filings and ingest them into Pinecone (or a local vector store).")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="COMMAND")
+    dry_run = argparse.ArgumentParser(add_help=False)
+    dry_run.add_argument("--dry-run", action="store_true",
+                         help="Report what would be done without writing anything or connecting to OpenAI or the vector sink")
+    mode = argparse.ArgumentParser(add_help=False)
+    mode.add_argument("--mode", choices=["sync", "batch"], default="sync",
+                      help="Embed with synchronous requests, or through the OpenAI Batch API (half price, for backfills)")
+
+    fetch = commands.add_parser("fetch", parents=[dry_run], help="Phase 1: fetch filings from EDGAR into the filing store")
+    fetch.add_argument("--year", type=int, default=2024, help="Filing year to fetch")
+    fetch.add_argument("--quarter", type=int, choices=[1, 2, 3, 4], help="Only fetch this quarter of the year")
+    fetch.add_argument("--forms", default="10-K", help="Comma-separated form types, e.g. 10-K,10-Q")
+    fetch.add_argument("--ciks", help="Comma-separated CIKs to restrict the fetch to")
+
+    commands.add_parser("embed", parents=[dry_run, mode],
+                        help="Embed the chunks of new and changed filings into the embedding cache; write no vectors")
+
+    upsert = commands.add_parser("upsert", parents=[dry_run, mode],
+                                 help="Phase 2: ingest new and changed filings into the vector sink")
+    upsert.add_argument("--resume", action="store_true",
+                        help="Continue the last interrupted run, skipping vectors it already wrote")
+    upsert.add_argument("--rebuild-partition", metavar="NAME",
+                        help="Re-ingest one partition into a fresh namespace, switched live when complete "
+                             "('default' with PARTITION_SCHEME=none); see `status` for names")
+    upsert.add_argument("--abort-rebuild", metavar="NAME", help="Give up the rebuild of a partition")
+
+    commands.add_parser("status", help="Show stored and ingested filings, unfinished runs, the spool and partitions")
+
+    migrate = commands.add_parser("migrate", help="Import filing JSON files from the filings data directory into the filing store")
+    migrate.add_argument("--delete", action="store_true", help="Delete each JSON file once it is stored")
+
+    commands.add_parser("build-index", help="Retrain the IVF indexes of the local vector store (VECTOR_SINK=local)")
+
+    serve = commands.add_parser("serve-chunk-texts", help="Serve the chunk text store over HTTP")
+    serve.add_argument("port", type=int)
+    serve.add_argument("--host", default="127.0.0.1",
+                       help="Interface to listen on (default: localhost only; any other needs CHUNK_TEXT_STORE_API_KEY)")
+
+    # Arguments after `bench` are benchmark.py's own, so it gets no help or options of its own here
+    commands.add_parser("bench", add_help=False, help="Run benchmark.py against the mock API server (see benchmark.py --help)")
+    return parser
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "bench":
+        import benchmark
+        return benchmark.main(extra)
+    if extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+
+    # Looking things up writes no log file; neither does a dry run
+    setup_logging(log_file=args.command != "status" and not getattr(args, "dry_run", False))
+    try:
+        check_settings()
+        return COMMANDS[args.command](args)
+    except ConfigurationError as e:
+        logger.error(str(e))
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
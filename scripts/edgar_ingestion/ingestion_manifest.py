@@ -0,0 +1,156 @@
+"""
+Local manifest of what has already been ingested.
+
+For every filing the manifest records the content hash it was ingested from
+(see filing_store.py), the chunking parameters it was processed with, and per
+section the section hash plus the vector IDs written to the index, and the
+namespace they were written to (see partitions.py). Later runs use it to skip
+unchanged filings and sections and to find vectors that no longer exist in the
+source data.
+
+Filings are keyed by `file_name`, which is their accession number since the
+filing store replaced one JSON file per filing (see `rename`).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text: str) -> str:
+    return hash_bytes(text.encode("utf-8"))
+
+
+class IngestionManifest:
+    """Thread-safe SQLite-backed record of ingested filings and their vectors."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS filings (
+                file_name TEXT PRIMARY KEY,
+                accession_number TEXT,
+                size INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                chunk_params TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                namespace TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS sections (
+                file_name TEXT NOT NULL,
+                section TEXT NOT NULL,
+                section_hash TEXT NOT NULL,
+                vector_ids TEXT NOT NULL,
+                PRIMARY KEY (file_name, section)
+            );
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(filings)")}
+        if "namespace" not in columns:  # Manifests from before partitions: everything is in the default namespace
+            self._conn.execute("ALTER TABLE filings ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+        if "mtime" in columns:  # Manifests from when filings were separate JSON files; no longer written or read
+            self._conn.execute("ALTER TABLE filings DROP COLUMN mtime")
+        self._conn.commit()
+
+    def get_filing(self, file_name: str) -> dict | None:
+        """Return the recorded state of a filing, or None if it has never been ingested."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT accession_number, size, content_hash, chunk_params, namespace FROM filings "
+                "WHERE file_name = ?",
+                (file_name,),
+            ).fetchone()
+            if row is None:
+                return None
+            section_rows = self._conn.execute(
+                "SELECT section, section_hash, vector_ids FROM sections WHERE file_name = ?",
+                (file_name,),
+            ).fetchall()
+        return {
+            "accession_number": row[0],
+            "size": row[1],
+            "content_hash": row[2],
+            "chunk_params": json.loads(row[3]),
+            "namespace": row[4],
+            "sections": {
+                section: {"hash": section_hash, "vector_ids": json.loads(vector_ids)}
+                for section, section_hash, vector_ids in section_rows
+            },
+        }
+
+    def record_filing(
+        self,
+        file_name: str,
+        accession_number: str,
+        content_hash: str,
+        chunk_params: dict,
+        sections: dict,
+        size: int = 0,
+        namespace: str = "",
+    ):
+        """
+        Replace the manifest entry for a filing. `sections` maps section name to
+        {"hash": ..., "vector_ids": [...]} and must describe every section now in the index.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO filings "
+                "(file_name, accession_number, size, content_hash, chunk_params, updated_at, namespace) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    file_name,
+                    accession_number,
+                    size,
+                    content_hash,
+                    json.dumps(chunk_params, sort_keys=True),
+                    time.time(),
+                    namespace,
+                ),
+            )
+            self._conn.execute("DELETE FROM sections WHERE file_name = ?", (file_name,))
+            self._conn.executemany(
+                "INSERT INTO sections (file_name, section, section_hash, vector_ids) VALUES (?, ?, ?, ?)",
+                [
+                    (file_name, section, state["hash"], json.dumps(state["vector_ids"]))
+                    for section, state in sections.items()
+                ],
+            )
+            self._conn.commit()
+
+    def rename(self, names: dict[str, str]):
+        """Re-key filings ({old name: new name}), e.g. from `{accession}.json` to the accession number."""
+        with self._lock:
+            for old_name, new_name in names.items():
+                if old_name == new_name or self._conn.execute(
+                        "SELECT 1 FROM filings WHERE file_name = ?", (old_name,)).fetchone() is None:
+                    continue
+                self._conn.execute("DELETE FROM sections WHERE file_name = ?", (new_name,))
+                self._conn.execute("DELETE FROM filings WHERE file_name = ?", (new_name,))
+                self._conn.execute("UPDATE filings SET file_name = ? WHERE file_name = ?", (new_name, old_name))
+                self._conn.execute("UPDATE sections SET file_name = ? WHERE file_name = ?", (new_name, old_name))
+            self._conn.commit()
+
+    def known_files(self) -> set[str]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT file_name FROM filings")}
+
+    def namespaces(self) -> dict[str, str]:
+        """The namespace each ingested filing's vectors are in."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT file_name, namespace FROM filings"))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,497 @@
+"""
+Asyncio ingestion pipeline.
+
+Filings flow through four stages connected by bounded queues:
+
+    load JSON -> chunk -> embed (N in flight) -> upsert (M in flight, per partition)
+
+Each stage has its own worker count, so embedding requests for one filing
+overlap with upserts for another instead of every file waiting on a single
+global lock. Files are loaded largest first (by `FileJob.size`, an estimate of
+their work), so a big filing found late cannot leave the other workers idle
+while it finishes alone. Chunks are packed into embedding requests by token budget across
+sections and files (see token_batcher.py). Blocking work (file I/O, SDK calls)
+runs in a dedicated thread pool sized to the total stage concurrency.
+
+Vectors are buffered per partition (`FileJob.partition`, e.g. a Pinecone
+namespace), not per file, so small filings bound for the same partition share
+full upsert batches. Each partition has its own upsert queue and writers: a
+slow or throttled partition backs up only its own queue, while every writer
+still shares the one `upsert_concurrency` cap on requests in flight. A file's
+vectors left in its partition's buffer are sent, with whatever else is there,
+as soon as the file is fully embedded.
+
+Memory stays bounded: chunk_fn may return a generator, which is pulled one
+embedding batch at a time and stalls whenever the embed queue is full, and each
+full upsert batch of vectors is handed off (and released) as soon as it exists.
+Peak memory is therefore roughly queue_size x batch size per stage rather than
+proportional to the size of the filings in flight.
+
+The pipeline knows nothing about Pinecone or OpenAI; the caller supplies the
+stage functions:
+
+    load_fn(job) -> bool               parse the file into job.data, False to skip it
+    chunk_fn(job) -> iterable[dict]    chunk items, each with a 'chunk' text and 'tokens' count;
+                                       items that already carry an 'embedding' skip the embed stage
+    embed_fn(texts) -> sequence        one embedding per text (e.g. rows of a float32 array)
+    build_fn(job, items, embeddings)   -> list of vectors ready to upsert
+    upsert_fn(vectors, partition)      write one batch of vectors to a partition, returning how
+        -> int | None                  many were written, in order (None for all of them)
+    finalize_fn(job)                   called once every vector of a file is written
+    on_file_done(stats)                called with the file's stats dict
+    on_progress(job, state, vectors)   optional; called (in a worker thread) with "batch_upserted"
+                                       and the vectors written after each batch, and with
+                                       "chunked", "embedded" and "upserted" as a file reaches them
+
+Vectors upsert_fn reports as not written (e.g. set aside for a later retry) are
+counted in the file's `vectors_unwritten` stat and are never reported as
+written; the file is not finalized and does not count as a success, so it is
+picked up again once they have been written.
+
+`stop()` (safe to call from a signal handler) drains the pipeline: files not
+yet loaded are left in `not_started`, chunking stops, and queued embedding
+batches are dropped; requests already in flight finish and every vector built
+is still upserted. Files cut short are marked `interrupted` and are not
+finalized, so a later run can pick them up.
+
+With a `tuner` (see autotuner.py) the embed and upsert worker counts become
+upper bounds: the tuner's `embed_concurrency` and `upsert_concurrency` cap the
+requests in flight, and its `embed_token_budget` and `upsert_batch_size` size
+the batches, all re-read every `tuner.interval` seconds while the run goes on.
+
+Every stage's duration is recorded in the `stage_seconds` histogram, queue
+depths are sampled into `queue_depth` (the upsert queues of all partitions summed), and each filing gets a "filing" span
+with "load" and "finalize" children (see metrics.py).
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from metrics import DEPTH_BUCKETS, registry, tracer
+from token_batcher import TokenBatcher
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SAMPLE_SECONDS = 1.0
+
+
+def _take(iterator, count: int) -> list:
+    """Pull up to `count` items from an iterator (run in a worker thread)."""
+    items = []
+    for item in iterator:
+        items.append(item)
+        if len(items) >= count:
+            break
+    return items
+
+
+class FileJob:
+    """Per-filing state tracked while its batches move through the pipeline."""
+
+    def __init__(self, source, file_name: str, file_index: int, stats: dict, size: int = 0, partition: str = ""):
+        self.source = source  # Where load_fn reads the filing from, e.g. its filing store header
+        self.file_name = file_name
+        self.file_index = file_index
+        self.stats = stats
+        self.size = size  # Estimated work, e.g. the file's size in bytes
+        self.partition = partition  # Where its vectors are written, passed on to upsert_fn
+        self.data = None  # Set by load_fn
+        self.start_time = time.time()
+        self.chunking_done = False
+        self.pending_embed_items = 0
+        self.pending_upsert_batches = 0
+        self.unwritten_vectors = 0  # Vectors upsert_fn did not write, e.g. spooled for a later run
+        self.finished = False
+        self.progress = None  # Last state passed to on_progress: "chunked", "embedded", "upserted"
+        self.interrupted = False  # Chunking was cut short by stop()
+        self.span = None  # Root tracing span, opened when loading starts
+        self.chunk_seconds = 0.0
+
+    def fail(self, error: Exception):
+        self.stats['error'] = str(error)
+
+
+class IngestionPipeline:
+    """Bounded-queue pipeline with independent concurrency per stage."""
+
+    def __init__(
+        self,
+        load_fn,
+        chunk_fn,
+        embed_fn,
+        build_fn,
+        upsert_fn,
+        finalize_fn,
+        on_file_done,
+        on_progress=None,
+        load_workers: int = 4,
+        chunk_workers: int = 2,
+        embed_workers: int = 8,
+        upsert_workers: int = 4,
+        queue_size: int = 32,
+        embed_batch_size: int = 20,
+        embed_token_budget: int = 60_000,
+        upsert_batch_size: int = 100,
+        largest_first: bool = True,
+        tuner=None,
+    ):
+        self.load_fn = load_fn
+        self.chunk_fn = chunk_fn
+        self.embed_fn = embed_fn
+        self.build_fn = build_fn
+        self.upsert_fn = upsert_fn
+        self.finalize_fn = finalize_fn
+        self.on_file_done = on_file_done
+        self.on_progress = on_progress
+        self.load_workers = load_workers
+        self.chunk_workers = chunk_workers
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+        self.embed_token_budget = embed_token_budget
+        self.upsert_batch_size = upsert_batch_size
+        self.largest_first = largest_first
+        self.tuner = tuner
+        # In-flight caps, at most the worker counts; the tuner may change them during a run
+        self.embed_concurrency = embed_workers
+        self.upsert_concurrency = upsert_workers
+        self.embedding_requests = 0
+        self.stopping = False
+        self.not_started = []
+
+    def stop(self):
+        """Stop taking new files, chunks and embedding batches; vectors already built are still upserted."""
+        self.stopping = True
+
+    def run(self, jobs: list[FileJob]):
+        """Run every job through the pipeline and block until all are finished."""
+        asyncio.run(self._run(jobs))
+
+    async def _run(self, jobs: list[FileJob]):
+        total_threads = self.load_workers + self.chunk_workers + self.embed_workers + self.upsert_workers
+        self._executor = ThreadPoolExecutor(max_workers=total_threads, thread_name_prefix="PipelineWorker")
+        self._load_queue = asyncio.Queue()
+        self._chunk_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._embed_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._upsert_queues = {}  # Partition -> queue of batches, created with its writers on first use
+        self._upsert_buffers = {}  # Partition -> [(job, vector)] not yet a full batch
+        self._upsert_writers = []
+        self._batcher = TokenBatcher(self.embed_token_budget, self.embed_batch_size)
+        self._active_chunkers = 0
+        self._in_flight = {"embed": 0, "upsert": 0}
+        self._slots = asyncio.Condition()
+        if self.tuner is not None:
+            await self._apply_settings(self.tuner.values())
+
+        # Stable, so files of equal size keep the caller's order
+        for job in sorted(jobs, key=lambda job: -job.size) if self.largest_first else jobs:
+            self._load_queue.put_nowait(job)
+
+        workers = (
+            [asyncio.create_task(self._load_worker()) for _ in range(self.load_workers)]
+            + [asyncio.create_task(self._chunk_worker()) for _ in range(self.chunk_workers)]
+            + [asyncio.create_task(self._embed_worker()) for _ in range(self.embed_workers)]
+            + [asyncio.create_task(self._sample_queue_depths())]
+            + ([asyncio.create_task(self._autotune())] if self.tuner is not None else [])
+        )
+        try:
+            # Each stage only receives work from the one before it, so joining the
+            # queues in order means every item has been fully processed.
+            await self._load_queue.join()
+            await self._chunk_queue.join()
+            await self._embed_queue.join()
+            # Once embedding is done no new partition can appear, but join in a loop to be sure
+            joined = 0
+            while joined < len(self._upsert_queues):
+                joined = len(self._upsert_queues)
+                for queue in list(self._upsert_queues.values()):
+                    await queue.join()
+        finally:
+            workers += self._upsert_writers
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._executor.shutdown(wait=True)
+
+    async def _in_thread(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _run_stage(self, stage: str, fn, *args):
+        """Run a stage function in the thread pool and record how long it took."""
+        start = time.perf_counter()
+        try:
+            return await self._in_thread(fn, *args)
+        finally:
+            registry.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    async def _report_progress(self, job: FileJob, state: str, vectors: list | None = None):
+        if self.on_progress is None or (vectors is None and (job.stats['error'] is not None or job.interrupted)):
+            return  # A failed or interrupted file never reaches its remaining states
+        try:
+            await self._in_thread(self.on_progress, job, state, vectors)
+        except Exception as e:
+            logger.error(f"Error recording {state} for {job.file_name}: {e}")
+            job.fail(e)
+
+    async def _sample_queue_depths(self):
+        queues = {
+            "load": self._load_queue,
+            "chunk": self._chunk_queue,
+            "embed": self._embed_queue,
+        }
+        while True:
+            depths = {name: queue.qsize() for name, queue in queues.items()}
+            depths["upsert"] = sum(queue.qsize() for queue in self._upsert_queues.values())
+            for name, depth in depths.items():
+                registry.set_gauge("queue_depth", depth, queue=name)
+                registry.observe("queue_depth_samples", depth, buckets=DEPTH_BUCKETS, queue=name)
+            await asyncio.sleep(QUEUE_SAMPLE_SECONDS)
+
+    async def _autotune(self):
+        while True:
+            await asyncio.sleep(self.tuner.interval)
+            changes = self.tuner.step()
+            if changes:
+                await self._apply_settings(changes)
+
+    async def _apply_settings(self, values: dict):
+        for name, value in values.items():
+            if name in ("embed_concurrency", "upsert_concurrency"):
+                value = min(value, self.embed_workers if name == "embed_concurrency" else self.upsert_workers)
+            setattr(self, name, value)
+            if name == "embed_token_budget":
+                self._batcher.token_budget = value
+            elif name == "embed_batch_size":
+                self._batcher.max_items = value
+            registry.set_gauge("pipeline_setting", value, setting=name)
+        async with self._slots:
+            self._slots.notify_all()  # A raised cap frees waiting workers
+
+    @asynccontextmanager
+    async def _slot(self, stage: str):
+        """Hold one of the stage's in-flight slots (see embed_concurrency and upsert_concurrency)."""
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight[stage] < getattr(self, f"{stage}_concurrency"))
+            self._in_flight[stage] += 1
+        try:
+            yield
+        finally:
+            async with self._slots:
+                self._in_flight[stage] -= 1
+                self._slots.notify_all()
+
+    # --- Stage workers ---
+
+    async def _load_worker(self):
+        while True:
+            job = await self._load_queue.get()
+            if self.stopping:
+                self.not_started.append(job)
+                self._load_queue.task_done()
+                continue
+            job.span = tracer.start_span("filing", file=job.file_name)
+            try:
+                with tracer.span("load", parent=job.span):
+                    should_process = await self._run_stage("load", self.load_fn, job)
+                if should_process:
+                    await self._chunk_queue.put(job)
+                else:
+                    await self._finish(job)
+            except Exception as e:
+                logger.error(f"Error loading {job.file_name}: {e}")
+                job.fail(e)
+                await self._finish(job)
+            finally:
+                self._load_queue.task_done()
+
+    async def _chunk_worker(self):
+        while True:
+            job = await self._chunk_queue.get()
+            self._active_chunkers += 1
+            try:
+                chunk_iterator = iter(await self._run_stage("chunk", self.chunk_fn, job))
+                while True:
+                    if self.stopping:
+                        job.interrupted = True
+                        break
+                    # Produce chunks lazily; a full embed queue pauses the generator
+                    take_start = time.perf_counter()
+                    items = await self._run_stage("chunk", _take, chunk_iterator, self.embed_batch_size)
+                    job.chunk_seconds += time.perf_counter() - take_start
+                    if not items:
+                        break
+                    registry.inc("chunks_total", len(items))
+                    for item in items:
+                        if 'embedding' in item:
+                            with registry.timer("stage_seconds", stage="build"):
+                                vectors = self.build_fn(job, [item], [item['embedding']])
+                            await self._buffer_vectors(job, vectors)
+                            continue
+                        job.pending_embed_items += 1
+                        batch = self._batcher.add((job, item), item.get('tokens', 0))
+                        if batch:
+                            await self._embed_queue.put(batch)
+            except Exception as e:
+                logger.error(f"Error chunking {job.file_name}: {e}")
+                job.fail(e)
+            finally:
+                job.chunking_done = True
+                self._active_chunkers -= 1
+                # Send the partially filled batch once nothing else is being chunked,
+                # otherwise its items would wait for chunks that are never coming
+                if not self._active_chunkers and self._chunk_queue.empty():
+                    batch = self._batcher.flush()
+                    if batch:
+                        await self._embed_queue.put(batch)
+                await self._maybe_flush(job)
+                self._chunk_queue.task_done()
+
+    async def _embed_worker(self):
+        while True:
+            batch = await self._embed_queue.get()
+            # A batch can span several files; results are routed back per file
+            items_by_job = {}
+            for job, item in batch:
+                items_by_job.setdefault(job, []).append(item)
+            try:
+                if self.stopping:
+                    for job in items_by_job:
+                        job.interrupted = True
+                    continue  # The finally block still releases the batch
+                async with self._slot("embed"):
+                    embeddings = await self._run_stage("embed", self.embed_fn, [item['chunk'] for _, item in batch])
+                self.embedding_requests += 1
+                registry.inc("embedding_batches_total")
+                registry.observe("embedding_batch_size", len(batch), buckets=DEPTH_BUCKETS)
+                embeddings_by_job = {}
+                for (job, _), embedding in zip(batch, embeddings):
+                    embeddings_by_job.setdefault(job, []).append(embedding)
+                for job, items in items_by_job.items():
+                    job_embeddings = embeddings_by_job[job]
+                    job.stats['embedding_requests'] += 1
+                    with registry.timer("stage_seconds", stage="build"):
+                        vectors = self.build_fn(job, items, job_embeddings)
+                    await self._buffer_vectors(job, vectors)
+            except Exception as e:
+                logger.error(f"Error embedding batch for {', '.join(job.file_name for job in items_by_job)}: {e}")
+                for job in items_by_job:
+                    job.fail(e)
+            finally:
+                for job, items in items_by_job.items():
+                    job.pending_embed_items -= len(items)
+                    await self._maybe_flush(job)
+                self._embed_queue.task_done()
+
+    async def _upsert_worker(self, partition: str, queue: asyncio.Queue):
+        while True:
+            batch = await queue.get()
+            # A batch can span several files of the partition; progress is reported per file
+            vectors_by_job = {}
+            for job, vector in batch:
+                vectors_by_job.setdefault(job, []).append(vector)
+            vectors = [vector for _, vector in batch]
+            try:
+                async with self._slot("upsert"):
+                    written = await self._run_stage("upsert", self.upsert_fn, vectors, partition)
+                written = len(vectors) if written is None else written
+                registry.inc("vectors_upserted_total", written)
+                for job, job_vectors in vectors_by_job.items():
+                    credited = min(len(job_vectors), written)
+                    written -= credited
+                    job.stats['vectors_upserted'] += credited
+                    job.unwritten_vectors += len(job_vectors) - credited
+                    if credited:
+                        await self._report_progress(job, "batch_upserted", job_vectors[:credited])
+            except Exception as e:
+                logger.error(f"Error upserting vectors for {', '.join(job.file_name for job in vectors_by_job)}: {e}")
+                for job in vectors_by_job:
+                    job.fail(e)
+            finally:
+                for job in vectors_by_job:
+                    job.pending_upsert_batches -= 1
+                    await self._maybe_flush(job)
+                queue.task_done()
+
+    # --- Per-file bookkeeping ---
+
+    async def _buffer_vectors(self, job: FileJob, vectors: list):
+        """Add a file's vectors to its partition's buffer and hand off every full upsert batch in it."""
+        self._upsert_buffers.setdefault(job.partition, []).extend((job, vector) for vector in vectors)
+        # Re-read the buffer after every hand-off: while one waits on a full queue, _flush_vectors may
+        # take the buffer as a batch of its own, which must not be modified once it is queued
+        while len(self._upsert_buffers[job.partition]) >= self.upsert_batch_size:
+            buffer = self._upsert_buffers[job.partition]
+            batch, self._upsert_buffers[job.partition] = (buffer[:self.upsert_batch_size],
+                                                          buffer[self.upsert_batch_size:])
+            await self._enqueue_upsert(job.partition, batch)
+
+    async def _flush_vectors(self, partition: str):
+        """Send the partition's partial upsert batch."""
+        batch, self._upsert_buffers[partition] = self._upsert_buffers.get(partition, []), []
+        if batch:
+            await self._enqueue_upsert(partition, batch)
+
+    async def _enqueue_upsert(self, partition: str, batch: list):
+        for job in {job for job, _ in batch}:
+            job.pending_upsert_batches += 1
+        queue = self._upsert_queues.get(partition)
+        if queue is None:
+            queue = self._upsert_queues[partition] = asyncio.Queue(maxsize=self.queue_size)
+            self._upsert_writers += [asyncio.create_task(self._upsert_worker(partition, queue))
+                                     for _ in range(self.upsert_workers)]
+        await queue.put(batch)
+
+    async def _maybe_flush(self, job: FileJob):
+        """Send the file's last vectors (in its partition's partial batch) and finish it once nothing is in flight."""
+        # job.progress changes before each await, so concurrent callers never repeat a step
+        if job.finished or not job.chunking_done:
+            return
+        if job.progress is None:
+            job.progress = "chunked"
+            await self._report_progress(job, "chunked")
+        if job.pending_embed_items:
+            return
+        if job.progress == "chunked":
+            job.progress = "embedded"
+            await self._flush_vectors(job.partition)
+            await self._report_progress(job, "embedded")
+        if job.pending_upsert_batches or job.progress == "upserted":
+            return
+        job.progress = "upserted"
+        await self._report_progress(job, "upserted")
+        await self._finish(job)
+
+    async def _finish(self, job: FileJob):
+        job.finished = True
+        if not job.interrupted and not job.unwritten_vectors:
+            finalize_span = tracer.start_span("finalize", parent=job.span)
+            try:
+                await self._run_stage("finalize", self.finalize_fn, job)
+                finalize_span.end()
+            except Exception as e:
+                logger.error(f"Error finalizing {job.file_name}: {e}")
+                job.fail(e)
+                finalize_span.end(error=str(e))
+        job.stats['interrupted'] = job.interrupted
+        job.stats['vectors_unwritten'] = job.unwritten_vectors
+        job.stats['success'] = job.stats['error'] is None and not job.interrupted and not job.unwritten_vectors
+        job.stats['processing_time'] = time.time() - job.start_time
+        status = ("skipped" if job.stats.get('skipped') else "interrupted" if job.interrupted
+                  else "success" if job.stats['success'] else "unwritten" if job.stats['error'] is None else "failed")
+        registry.inc("files_total", status=status)
+        if job.span is not None:
+            job.span.set_attributes(
+                status=status,
+                chunks=job.stats.get('chunks_processed', 0),
+                vectors_upserted=job.stats['vectors_upserted'],
+                embedding_requests=job.stats['embedding_requests'],
+                chunk_seconds=round(job.chunk_seconds, 3),
+            )
+            job.span.end(error=job.stats['error'])
+        job.data = None  # Release the parsed filing as soon as we are done with it
+        self.on_file_done(job.stats)
@@ -0,0 +1,43 @@
+"""
+Objects created on first use.
+
+`Lazy(factory)` stands in for whatever `factory()` returns: the first
+attribute access calls the factory, and every later one is passed straight
+to the object it made. Module-level clients and stores can then be declared
+next to their settings without connecting, opening files or failing on a
+missing key at import time - only the commands that touch them pay for them.
+
+The object is created once, under a lock, so all threads share one instance
+and, for API clients, one connection pool. Factories are called with the
+module's settings as they are at that moment, so settings changed after
+import (e.g. by the benchmark's overrides) still apply.
+"""
+
+import threading
+
+
+class Lazy:
+    """Thread-safe proxy that creates its object on first attribute access."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._created = False
+
+    @property
+    def created(self) -> bool:
+        """Whether the object exists yet, e.g. to close only what a command actually opened."""
+        return self._created
+
+    def get(self):
+        """The object itself, created now if it was not yet."""
+        if not self._created:
+            with self._lock:
+                if not self._created:
+                    self._value = self._factory()
+                    self._created = True
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
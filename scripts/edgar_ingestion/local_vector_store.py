@@ -0,0 +1,645 @@
+"""
+Local, memory-mapped vector store - a Pinecone stand-in for offline runs,
+reproducible benchmarks and development.
+
+Layout (inside `directory`):
+    store.json        dimension, storage dtype and index options, fixed by the first write
+    vectors.bin       append-only row-major search matrix, read through np.memmap
+    scales.bin        per-row float32 scales (int8 stores only)
+    full.bin          full-precision float32 copies for re-ranking (rerank stores only)
+    metadata.sqlite3  vector_id -> (row, metadata JSON)
+    ivf.npz           IVF centroids and list assignments, from build_index()
+    namespaces/NAME/  a store with this same layout for each namespace but the default one
+
+Vectors are L2-normalised on write so cosine similarity is a dot product.
+`dtype` is "float32", "float16" (half the size, no practical recall loss),
+"int8" (a quarter of the size, symmetric per-row quantization) or "binary"
+(one sign bit per dimension, 1/32 of the size). `index_dimension` keeps only
+the leading dimensions in the search matrix, which for text-embedding-3 models
+is what the API's `dimensions` parameter returns (re-normalised). Upserting an
+existing ID appends a new row and points the ID at it; `compact()` rewrites
+the matrix without the dead rows. Writes and queries given a `namespace`
+go to that namespace's store, opened with the same options on first use.
+
+`query` scores the `nprobe` closest IVF lists plus any rows written since the
+index was built, or the whole matrix when no index exists. `update_index`
+keeps the index current cheaply: new rows are assigned to the existing lists,
+and the centroids are only retrained once the rows written since they were
+trained pass a fraction of the rows they were trained on. With `rerank`, the
+best `top_k * rerank_factor` candidates are then re-scored against their
+full-precision, full-dimension vectors, so a small quantized or truncated
+search matrix loses little recall. Metadata filters use Pinecone's syntax:
+{"field": value}, the $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin operators, and
+$and/$or.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+
+from vector_sinks import VectorSink
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8, "binary": np.uint8}
+DEFAULT_RERANK_FACTOR = 4  # Candidates re-scored per requested match
+_BLOCK_ROWS = 16_384  # Rows dequantized at a time when scanning or assigning
+_KMEANS_SAMPLE = 50_000  # Max rows the IVF centroids are trained on
+DEFAULT_REBUILD_FRACTION = 0.25  # Rows written since training, relative to the rows trained on, that trigger a rebuild
+
+_COMPARISONS = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$gt": lambda value, target: value is not None and value > target,
+    "$gte": lambda value, target: value is not None and value >= target,
+    "$lt": lambda value, target: value is not None and value < target,
+    "$lte": lambda value, target: value is not None and value <= target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target,
+}
+
+
+def matches_filter(metadata: dict, filter: dict) -> bool:
+    """Evaluate a Pinecone-style metadata filter against one vector's metadata."""
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, clause) for clause in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, target in condition.items():
+                if operator not in _COMPARISONS:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+                try:
+                    if not _COMPARISONS[operator](value, target):
+                        return False
+                except TypeError:  # e.g. comparing a string field with a number
+                    return False
+    return True
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for each row of `data`."""
+    assignments = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), _BLOCK_ROWS):
+        assignments[start:start+_BLOCK_ROWS] = np.argmax(data[start:start+_BLOCK_ROWS] @ centroids.T, axis=1)
+    return assignments
+
+
+class LocalVectorStore(VectorSink):
+    """Thread-safe append-only vector matrix with a SQLite metadata sidecar."""
+
+    def __init__(self, directory: str, dtype: str = "float16", index_dimension: int | None = None,
+                 rerank: bool = False, rerank_factor: int = DEFAULT_RERANK_FACTOR):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {sorted(DTYPES)}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dimension = None
+        self.dtype = dtype
+        self.index_dimension = index_dimension
+        self.rerank = rerank
+        self.rerank_factor = rerank_factor
+        self._config_path = os.path.join(directory, "store.json")
+        if os.path.exists(self._config_path):
+            with open(self._config_path) as f:
+                config = json.load(f)
+            for option in ("dtype", "index_dimension", "rerank"):
+                stored = config.get(option)
+                if stored != getattr(self, option):
+                    logger.warning(f"Local vector store {directory} was created with {option}={stored}; "
+                                   f"ignoring {option}={getattr(self, option)}")
+                setattr(self, option, stored)
+            self.dimension = config["dimension"]
+        self._np_dtype = np.dtype(DTYPES[self.dtype])
+        self._vectors_path = os.path.join(directory, "vectors.bin")
+        self._scales_path = os.path.join(directory, "scales.bin")
+        self._full_path = os.path.join(directory, "full.bin")
+        self._ivf_path = os.path.join(directory, "ivf.npz")
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(os.path.join(directory, "metadata.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vectors (
+                vector_id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                metadata TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_row ON vectors(row)")
+        self._conn.commit()
+
+        self._row_count = self._recover_row_count()
+        self._live = bytearray(self._row_count)  # 1 for rows some vector ID currently points at
+        for (row,) in self._conn.execute("SELECT row FROM vectors"):
+            if row < self._row_count:
+                self._live[row] = 1
+        self._open_writers()
+        self._matrix = None  # np.memmap views, reopened after rows are added
+        self._scales = None
+        self._full = None
+        self._ivf = None
+        self._ivf_trained = (0, 0)  # (row count, live rows) when the centroids were trained
+        self._load_ivf()
+        self._namespaces = {}  # Name -> LocalVectorStore, opened on first use
+        self._namespaces_lock = threading.Lock()
+
+    # --- Namespaces ---
+
+    def namespace(self, name: str) -> "LocalVectorStore":
+        """The store for namespace `name`; "" is this store itself."""
+        if not name:
+            return self
+        with self._namespaces_lock:
+            store = self._namespaces.get(name)
+            if store is None:
+                store = self._namespaces[name] = LocalVectorStore(
+                    os.path.join(self.directory, "namespaces", name), dtype=self.dtype,
+                    index_dimension=self.index_dimension, rerank=self.rerank, rerank_factor=self.rerank_factor)
+            return store
+
+    def namespaces(self) -> list[str]:
+        """Every namespace with a store on disk, the default one ("") first."""
+        directory = os.path.join(self.directory, "namespaces")
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        return [""] + [name for name in names if os.path.isdir(os.path.join(directory, name))]
+
+    def delete_namespace(self, namespace: str):
+        if not namespace:
+            with self._lock:
+                vector_ids = [vector_id for (vector_id,) in self._conn.execute("SELECT vector_id FROM vectors")]
+            self.delete(vector_ids)
+            return
+        with self._namespaces_lock:
+            store = self._namespaces.pop(namespace, None)
+        if store is not None:
+            store.close()
+        shutil.rmtree(os.path.join(self.directory, "namespaces", namespace), ignore_errors=True)
+
+    # --- Files ---
+
+    @property
+    def _search_dimension(self) -> int:
+        return min(self.index_dimension or self.dimension, self.dimension)
+
+    @property
+    def _row_width(self) -> int:
+        """Elements per row of the search matrix (bytes of packed bits for binary stores)."""
+        return (self._search_dimension + 7) // 8 if self.dtype == "binary" else self._search_dimension
+
+    def _recover_row_count(self) -> int:
+        """Count whole rows on disk, truncating a row torn by a crash mid-append."""
+        if self.dimension is None:
+            return 0
+        files = [(self._vectors_path, self._row_width * self._np_dtype.itemsize)]
+        if self.dtype == "int8":
+            files.append((self._scales_path, 4))
+        if self.rerank:
+            files.append((self._full_path, self.dimension * 4))
+        count = min(
+            os.path.getsize(path) // row_bytes if os.path.exists(path) else 0 for path, row_bytes in files
+        )
+        for path, row_bytes in files:
+            if os.path.exists(path) and os.path.getsize(path) > count * row_bytes:
+                os.truncate(path, count * row_bytes)
+        return count
+
+    def _open_writers(self):
+        self._vector_writer = open(self._vectors_path, "ab")
+        self._scale_writer = open(self._scales_path, "ab") if self.dtype == "int8" else None
+        self._full_writer = open(self._full_path, "ab") if self.rerank else None
+
+    def _writers(self) -> list:
+        return [writer for writer in (self._vector_writer, self._scale_writer, self._full_writer) if writer is not None]
+
+    def _close_writers(self):
+        for writer in self._writers():
+            writer.close()
+
+    def _refresh_views_locked(self):
+        if self._matrix is not None and len(self._matrix) == self._row_count:
+            return
+        self._matrix = self._scales = self._full = None
+        if not self._row_count:
+            return
+        for writer in self._writers():
+            writer.flush()
+        self._matrix = np.memmap(self._vectors_path, dtype=self._np_dtype, mode="r", shape=(self._row_count, self._row_width))
+        if self._scale_writer is not None:
+            self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(self._row_count,))
+        if self._full_writer is not None:
+            self._full = np.memmap(self._full_path, dtype=np.float32, mode="r", shape=(self._row_count, self.dimension))
+
+    def _rows_as_float32(self, selector) -> np.ndarray:
+        """Search-matrix rows as approximately unit-length float32 vectors."""
+        if self.dtype == "binary":
+            bits = np.unpackbits(np.asarray(self._matrix[selector]), axis=1, count=self._search_dimension)
+            return (bits.astype(np.float32) * 2 - 1) / np.sqrt(np.float32(self._search_dimension))
+        block = np.array(self._matrix[selector], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[selector][:, None]
+        return block
+
+    def _score_rows(self, selector, query_vector: np.ndarray, byte_tables: np.ndarray | None) -> np.ndarray:
+        """Approximate dot products of search-matrix rows with the (search-dimension) query."""
+        if byte_tables is None:
+            return self._rows_as_float32(selector) @ query_vector
+        # Binary rows: sum the query's per-byte contributions instead of unpacking the bits
+        packed = np.asarray(self._matrix[selector])
+        return byte_tables[np.arange(packed.shape[1]), packed].sum(axis=1)
+
+    def _binary_byte_tables(self, query_vector: np.ndarray) -> np.ndarray:
+        """
+        For each byte of a packed row, the dot product of the query with every
+        possible byte value (bits mapped to +-1/sqrt(d)), shape (row bytes, 256).
+        """
+        padded = np.zeros(self._row_width * 8, dtype=np.float32)
+        padded[:len(query_vector)] = query_vector / np.sqrt(np.float32(self._search_dimension))
+        bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.float32) * 2 - 1
+        return padded.reshape(self._row_width, 8) @ bits.T  # Zero query padding cancels the pad bits
+
+    def _search_vector(self, vector: np.ndarray) -> np.ndarray:
+        """Truncate unit vectors to the search dimension and re-normalise them."""
+        if self._search_dimension == vector.shape[-1]:
+            return vector
+        truncated = vector[..., :self._search_dimension]
+        norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+        return truncated / np.where(norms == 0, 1.0, norms)
+
+    def _live_mask_locked(self) -> np.ndarray:
+        return np.frombuffer(bytes(self._live), dtype=np.bool_)
+
+    # --- Writing ---
+
+    def upsert(self, vectors: list[dict], namespace: str = ""):
+        if namespace:
+            self.namespace(namespace).upsert(vectors)
+            return
+        if not vectors:
+            return
+        matrix = np.asarray([vector["values"] for vector in vectors], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = matrix.shape[1]
+                with open(self._config_path, "w") as f:
+                    json.dump({"dimension": self.dimension, "dtype": self.dtype,
+                               "index_dimension": self.index_dimension, "rerank": self.rerank}, f)
+            elif matrix.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension {matrix.shape[1]} does not match store dimension {self.dimension}")
+
+            search = self._search_vector(matrix)
+            scales = None
+            if self.dtype == "int8":
+                scales = np.abs(search).max(axis=1) / 127.0
+                scales[scales == 0] = 1.0
+                rows = np.round(search / scales[:, None]).astype(np.int8)
+            elif self.dtype == "binary":
+                rows = np.packbits(search > 0, axis=1)
+            else:
+                rows = search.astype(self._np_dtype)
+
+            # Rows hit the disk before the metadata points at them
+            self._vector_writer.write(rows.tobytes())
+            if scales is not None:
+                self._scale_writer.write(scales.astype(np.float32).tobytes())
+            if self._full_writer is not None:
+                self._full_writer.write(matrix.tobytes())
+            for writer in self._writers():
+                writer.flush()
+
+            for row in self._rows_for_ids_locked([vector["id"] for vector in vectors]):
+                self._live[row] = 0
+            first_row = self._row_count
+            self._row_count += len(vectors)
+            self._live.extend(bytes(len(vectors)))
+            latest = {}  # A repeated ID within the batch keeps its last row
+            for offset, vector in enumerate(vectors):
+                latest[vector["id"]] = (first_row + offset, vector.get("metadata") or {})
+            for row, _ in latest.values():
+                self._live[row] = 1
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (vector_id, row, metadata) VALUES (?, ?, ?)",
+                [(vector_id, row, json.dumps(metadata)) for vector_id, (row, metadata) in latest.items()],
+            )
+            self._conn.commit()
+
+    def delete(self, vector_ids: list[str], namespace: str = ""):
+        if namespace:
+            self.namespace(namespace).delete(vector_ids)
+            return
+        with self._lock:
+            for row in self._rows_for_ids_locked(vector_ids):
+                self._live[row] = 0
+            self._conn.executemany("DELETE FROM vectors WHERE vector_id = ?", [(vector_id,) for vector_id in vector_ids])
+            self._conn.commit()
+
+    def _rows_for_ids_locked(self, vector_ids: list[str]) -> list[int]:
+        rows = []
+        for i in range(0, len(vector_ids), 500):
+            id_batch = vector_ids[i:i+500]
+            placeholders = ",".join("?" * len(id_batch))
+            rows.extend(
+                row for (row,) in self._conn.execute(f"SELECT row FROM vectors WHERE vector_id IN ({placeholders})", id_batch)
+                if row < self._row_count
+            )
+        return rows
+
+    def flush(self):
+        with self._namespaces_lock:
+            stores = list(self._namespaces.values())
+        for store in stores:
+            store.flush()
+        with self._lock:
+            for writer in self._writers():
+                writer.flush()
+                os.fsync(writer.fileno())
+
+    # --- Index ---
+
+    def build_index(self, nlist: int | None = None, iterations: int = 10, seed: int = 0):
+        """
+        Train an IVF coarse quantizer (spherical k-means on a sample of live
+        rows) and assign every live row to its closest list. `nlist` defaults
+        to sqrt(live rows).
+        """
+        with self._lock:
+            self._build_index_locked(nlist, iterations, seed)
+
+    def update_index(self, rebuild_fraction: float = DEFAULT_REBUILD_FRACTION) -> str:
+        """
+        Bring the IVF index up to date after writes. Rows written since the
+        last update are assigned to the existing lists, which is one pass over
+        just those rows; the centroids are retrained (`build_index`) only when
+        there is no index yet, or when the rows written since training exceed
+        `rebuild_fraction` of the live rows trained on, as by then the lists
+        no longer reflect the data. Returns "built", "extended" or "current".
+        """
+        with self._lock:
+            self._refresh_views_locked()
+            if self._matrix is None:
+                return "current"
+            trained_row_count, trained_live_rows = self._ivf_trained
+            if self._ivf is None or self._row_count - trained_row_count > rebuild_fraction * trained_live_rows:
+                self._build_index_locked()
+                return "built"
+            centroids, _, _, indexed_rows = self._ivf
+            if indexed_rows == self._row_count:
+                return "current"
+            live = self._live_mask_locked()
+            tail = np.full(self._row_count - indexed_rows, -1, dtype=np.int32)
+            live_tail = np.flatnonzero(live[indexed_rows:])
+            for start in range(0, len(live_tail), _BLOCK_ROWS):
+                rows = live_tail[start:start+_BLOCK_ROWS]
+                tail[rows] = _assign(self._rows_as_float32(rows + indexed_rows), centroids)
+            self._save_ivf_locked(centroids, np.concatenate([self._ivf_assignments, tail]))
+            logger.info(f"Added {len(live_tail)} vectors to the IVF index ({len(centroids)} lists)")
+            return "extended"
+
+    def _build_index_locked(self, nlist: int | None = None, iterations: int = 10, seed: int = 0):
+        self._refresh_views_locked()
+        if self._matrix is None:
+            return
+        live_rows = np.flatnonzero(self._live_mask_locked())
+        if not len(live_rows):
+            return
+        nlist = min(nlist or max(1, int(np.sqrt(len(live_rows)))), len(live_rows))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(live_rows, size=min(len(live_rows), _KMEANS_SAMPLE), replace=False))
+        data = self._rows_as_float32(sample_rows)
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = _assign(data, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+            order = np.argsort(assignments, kind="stable")
+            filled = np.flatnonzero(counts)
+            starts = np.searchsorted(assignments[order], filled)
+            sums = np.add.reduceat(data[order], starts, axis=0)
+            centroids[filled] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+
+        assignments = np.full(self._row_count, -1, dtype=np.int32)
+        for start in range(0, len(live_rows), _BLOCK_ROWS):
+            rows = live_rows[start:start+_BLOCK_ROWS]
+            assignments[rows] = _assign(self._rows_as_float32(rows), centroids)
+
+        self._ivf_trained = (self._row_count, len(live_rows))
+        self._save_ivf_locked(centroids, assignments)
+        logger.info(f"Built IVF index over {len(live_rows)} vectors with {nlist} lists")
+
+    def _save_ivf_locked(self, centroids: np.ndarray, assignments: np.ndarray):
+        temp_path = os.path.join(self.directory, "ivf.tmp.npz")
+        np.savez(temp_path, centroids=centroids, assignments=assignments, trained=np.array(self._ivf_trained))
+        os.replace(temp_path, self._ivf_path)
+        self._set_ivf(centroids, assignments)
+
+    def _load_ivf(self):
+        if not os.path.exists(self._ivf_path):
+            return
+        with np.load(self._ivf_path) as ivf:
+            centroids, assignments = ivf["centroids"], ivf["assignments"]
+            # Indexes from before update_index: trained on every row they cover
+            trained = tuple(ivf["trained"]) if "trained" in ivf else (len(assignments), int((assignments >= 0).sum()))
+        if len(assignments) > self._row_count:
+            logger.warning(f"Ignoring IVF index in {self.directory}: it covers rows that are no longer on disk")
+            return
+        self._ivf_trained = (int(trained[0]), int(trained[1]))
+        self._set_ivf(centroids, assignments)
+
+    def _set_ivf(self, centroids: np.ndarray, assignments: np.ndarray):
+        # Rows grouped by list; rows that were dead at build time (-1) sort first and are never probed
+        self._ivf_assignments = assignments
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        self._ivf = (centroids, order, bounds, len(assignments))
+
+    # --- Reading ---
+
+    def query(self, vector, top_k: int = 10, filter: dict | None = None, nprobe: int = 8,
+              include_metadata: bool = True, namespace: str = "") -> list[dict]:
+        """
+        Return up to `top_k` matches as {"id", "score", "metadata"} dicts, best first.
+        With an IVF index, filters only see the probed lists, so a very
+        selective filter may need a larger `nprobe`. In rerank stores, only the
+        re-ranked candidates are eligible when there is no filter; with a
+        filter, rows past the candidates follow in approximate order.
+        """
+        if namespace:
+            return self.namespace(namespace).query(vector, top_k, filter, nprobe, include_metadata)
+        query_vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return []
+        query_vector = query_vector / norm
+
+        with self._lock:
+            self._refresh_views_locked()
+            if self._matrix is None:
+                return []
+            full_query, query_vector = query_vector, self._search_vector(query_vector)
+            if self._ivf is not None:
+                centroids, order, bounds, indexed_rows = self._ivf
+                probed = np.argsort(-(centroids @ query_vector))[:nprobe]
+                rows = np.concatenate(
+                    [order[bounds[c]:bounds[c + 1]] for c in probed] + [np.arange(indexed_rows, self._row_count)]
+                )
+            else:
+                rows = np.arange(self._row_count)
+            rows = rows[self._live_mask_locked()[rows]]
+            rows.sort()  # Sequential reads through the memmap
+            scores = np.empty(len(rows), dtype=np.float32)
+            byte_tables = self._binary_byte_tables(query_vector) if self.dtype == "binary" else None
+            for start in range(0, len(rows), _BLOCK_ROWS):
+                scores[start:start+_BLOCK_ROWS] = self._score_rows(rows[start:start+_BLOCK_ROWS], query_vector, byte_tables)
+
+            if self._full is not None:
+                ranked = self._rerank_locked(rows, scores, full_query, top_k * self.rerank_factor, filter is None)
+            elif filter is None and len(scores) > top_k:
+                best = np.argpartition(-scores, top_k)[:top_k]
+                ranked = best[np.argsort(-scores[best])]
+            else:
+                ranked = np.argsort(-scores)
+
+            matches = []
+            page_size = max(top_k * 4, 64)
+            for start in range(0, len(ranked), page_size):
+                page = ranked[start:start+page_size]
+                page_rows = [int(row) for row in rows[page]]
+                placeholders = ",".join("?" * len(page_rows))
+                records = {
+                    row: (vector_id, metadata)
+                    for vector_id, row, metadata in self._conn.execute(
+                        f"SELECT vector_id, row, metadata FROM vectors WHERE row IN ({placeholders})", page_rows
+                    )
+                }
+                for row, score in zip(page_rows, scores[page]):
+                    if row not in records:
+                        continue
+                    vector_id, metadata = records[row]
+                    metadata = json.loads(metadata)
+                    if filter is not None and not matches_filter(metadata, filter):
+                        continue
+                    match = {"id": vector_id, "score": float(score)}
+                    if include_metadata:
+                        match["metadata"] = metadata
+                    matches.append(match)
+                    if len(matches) == top_k:
+                        return matches
+        return matches
+
+    def _rerank_locked(self, rows: np.ndarray, scores: np.ndarray, query_vector: np.ndarray, candidates: int,
+                       candidates_only: bool) -> np.ndarray:
+        """
+        Re-score the best `candidates` approximate matches with full-precision
+        vectors, overwriting their entries in `scores`. Returns positions into
+        `rows` ordered best first: the re-ranked candidates, then (unless
+        `candidates_only`) everything else by approximate score.
+        """
+        if len(scores) > candidates:
+            head = np.argpartition(-scores, candidates)[:candidates]
+        else:
+            head = np.arange(len(scores))
+        head = head[np.argsort(rows[head])]  # Sequential reads through the memmap
+        scores[head] = np.asarray(self._full[rows[head]]) @ query_vector
+        head = head[np.argsort(-scores[head])]
+        if candidates_only or len(head) == len(scores):
+            return head
+        rest = np.ones(len(scores), dtype=bool)
+        rest[head] = False
+        rest = np.flatnonzero(rest)
+        return np.concatenate([head, rest[np.argsort(-scores[rest])]])
+
+    # --- Maintenance ---
+
+    def compact(self) -> int:
+        """
+        Rewrite the matrix without dead rows and drop the IVF index. Returns the
+        number of rows removed. Not crash-safe: run it while nothing else writes.
+        """
+        with self._lock:
+            self._refresh_views_locked()
+            if self._matrix is None:
+                return 0
+            live_rows = np.flatnonzero(self._live_mask_locked())
+            removed = self._row_count - len(live_rows)
+            if not removed:
+                return 0
+
+            new_rows = np.full(self._row_count, -1, dtype=np.int64)
+            new_rows[live_rows] = np.arange(len(live_rows))
+            with open(self._vectors_path + ".tmp", "wb") as f:
+                for start in range(0, len(live_rows), _BLOCK_ROWS):
+                    f.write(np.asarray(self._matrix[live_rows[start:start+_BLOCK_ROWS]]).tobytes())
+            if self._scales is not None:
+                with open(self._scales_path + ".tmp", "wb") as f:
+                    f.write(np.asarray(self._scales[live_rows]).tobytes())
+            if self._full is not None:
+                with open(self._full_path + ".tmp", "wb") as f:
+                    for start in range(0, len(live_rows), _BLOCK_ROWS):
+                        f.write(np.asarray(self._full[live_rows[start:start+_BLOCK_ROWS]]).tobytes())
+
+            records = self._conn.execute("SELECT vector_id, row FROM vectors").fetchall()
+            self._conn.executemany(
+                "UPDATE vectors SET row = ? WHERE vector_id = ?",
+                [(int(new_rows[row]), vector_id) for vector_id, row in records if row < self._row_count],
+            )
+            self._matrix = self._scales = self._full = None
+            self._close_writers()
+            os.replace(self._vectors_path + ".tmp", self._vectors_path)
+            if self.dtype == "int8":
+                os.replace(self._scales_path + ".tmp", self._scales_path)
+            if self.rerank:
+                os.replace(self._full_path + ".tmp", self._full_path)
+            self._conn.commit()
+            self._open_writers()
+
+            self._row_count = len(live_rows)
+            self._live = bytearray(b"\x01" * self._row_count)
+            self._ivf = None
+            if os.path.exists(self._ivf_path):
+                os.remove(self._ivf_path)
+            logger.info(f"Compacted local vector store: removed {removed} dead rows")
+            return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rows": self._row_count,
+                "live_vectors": self._live.count(1),
+                "dimension": self.dimension,
+                "index_dimension": self._search_dimension if self.dimension else self.index_dimension,
+                "dtype": self.dtype,
+                "bytes": os.path.getsize(self._vectors_path),  # Search matrix, the part scanned per query
+                "rerank_bytes": os.path.getsize(self._full_path) if self.rerank else 0,
+                "ivf_lists": len(self._ivf[0]) if self._ivf is not None else 0,
+            }
+
+    def close(self):
+        self.flush()
+        with self._namespaces_lock:
+            stores, self._namespaces = list(self._namespaces.values()), {}
+        for store in stores:
+            store.close()
+        with self._lock:
+            self._matrix = self._scales = self._full = None
+            self._close_writers()
+            self._conn.close()
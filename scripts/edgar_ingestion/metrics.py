@@ -0,0 +1,299 @@
+"""
+Counters, histograms and per-filing spans for the ingestion scripts.
+
+Modules record into the process-wide `registry`:
+
+    registry.inc("openai_retries_total")
+    registry.observe("openai_request_seconds", elapsed)
+    with registry.timer("filing_load_seconds"):
+        ...
+
+`registry.write(path)` exports everything either in the Prometheus text format
+(`.prom`, e.g. for node_exporter's textfile collector, rewritten atomically) or
+as one JSON snapshot per line (`.jsonl`, appended). `MetricsExporter` does this
+periodically from a background thread so long runs can be watched live.
+
+`tracer` writes OpenTelemetry-style spans (trace/span/parent IDs, start and end
+times, attributes, status) as JSON lines once `tracer.configure(path)` is
+called; until then spans cost next to nothing and are not recorded.
+"""
+
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "edgar_ingestion_"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key: tuple, extra: tuple = ()) -> str:
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # Per bucket, made cumulative on export
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Thread-safe store of labelled counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # name -> {label key: value}
+        self._gauges = {}
+        self._histograms = {}  # name -> {label key: _Histogram}
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, buckets: tuple = DURATION_BUCKETS, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the duration of the `with` block in seconds, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    # --- Export ---
+
+    def snapshot(self) -> dict:
+        """Plain-dict view: {"counters": {name: [{"labels", "value"}]}, "gauges": ..., "histograms": ...}."""
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self._counters.items()
+                },
+                "gauges": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self._gauges.items()
+                },
+                "histograms": {
+                    name: [
+                        {
+                            "labels": dict(key),
+                            "count": histogram.count,
+                            "sum": histogram.sum,
+                            "buckets": dict(zip((str(bound) for bound in histogram.buckets), histogram.counts)),
+                        }
+                        for key, histogram in series.items()
+                    ]
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = METRIC_PREFIX + name
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_format_labels(key)} {_format_number(value)}")
+            for name, series in sorted(self._gauges.items()):
+                metric = METRIC_PREFIX + name
+                lines.append(f"# TYPE {metric} gauge")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_format_labels(key)} {_format_number(value)}")
+            for name, series in sorted(self._histograms.items()):
+                metric = METRIC_PREFIX + name
+                lines.append(f"# TYPE {metric} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_format_labels(key, (('le', _format_number(bound)),))} {cumulative}")
+                    lines.append(f"{metric}_bucket{_format_labels(key, (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{metric}_sum{_format_labels(key)} {_format_number(histogram.sum)}")
+                    lines.append(f"{metric}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Write to `path`: Prometheus text for .prom files, otherwise append a JSON line."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if path.endswith(".prom"):
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(self.to_prometheus())
+            os.replace(temp_path, path)  # Scrapers never see a half-written file
+        else:
+            with open(path, "a") as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+
+
+registry = MetricsRegistry()
+
+
+class MetricsExporter:
+    """Writes `registry` to `path` every `interval` seconds until stopped, and once more on stop."""
+
+    def __init__(self, path: str, interval: float = 15.0, metrics: MetricsRegistry = registry):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="MetricsExporter", daemon=True)
+
+    def start(self) -> "MetricsExporter":
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def _write(self):
+        try:
+            self.metrics.write(self.path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.path}: {e}")
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._write()
+
+
+# --- Tracing ---
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: str | None, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.ended = False
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: str | None = None):
+        if self.ended:
+            return
+        self.ended = True
+        self.tracer._record(self, time.time_ns(), error)
+
+
+class Tracer:
+    """Records finished spans as JSON lines. Disabled until `configure(path)` is called."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def configure(self, path: str | None):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if path:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._file = open(path, "a")
+
+    def start_span(self, name: str, parent: Span | None = None, **attributes) -> Span:
+        trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        return Span(self, name, trace_id, parent.span_id if parent is not None else None, attributes)
+
+    @contextmanager
+    def span(self, name: str, parent: Span | None = None, **attributes):
+        span = self.start_span(name, parent, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            span.end(error=str(e))
+            raise
+        span.end()
+
+    def _record(self, span: Span, end_ns: int, error: str | None):
+        if self._file is None:
+            return
+        record = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_span_id": span.parent_id,
+            "name": span.name,
+            "start_time_unix_nano": span.start_ns,
+            "end_time_unix_nano": end_ns,
+            "duration_ms": round((end_ns - span.start_ns) / 1e6, 3),
+            "attributes": span.attributes,
+            "status": "ERROR" if error else "OK",
+        }
+        if error:
+            record["error"] = error
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+
+    def close(self):
+        self.configure(None)
+
+
+tracer = Tracer()
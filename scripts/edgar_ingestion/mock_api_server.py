@@ -0,0 +1,355 @@
+"""
+Local HTTP stand-in for the OpenAI embeddings API and the Pinecone data plane,
+used by the benchmark harness (`benchmark.py`).
+
+    POST /v1/embeddings     OpenAI-compatible, float or base64 encoding
+    POST /v1/files          OpenAI-compatible upload of batch input files
+    POST /v1/batches        OpenAI Batch API, /v1/embeddings endpoint only
+    GET  /v1/batches/<id>
+    GET  /v1/files/<id>/content
+    POST /vectors/upsert    Pinecone-compatible
+    POST /vectors/delete    Pinecone-compatible
+
+Point the ingestion script at it with OPENAI_BASE_URL=<url>/v1 and
+PINECONE_INDEX_HOST=<url>.
+
+Latency, OpenAI-style RPM/TPM limits (429 with retry-after-ms and
+x-ratelimit-* headers) and randomly injected 429/5xx errors are configurable.
+Embeddings are pseudo-random unit vectors seeded by the input text, so the same
+text always gets the same vector. Batches complete `batch_latency_seconds`
+after they are created, when they are next polled.
+"""
+
+import base64
+import email.parser
+import email.policy
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def fake_embedding(text: str, dimension: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class MockApiServer:
+    """Threaded mock server. Call start(), point clients at `url`, then stop()."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        dimension: int = 1536,
+        embedding_latency_ms: float = 150.0,
+        embedding_ms_per_1k_tokens: float = 5.0,
+        upsert_latency_ms: float = 40.0,
+        latency_jitter: float = 0.25,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        error_rate_429: float = 0.0,
+        error_rate_5xx: float = 0.0,
+        batch_latency_seconds: float = 2.0,
+        seed: int = 0,
+    ):
+        self.dimension = dimension
+        self.embedding_latency_ms = embedding_latency_ms
+        self.embedding_ms_per_1k_tokens = embedding_ms_per_1k_tokens
+        self.upsert_latency_ms = upsert_latency_ms
+        self.latency_jitter = latency_jitter
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.batch_latency_seconds = batch_latency_seconds
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._files = {}  # file ID -> bytes
+        self._batches = {}  # batch ID -> batch object
+        self.counts = {
+            "embedding_requests": 0,
+            "embedding_inputs": 0,
+            "embedding_tokens": 0,
+            "upsert_requests": 0,
+            "vectors_upserted": 0,
+            "delete_requests": 0,
+            "vectors_deleted": 0,
+            "rate_limited_429": 0,
+            "injected_429": 0,
+            "injected_5xx": 0,
+            "batch_jobs": 0,
+            "batch_inputs": 0,
+            "namespaces": 0,  # Distinct namespaces upserted to
+        }
+        self._namespaces = set()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockApiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MockApiServer", daemon=True)
+        self._thread.start()
+        logger.info(f"Mock OpenAI/Pinecone server listening on {self.url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                self.counts[name] += amount
+
+    def _sleep(self, milliseconds: float):
+        with self._lock:
+            factor = self._random.uniform(1 - self.latency_jitter, 1 + self.latency_jitter)
+        time.sleep(max(0.0, milliseconds * factor) / 1000)
+
+    def _roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def _rate_limit(self, tokens: int) -> tuple[dict, float | None]:
+        """Charge one request against the RPM/TPM buckets. Returns (headers, retry_after_seconds or None)."""
+        headers = {}
+        wait = 0.0
+        with self._lock:
+            now = time.monotonic()
+            buckets = [(name, bucket, cost) for name, bucket, cost in
+                       (("requests", self._requests, 1), ("tokens", self._tokens, tokens)) if bucket is not None]
+            for _, bucket, cost in buckets:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(cost))
+            for name, bucket, cost in buckets:
+                if wait <= 0:
+                    bucket.available -= min(cost, bucket.capacity)
+                reset = (bucket.capacity - bucket.available) / bucket.refill_rate
+                headers[f"x-ratelimit-limit-{name}"] = str(int(bucket.capacity))
+                headers[f"x-ratelimit-remaining-{name}"] = str(max(0, int(bucket.available)))
+                headers[f"x-ratelimit-reset-{name}"] = f"{max(reset, 0.0) * 1000:.0f}ms"
+        return headers, wait if wait > 0 else None
+
+    def _embedding_response(self, body: dict) -> dict:
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        tokens = sum(len(text) // 4 + 1 for text in inputs)
+        base64_encoded = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, self.dimension)
+            if body.get("dimensions"):
+                # text-embedding-3 shortening: the leading dimensions, re-normalised
+                vector = vector[:body["dimensions"]] / np.linalg.norm(vector[:body["dimensions"]])
+            embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii") if base64_encoded else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", ""),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _batch_state(self, batch_id: str) -> dict | None:
+        """Return a batch, running it first if its latency has elapsed."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None or batch["status"] == "completed":
+                return batch
+            if time.time() - batch["created_at"] < self.batch_latency_seconds:
+                batch["status"] = "in_progress"
+                return dict(batch)
+            input_lines = self._files[batch["input_file_id"]].decode("utf-8").splitlines()
+        output = []
+        inputs = 0
+        for line in input_lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            inputs += len(request["body"]["input"])
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": self._embedding_response(request["body"])},
+                "error": None,
+            }))
+        output_file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self._lock:
+            self._files[output_file_id] = ("\n".join(output) + "\n").encode("utf-8")
+            batch.update(status="completed", output_file_id=output_file_id, completed_at=int(time.time()),
+                         request_counts={"total": len(output), "completed": len(output), "failed": 0})
+            self.counts["batch_inputs"] += inputs
+            return dict(batch)
+
+    def _make_handler(self):
+        server = self
+
+        class MockApiHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_error_json(self, status: int, message: str, headers: dict | None = None):
+                self._send_json(status, {"error": {"message": message, "type": "mock_error", "code": status}}, headers)
+
+            def do_POST(self):
+                raw_body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == "/v1/files":
+                    self._upload_file(raw_body)
+                    return
+                body = json.loads(raw_body or b"{}")
+                if self.path == "/v1/embeddings":
+                    self._embeddings(body)
+                elif self.path == "/v1/batches":
+                    self._create_batch(body)
+                elif self.path == "/vectors/upsert":
+                    self._upsert(body)
+                elif self.path == "/vectors/delete":
+                    self._delete(body)
+                else:
+                    self._send_error_json(404, f"Unknown path {self.path}")
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                if parts[:2] == ["v1", "batches"] and len(parts) == 3:
+                    batch = server._batch_state(parts[2])
+                    if batch is None:
+                        self._send_error_json(404, f"No batch {parts[2]}")
+                    else:
+                        self._send_json(200, batch)
+                elif parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content":
+                    with server._lock:
+                        content = server._files.get(parts[2])
+                    if content is None:
+                        self._send_error_json(404, f"No file {parts[2]}")
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                else:
+                    self._send_error_json(404, f"Unknown path {self.path}")
+
+            def _upload_file(self, raw_body: bytes):
+                message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("latin-1") + raw_body)
+                fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+                content = fields["file"].get_payload(decode=True)
+                file_id = f"file-{uuid.uuid4().hex[:24]}"
+                with server._lock:
+                    server._files[file_id] = content
+                self._send_json(200, {
+                    "id": file_id,
+                    "object": "file",
+                    "bytes": len(content),
+                    "created_at": int(time.time()),
+                    "filename": fields["file"].get_filename() or "upload.jsonl",
+                    "purpose": fields["purpose"].get_content().strip() if "purpose" in fields else "batch",
+                    "status": "processed",
+                })
+
+            def _create_batch(self, body: dict):
+                if body.get("endpoint") != "/v1/embeddings" or body.get("input_file_id") not in server._files:
+                    self._send_error_json(400, "Only /v1/embeddings batches over uploaded files are supported (mock)")
+                    return
+                batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+                batch = {
+                    "id": batch_id,
+                    "object": "batch",
+                    "endpoint": body["endpoint"],
+                    "input_file_id": body["input_file_id"],
+                    "completion_window": body.get("completion_window", "24h"),
+                    "status": "validating",
+                    "created_at": int(time.time()),
+                    "output_file_id": None,
+                    "error_file_id": None,
+                    "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                    "metadata": body.get("metadata"),
+                }
+                with server._lock:
+                    server._batches[batch_id] = batch
+                    server.counts["batch_jobs"] += 1
+                self._send_json(200, dict(batch))
+
+            def _embeddings(self, body: dict):
+                inputs = body.get("input", [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                tokens = sum(len(text) // 4 + 1 for text in inputs)
+                server._count(embedding_requests=1)
+                headers, retry_after = server._rate_limit(tokens)
+                if retry_after is not None or server._roll(server.error_rate_429):
+                    if retry_after is None:
+                        server._count(injected_429=1)
+                        retry_after = 1.0
+                    else:
+                        server._count(rate_limited_429=1)
+                    headers["retry-after-ms"] = f"{retry_after * 1000:.0f}"
+                    self._send_error_json(429, "Rate limit reached (mock)", headers)
+                    return
+                if server._roll(server.error_rate_5xx):
+                    server._count(injected_5xx=1)
+                    self._send_error_json(500, "Internal server error (mock)", headers)
+                    return
+
+                server._sleep(server.embedding_latency_ms + server.embedding_ms_per_1k_tokens * tokens / 1000)
+                server._count(embedding_inputs=len(inputs), embedding_tokens=tokens)
+                self._send_json(200, server._embedding_response(body), headers)
+
+            def _upsert(self, body: dict):
+                server._count(upsert_requests=1)
+                if server._roll(server.error_rate_5xx):
+                    server._count(injected_5xx=1)
+                    self._send_error_json(503, "Service unavailable (mock)")
+                    return
+                server._sleep(server.upsert_latency_ms)
+                vectors = body.get("vectors", [])
+                with server._lock:
+                    server._namespaces.add(body.get("namespace", ""))
+                    server.counts["namespaces"] = len(server._namespaces)
+                server._count(vectors_upserted=len(vectors))
+                self._send_json(200, {"upsertedCount": len(vectors)})
+
+            def _delete(self, body: dict):
+                server._count(delete_requests=1)
+                server._sleep(server.upsert_latency_ms)
+                server._count(vectors_deleted=len(body.get("ids") or []))
+                self._send_json(200, {})
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return MockApiHandler
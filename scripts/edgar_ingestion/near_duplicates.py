@@ -0,0 +1,147 @@
+"""
+Cross-filing near-duplicate chunk detection with MinHash + LSH.
+
+Companies repeat boilerplate (risk factors especially) almost word for word
+from year to year and across 10-K/10-Q filings. Every chunk gets a MinHash
+signature over its word 5-grams, computed with one-permutation hashing (one
+hash per shingle, spread over `num_bins` bins) so it costs a single pass over
+the text. Signatures are split into LSH bands and stored in SQLite, so a new
+chunk can be matched against every chunk seen on earlier runs; candidates are
+confirmed by estimated Jaccard similarity against `threshold`.
+
+A match lets the pipeline reuse the embedding of the earlier chunk (looked up
+in the embedding cache) instead of calling OpenAI again.
+
+Lookups and registrations sit on the chunking path. A lookup reads every
+candidate's signature in one query, and registrations are committed in batches
+of COMMIT_ENTRIES (and on flush() and close()) rather than one per chunk.
+Uncommitted chunks are still matched, as they are on the same connection; a
+crash only loses chunks that later runs will register again.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from array import array
+
+_WORD_RE = re.compile(r"\w+")
+_EMPTY_BIN = (1 << 64) - 1
+COMMIT_ENTRIES = 1000  # Chunks registered before their rows are committed
+
+
+def minhash_signature(text: str, num_bins: int = 128, shingle_size: int = 5) -> list[int]:
+    """One-permutation MinHash signature of `text`'s lowercase word shingles."""
+    words = _WORD_RE.findall(text.lower())
+    signature = [_EMPTY_BIN] * num_bins
+    for i in range(max(1, len(words) - shingle_size + 1)):
+        shingle = " ".join(words[i:i+shingle_size]).encode("utf-8")
+        value = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "little")
+        bin_index = value % num_bins
+        value //= num_bins
+        if value < signature[bin_index]:
+            signature[bin_index] = value
+    return signature
+
+
+def estimate_similarity(signature_a: list[int], signature_b: list[int]) -> float:
+    """Estimated Jaccard similarity of two signatures, ignoring bins empty in both."""
+    matches = 0
+    used = 0
+    for a, b in zip(signature_a, signature_b):
+        if a == _EMPTY_BIN and b == _EMPTY_BIN:
+            continue
+        used += 1
+        if a == b:
+            matches += 1
+    return matches / used if used else 0.0
+
+
+class NearDuplicateIndex:
+    """Thread-safe persistent LSH index from chunk signatures to chunk keys."""
+
+    def __init__(self, path: str, threshold: float = 0.9, num_bins: int = 128, bands: int = 8):
+        if num_bins % bands:
+            raise ValueError("num_bins must be divisible by bands")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.threshold = threshold
+        self.num_bins = num_bins
+        self.bands = bands
+        self.rows_per_band = num_bins // bands
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS signatures (
+                chunk_key TEXT PRIMARY KEY,
+                signature BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                band_key TEXT NOT NULL,
+                chunk_key TEXT NOT NULL,
+                PRIMARY KEY (band_key, chunk_key)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def signature(self, text: str) -> list[int]:
+        return minhash_signature(text, self.num_bins)
+
+    def _band_keys(self, signature: list[int]) -> list[str]:
+        keys = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows_per_band:(band + 1) * self.rows_per_band]
+            digest = hashlib.blake2b(array("Q", rows).tobytes(), digest_size=12).hexdigest()
+            keys.append(f"{band}:{digest}")
+        return keys
+
+    def find(self, signature: list[int]) -> tuple[str, float] | None:
+        """Return (chunk_key, similarity) of the closest stored chunk above the threshold, if any."""
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            placeholders = ",".join("?" * len(band_keys))
+            rows = self._conn.execute(
+                f"SELECT chunk_key, signature FROM signatures WHERE chunk_key IN "
+                f"(SELECT chunk_key FROM bands WHERE band_key IN ({placeholders}))",
+                band_keys,
+            ).fetchall()
+        best = None
+        for chunk_key, blob in rows:
+            similarity = estimate_similarity(signature, array("Q", blob).tolist())
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (chunk_key, similarity)
+        return best
+
+    def add(self, chunk_key: str, signature: list[int]):
+        """Register a chunk so later chunks can be matched against it."""
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO signatures (chunk_key, signature) VALUES (?, ?)",
+                (chunk_key, array("Q", signature).tobytes()),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO bands (band_key, chunk_key) VALUES (?, ?)",
+                [(band_key, chunk_key) for band_key in band_keys],
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_ENTRIES:
+                self._commit_locked()
+
+    def _commit_locked(self):
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def flush(self):
+        """Commit the chunks registered since the last commit, e.g. before the process exits."""
+        with self._lock:
+            self._commit_locked()
+
+    def close(self):
+        with self._lock:
+            self._commit_locked()
+            self._conn.close()
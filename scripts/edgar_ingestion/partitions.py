@@ -0,0 +1,305 @@
+"""
+Partitioning of the vector index into namespaces.
+
+One flat namespace means every query scans every vector and every writer
+contends on the same partition. With a `Partitioner`, each filing's vectors go
+to the namespace of its partition, derived from header fields the filing store
+already indexes:
+
+    none        one partition, the default namespace (the layout before partitions)
+    form        form-10-K, form-10-Q, ...
+    year        year-2023, year-2024, ... (filing year)
+    form_year   form-10-K_year-2024, ...
+    cik_range   cik-0000000000, cik-0000100000, ... (`cik_range_size` CIKs each)
+
+`PartitionManifest` records which namespace serves each partition. A
+partition is rebuilt blue/green: `start_rebuild` gives it a fresh "building"
+namespace that ingestion writes to while queries keep reading the live one,
+and `finish_rebuild` switches it live once every filing of the partition is in
+it. A change of scheme works the same way for the whole index: partitions of
+the new scheme are all built beside the live ones, and `activate` switches to
+them together. Replaced namespaces are retired, not deleted at once, so a
+query side still holding the previous manifest keeps working for a grace
+period (see `expired_retirements`).
+
+`export` writes the live partitions, with the forms, filing years and CIK
+range each holds, as JSON for the query side, which then searches only the
+partitions a question's filters can match, in parallel.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+SCHEMES = ("none", "form", "year", "form_year", "cik_range")
+DEFAULT_CIK_RANGE_SIZE = 100_000
+
+
+def _name_part(value) -> str:
+    return re.sub(r"[^A-Za-z0-9.-]", "_", str(value).strip()) or "unknown"
+
+
+class Partitioner:
+    """Maps a filing's header fields to its partition name."""
+
+    def __init__(self, scheme: str = "none", cik_range_size: int = DEFAULT_CIK_RANGE_SIZE):
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown partition scheme {scheme!r} (expected one of {', '.join(SCHEMES)})")
+        self.scheme = scheme
+        self.cik_range_size = cik_range_size
+
+    def __call__(self, filing: dict) -> str:
+        if self.scheme == "none":
+            return ""
+        form = f"form-{_name_part(filing.get('form') or 'unknown')}"
+        year = f"year-{_name_part(str(filing.get('filing_date') or '')[:4])}"
+        if self.scheme == "form":
+            return form
+        if self.scheme == "year":
+            return year
+        if self.scheme == "form_year":
+            return f"{form}_{year}"
+        try:
+            cik = int(filing.get('cik'))
+        except (TypeError, ValueError):
+            return "cik-unknown"
+        return f"cik-{cik // self.cik_range_size * self.cik_range_size:010d}"
+
+
+def namespace_name(partition: str, generation: int) -> str:
+    """Namespace of a partition's `generation`th build; the first uses the partition name itself."""
+    if generation == 0:
+        return partition
+    return f"{partition or 'default'}--g{generation}"
+
+
+def summarize_filings(filings: list[dict]) -> dict:
+    """Forms, filing year range and CIK range of a partition's filings, for pruning on the query side."""
+    years = [int(str(filing['filing_date'])[:4]) for filing in filings
+             if str(filing.get('filing_date') or '')[:4].isdigit()]
+    ciks = []
+    for filing in filings:
+        try:
+            ciks.append(int(filing.get('cik')))
+        except (TypeError, ValueError):
+            pass
+    return {
+        'filings': len(filings),
+        'forms': sorted({filing['form'] for filing in filings if filing.get('form')}),
+        'years': [min(years), max(years)] if years else None,
+        'ciks': [min(ciks), max(ciks)] if ciks else None,
+    }
+
+
+class PartitionManifest:
+    """Thread-safe SQLite record of each partition's live and building namespaces."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS partitions (
+                scheme TEXT NOT NULL,
+                name TEXT NOT NULL,
+                namespace TEXT,             -- live, what queries read; NULL until first built
+                building TEXT,              -- namespace of a rebuild in progress
+                generation INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (scheme, name)
+            );
+            CREATE TABLE IF NOT EXISTS namespaces (
+                namespace TEXT PRIMARY KEY,
+                vectors INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS retired (
+                namespace TEXT PRIMARY KEY,
+                retired_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    @property
+    def scheme(self) -> str | None:
+        """The scheme queries are served from, None before the first run."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'scheme'").fetchone()
+        return row[0] if row else None
+
+    def set_scheme(self, scheme: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('scheme', ?)", (scheme,))
+            self._conn.commit()
+
+    def target_namespace(self, scheme: str, name: str) -> str:
+        """
+        The namespace ingestion writes a partition to: its rebuild's, if one is
+        in progress, otherwise the live one. A partition seen for the first
+        time goes live at once under the active scheme, and is built beside
+        the live partitions under any other.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT namespace, building FROM partitions WHERE scheme = ? AND name = ?",
+                                     (scheme, name)).fetchone()
+            if row is not None:
+                return row[1] or row[0]
+            active = self._conn.execute("SELECT value FROM meta WHERE key = 'scheme'").fetchone()
+            live = active is None or active[0] == scheme
+            namespace = namespace_name(name, 0)
+            self._conn.execute(
+                "INSERT INTO partitions (scheme, name, namespace, building, generation, updated_at) VALUES (?, ?, ?, ?, 0, ?)",
+                (scheme, name, namespace if live else None, None if live else namespace, time.time()),
+            )
+            if active is None:
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('scheme', ?)", (scheme,))
+            self._conn.commit()
+            return namespace
+
+    def start_rebuild(self, scheme: str, name: str) -> str:
+        """Give a partition a fresh building namespace (or return the one already being built)."""
+        self.target_namespace(scheme, name)  # Registers the partition if it is new
+        with self._lock:
+            namespace, building, generation = self._conn.execute(
+                "SELECT namespace, building, generation FROM partitions WHERE scheme = ? AND name = ?",
+                (scheme, name)).fetchone()
+            if building is not None:
+                return building
+            generation += 1
+            building = namespace_name(name, generation)
+            self._conn.execute(
+                "UPDATE partitions SET building = ?, generation = ?, updated_at = ? WHERE scheme = ? AND name = ?",
+                (building, generation, time.time(), scheme, name),
+            )
+            self._conn.execute("DELETE FROM namespaces WHERE namespace = ?", (building,))
+            self._conn.commit()
+            return building
+
+    def finish_rebuild(self, scheme: str, name: str) -> str | None:
+        """Switch a partition to its building namespace. Returns the namespace it replaced, now retired."""
+        with self._lock:
+            row = self._conn.execute("SELECT namespace, building FROM partitions WHERE scheme = ? AND name = ?",
+                                     (scheme, name)).fetchone()
+            if row is None or row[1] is None:
+                return None
+            previous, building = row
+            self._conn.execute(
+                "UPDATE partitions SET namespace = ?, building = NULL, updated_at = ? WHERE scheme = ? AND name = ?",
+                (building, time.time(), scheme, name),
+            )
+            if previous is not None:
+                self._retire_locked(previous)
+            self._conn.commit()
+            return previous
+
+    def abort_rebuild(self, scheme: str, name: str) -> str | None:
+        """Give up a partition's rebuild. Returns its building namespace, now retired."""
+        with self._lock:
+            row = self._conn.execute("SELECT namespace, building FROM partitions WHERE scheme = ? AND name = ?",
+                                     (scheme, name)).fetchone()
+            if row is None or row[1] is None:
+                return None
+            if row[0] is None:  # Never went live, so nothing is left of it
+                self._conn.execute("DELETE FROM partitions WHERE scheme = ? AND name = ?", (scheme, name))
+            else:
+                self._conn.execute("UPDATE partitions SET building = NULL, updated_at = ? WHERE scheme = ? AND name = ?",
+                                   (time.time(), scheme, name))
+            self._retire_locked(row[1])
+            self._conn.commit()
+            return row[1]
+
+    def activate(self, scheme: str) -> list[str]:
+        """
+        Serve queries from `scheme`: its partitions' builds go live together and
+        every partition of other schemes is retired. Returns the namespaces retired.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE partitions SET namespace = building, building = NULL, updated_at = ? "
+                "WHERE scheme = ? AND namespace IS NULL", (time.time(), scheme))
+            retired = [namespace for row in self._conn.execute(
+                "SELECT namespace, building FROM partitions WHERE scheme != ?", (scheme,)) for namespace in row
+                if namespace is not None]
+            for namespace in retired:
+                self._retire_locked(namespace)
+            self._conn.execute("DELETE FROM partitions WHERE scheme != ?", (scheme,))
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('scheme', ?)", (scheme,))
+            self._conn.commit()
+            return retired
+
+    def _retire_locked(self, namespace: str):
+        self._conn.execute("INSERT OR REPLACE INTO retired (namespace, retired_at) VALUES (?, ?)",
+                           (namespace, time.time()))
+        self._conn.execute("DELETE FROM namespaces WHERE namespace = ?", (namespace,))
+
+    def expired_retirements(self, grace_seconds: float) -> list[str]:
+        """Retired namespaces older than `grace_seconds` that no partition uses again."""
+        with self._lock:
+            in_use = {namespace for row in self._conn.execute("SELECT namespace, building FROM partitions")
+                      for namespace in row if namespace is not None}
+            return [namespace for (namespace,) in self._conn.execute(
+                "SELECT namespace FROM retired WHERE retired_at <= ?", (time.time() - grace_seconds,))
+                if namespace not in in_use]
+
+    def forget_retired(self, namespace: str):
+        """Call once a retired namespace has been deleted from the sink."""
+        with self._lock:
+            self._conn.execute("DELETE FROM retired WHERE namespace = ?", (namespace,))
+            self._conn.commit()
+
+    def add_vectors(self, namespace: str, delta: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO namespaces (namespace, vectors) VALUES (?, ?) "
+                "ON CONFLICT (namespace) DO UPDATE SET vectors = MAX(0, vectors + excluded.vectors)",
+                (namespace, delta),
+            )
+            self._conn.commit()
+
+    def partitions(self, scheme: str | None = None) -> dict[str, dict]:
+        """{name: {scheme, namespace, building, generation, vectors}}, for one scheme or all of them."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT p.scheme, p.name, p.namespace, p.building, p.generation, COALESCE(n.vectors, 0) "
+                "FROM partitions p LEFT JOIN namespaces n ON n.namespace = p.namespace "
+                + ("WHERE p.scheme = ? " if scheme else "") + "ORDER BY p.name",
+                (scheme,) if scheme else (),
+            ).fetchall()
+        return {
+            name: {'scheme': row_scheme, 'namespace': namespace, 'building': building, 'generation': generation,
+                   'vectors': vectors}
+            for row_scheme, name, namespace, building, generation, vectors in rows
+        }
+
+    def export(self, path: str, summaries: dict[str, dict]):
+        """
+        Write the live partitions of the active scheme to `path` as JSON for the
+        query side. `summaries` maps a live namespace to its `summarize_filings`.
+        """
+        scheme = self.scheme
+        partitions = []
+        for name, partition in self.partitions(scheme).items():
+            if partition['namespace'] is None:
+                continue
+            summary = summaries.get(partition['namespace'], summarize_filings([]))
+            partitions.append({'name': name, 'namespace': partition['namespace'], 'vectors': partition['vectors'],
+                               **summary})
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({'scheme': scheme, 'updated_at': time.time(), 'partitions': partitions}, f, indent=2)
+        os.replace(temporary_path, path)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,184 @@
+"""
+Rate limiters for the external APIs used by the ingestion scripts.
+
+`AdaptiveRateLimiter` is the requests-per-minute / tokens-per-minute limiter
+for the OpenAI API.
+Callers `acquire()` capacity before each request and block until both the
+request bucket and the token bucket can cover it. After each response the
+limiter is corrected from OpenAI's rate-limit headers, so it throttles before
+a 429 happens instead of reacting to one. If a 429 does get through, its
+retry-after value pauses every caller, not just the one that was rejected.
+
+`RequestRateLimiter` is a plain requests-per-second limiter, used to stay
+within SEC EDGAR's fair-access limit.
+"""
+
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: str | None) -> float | None:
+    """Parse OpenAI reset durations such as '20ms', '1s' or '6m0s' into seconds."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_retry_after(headers) -> float | None:
+    """Return the retry-after delay in seconds from response headers, if any."""
+    if headers is None:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            return None
+    return None
+
+
+class TokenBucket:
+    """A bucket that refills continuously to `capacity` over `period` seconds (one minute by default)."""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = float(capacity)
+        self.available = float(capacity)
+        self.period = period
+        self._last_refill = time.monotonic()
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.period
+
+    def refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self.available = min(self.capacity, self.available + elapsed * self.refill_rate)
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until `cost` can be taken. Costs above capacity only need a full bucket."""
+        needed = min(cost, self.capacity) - self.available
+        return max(0.0, needed / self.refill_rate)
+
+
+class AdaptiveRateLimiter:
+    """Thread-safe RPM + TPM limiter corrected by server rate-limit headers."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.total_wait_seconds = 0.0
+        self.throttled_calls = 0
+        self.rate_limit_hits = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, token_cost: int):
+        """Block until one request costing `token_cost` tokens fits in both buckets."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(
+                    self._paused_until - now,
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(token_cost),
+                )
+                if wait <= 0:
+                    self.requests.available -= 1
+                    self.tokens.available -= min(token_cost, self.tokens.capacity)
+                    if waited:
+                        self.total_wait_seconds += waited
+                        self.throttled_calls += 1
+                    return
+            # Sleep outside the lock so other callers can refund/update meanwhile
+            time.sleep(wait)
+            waited += wait
+
+    def update_from_headers(self, headers):
+        """Sync bucket state with the x-ratelimit-* headers from an OpenAI response."""
+        if headers is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._apply_headers(self.requests, headers, "requests", now)
+            self._apply_headers(self.tokens, headers, "tokens", now)
+
+    def _apply_headers(self, bucket: TokenBucket, headers, kind: str, now: float):
+        limit = headers.get(f"x-ratelimit-limit-{kind}")
+        remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+        reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        if limit:
+            try:
+                bucket.capacity = float(limit)
+            except ValueError:
+                pass
+        if remaining:
+            try:
+                # The server's count is authoritative when it is lower than ours
+                bucket.available = min(bucket.available, float(remaining))
+            except ValueError:
+                return
+            if bucket.available <= 0 and reset:
+                self._paused_until = max(self._paused_until, now + reset)
+
+    def on_rate_limited(self, headers):
+        """Pause all callers after a 429, honouring retry-after when the server sends it."""
+        retry_after = parse_retry_after(headers)
+        with self._lock:
+            self.rate_limit_hits += 1
+            now = time.monotonic()
+            pause = retry_after if retry_after is not None else 60.0 / max(self.requests.capacity, 1.0)
+            self._paused_until = max(self._paused_until, now + pause)
+            self.requests.available = min(self.requests.available, 0.0)
+        logger.warning(f"Rate limited by OpenAI, pausing all embedding requests for {pause:.2f}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "throttled_calls": self.throttled_calls,
+                "total_wait_seconds": self.total_wait_seconds,
+                "rate_limit_hits": self.rate_limit_hits,
+                "requests_per_minute": self.requests.capacity,
+                "tokens_per_minute": self.tokens.capacity,
+            }
+
+
+class RequestRateLimiter:
+    """Thread-safe requests-per-second limiter shared by a pool of workers."""
+
+    def __init__(self, requests_per_second: float):
+        self.bucket = TokenBucket(requests_per_second, period=1.0)
+        self._lock = threading.Lock()
+
+    def acquire(self, cost: int = 1):
+        """Block until `cost` requests can be made without exceeding the rate."""
+        while True:
+            with self._lock:
+                self.bucket.refill(time.monotonic())
+                wait = self.bucket.wait_time(cost)
+                if wait <= 0:
+                    self.bucket.available -= min(cost, self.bucket.capacity)
+                    return
+            time.sleep(wait)
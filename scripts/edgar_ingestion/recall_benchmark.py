@@ -0,0 +1,158 @@
+"""
+Recall benchmark for shortened and quantized local vector indexes.
+
+Builds one LocalVectorStore per combination of search dimension, storage dtype
+and re-ranking, fills it with the same vectors, and compares each store's
+top-k for a held-out query set with the exact top-k over full-dimension
+float32 vectors. Reports recall@k, index size and query latency:
+
+    python recall_benchmark.py --cache cache/embeddings.sqlite3
+    python recall_benchmark.py --synthetic 50000 --dims 1536,512,256 --dtypes int8,binary
+    python recall_benchmark.py --synthetic 50000 --ivf --nprobe 16
+
+Vectors come from an embedding cache (real full-size embeddings) or are
+generated: clustered, with variance decaying over the dimensions the way
+text-embedding-3 models front-load information, so that truncation behaves
+roughly like the API's `dimensions` parameter. Truncating a full embedding and
+re-normalising it is exactly what `dimensions` returns, so a search dimension
+below the full one predicts the recall of ingesting with EMBEDDING_DIMENSIONS.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from benchmark import BENCH_RESULTS_DIR, git_commit, percentiles
+from local_vector_store import LocalVectorStore
+
+UPSERT_BATCH = 1000
+
+
+def load_cached_embeddings(path: str, model: str, limit: int) -> np.ndarray:
+    """Full-size embeddings of `model` from an embedding cache database."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT vector FROM embeddings WHERE model = ? LIMIT ?", (model, limit)).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        raise SystemExit(f"No {model} embeddings in {path}")
+    return np.array([array("f", blob) for (blob,) in rows], dtype=np.float32)
+
+
+def synthetic_embeddings(count: int, dimension: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    scale = np.exp(-np.arange(dimension) / (dimension / 4)).astype(np.float32)
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32) * scale
+    vectors = centers[rng.integers(clusters, size=count)]
+    vectors += 0.5 * rng.standard_normal((count, dimension), dtype=np.float32) * scale
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, top_k: int) -> list[set[int]]:
+    scores = queries @ corpus.T
+    best = np.argpartition(-scores, top_k, axis=1)[:, :top_k]
+    return [set(row.tolist()) for row in best]
+
+
+def measure(corpus: np.ndarray, queries: np.ndarray, truth: list[set[int]], args, dimension: int, dtype: str,
+            rerank: bool) -> dict:
+    directory = tempfile.mkdtemp(prefix="recall_bench_")
+    try:
+        store = LocalVectorStore(directory, dtype=dtype, index_dimension=dimension, rerank=rerank,
+                                 rerank_factor=args.rerank_factor)
+        for start in range(0, len(corpus), UPSERT_BATCH):
+            store.upsert([{"id": str(start + i), "values": vector}
+                          for i, vector in enumerate(corpus[start:start + UPSERT_BATCH])])
+        if args.ivf:
+            store.build_index()
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            matches = store.query(query, top_k=args.top_k, nprobe=args.nprobe, include_metadata=False)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(expected & {int(match["id"]) for match in matches})
+        stats = store.stats()
+        store.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        "dimension": dimension,
+        "dtype": dtype,
+        "rerank": rerank,
+        "recall": round(hits / (len(queries) * args.top_k), 4),
+        "index_mb": round(stats["bytes"] / 1024 / 1024, 2),
+        "rerank_mb": round(stats["rerank_bytes"] / 1024 / 1024, 2),
+        "query_ms": percentiles(latencies),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recall of shortened/quantized local indexes against exact search.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--cache", help="Embedding cache database to read full-size embeddings from")
+    source.add_argument("--synthetic", type=int, metavar="N", help="Generate N clustered vectors instead")
+    parser.add_argument("--model", default="text-embedding-3-small", help="Cache entries to read (with --cache)")
+    parser.add_argument("--limit", type=int, default=100_000, help="Most vectors read from the cache")
+    parser.add_argument("--dimension", type=int, default=1536, help="Full dimension (with --synthetic)")
+    parser.add_argument("--clusters", type=int, default=200, help="Clusters (with --synthetic)")
+    parser.add_argument("--queries", type=int, default=200, help="Vectors held out as queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--dims", default="1536,512,256", help="Search dimensions to compare")
+    parser.add_argument("--dtypes", default="float32,float16,int8,binary", help="Storage dtypes to compare")
+    parser.add_argument("--rerank-factor", type=int, default=4, help="Candidates re-ranked per requested match")
+    parser.add_argument("--ivf", action="store_true", help="Build an IVF index before querying")
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result JSON path (default: bench_results/recall_<timestamp>.json)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.cache:
+        vectors = load_cached_embeddings(args.cache, args.model, args.limit + args.queries)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    else:
+        vectors = synthetic_embeddings(args.synthetic + args.queries, args.dimension, args.clusters, args.seed)
+    np.random.default_rng(args.seed).shuffle(vectors)
+    queries, corpus = vectors[:args.queries], vectors[args.queries:]
+    if len(corpus) <= args.top_k:
+        raise SystemExit(f"Need more than {args.queries + args.top_k} vectors, got {len(vectors)}")
+    truth = exact_top_k(corpus, queries, args.top_k)
+    full_dimension = corpus.shape[1]
+    print(f"{len(corpus)} vectors of dimension {full_dimension}, {len(queries)} queries, recall@{args.top_k}"
+          f"{f', IVF nprobe {args.nprobe}' if args.ivf else ''}")
+
+    results = []
+    print(f"{'dims':>5} {'dtype':>8} {'rerank':>6} {'recall':>7} {'index MB':>9} {'rerank MB':>9} {'p50 ms':>7} {'p99 ms':>7}")
+    for dimension in sorted({min(int(d), full_dimension) for d in args.dims.split(",")}, reverse=True):
+        for dtype in args.dtypes.split(","):
+            for rerank in (False, True):
+                result = measure(corpus, queries, truth, args, dimension, dtype, rerank)
+                results.append(result)
+                print(f"{dimension:>5} {dtype:>8} {'yes' if rerank else 'no':>6} {result['recall']:>7.3f} "
+                      f"{result['index_mb']:>9.2f} {result['rerank_mb']:>9.2f} "
+                      f"{result['query_ms']['p50']:>7} {result['query_ms']['p99']:>7}")
+
+    output_path = args.output or os.path.join(BENCH_RESULTS_DIR, f"recall_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "vectors": len(corpus),
+            "full_dimension": full_dimension,
+            "results": results,
+        }, f, indent=2)
+    print(f"\nSaved results to {output_path}")
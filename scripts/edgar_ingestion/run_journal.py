@@ -0,0 +1,177 @@
+"""
+Journal of Phase 2 runs, so an interrupted run can be resumed.
+
+The ingestion manifest only hears about a filing once every one of its vectors
+is written, and the embedding cache only holds embeddings. Neither records
+which files a run was working through, or which upsert batches of a large,
+half-finished filing already reached the sink. The journal does, in SQLite
+(WAL, committed on every write so it survives the process being killed):
+
+    runs      one row per run: the files it was asked to process, its chunking
+              parameters and its status (running, interrupted, completed)
+    files     per run and file, the furthest state reached: loaded, chunked,
+              embedded, upserted, then done, failed or skipped
+    batches   the vector IDs of every upsert batch written for a filing that
+              is not done yet, with the content hash they were chunked from
+
+A resumed run processes only the files its predecessor had not finished, and
+skips chunks whose vectors were already written from the same file contents.
+Batch records are dropped as soon as their filing is done, so the journal stays
+small however long the run.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+UNFINISHED_STATUSES = ("running", "interrupted")
+FINISHED_FILE_STATES = ("done", "skipped")
+
+
+class RunJournal:
+    """Thread-safe SQLite-backed journal of runs, per-file states and written upsert batches."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                files TEXT NOT NULL,
+                chunk_params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                run_id INTEGER NOT NULL,
+                file_name TEXT NOT NULL,
+                state TEXT NOT NULL,
+                content_hash TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (run_id, file_name)
+            );
+            CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY,
+                run_id INTEGER NOT NULL,
+                file_name TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                vector_ids TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_batches_file ON batches(file_name);
+            """
+        )
+        self._conn.commit()
+
+    # --- Runs ---
+
+    def unfinished_run(self) -> dict | None:
+        """The most recent run that did not complete, with its per-file states, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT id, files, chunk_params, status, started_at FROM runs "
+                f"WHERE status IN ({','.join('?' * len(UNFINISHED_STATUSES))}) ORDER BY id DESC LIMIT 1",
+                UNFINISHED_STATUSES,
+            ).fetchone()
+            if row is None:
+                return None
+            states = dict(self._conn.execute("SELECT file_name, state FROM files WHERE run_id = ?", (row[0],)))
+        run_id, files, chunk_params, status, started_at = row
+        return {
+            'id': run_id,
+            'files': json.loads(files),
+            'chunk_params': json.loads(chunk_params),
+            'status': status,
+            'started_at': started_at,
+            'file_states': states,
+        }
+
+    def start_run(self, file_names: list[str], chunk_params: dict, keep_batches: bool = False) -> int:
+        """
+        Record a new run. Earlier unfinished runs are closed as superseded and,
+        unless `keep_batches` (a resume), their batch records are discarded.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE runs SET status = 'superseded', updated_at = ? "
+                f"WHERE status IN ({','.join('?' * len(UNFINISHED_STATUSES))})",
+                (now, *UNFINISHED_STATUSES),
+            )
+            if not keep_batches:
+                self._conn.execute("DELETE FROM batches")
+            run_id = self._conn.execute(
+                "INSERT INTO runs (files, chunk_params, status, started_at, updated_at) VALUES (?, ?, 'running', ?, ?)",
+                (json.dumps(file_names), json.dumps(chunk_params, sort_keys=True), now, now),
+            ).lastrowid
+            self._conn.commit()
+        return run_id
+
+    def resume_run(self, run_id: int) -> list[str]:
+        """Mark an unfinished run as running again and return the files it has not finished, in order."""
+        with self._lock:
+            files, = self._conn.execute("SELECT files FROM runs WHERE id = ?", (run_id,)).fetchone()
+            finished = {
+                file_name for (file_name,) in self._conn.execute(
+                    f"SELECT file_name FROM files WHERE run_id = ? AND state IN ({','.join('?' * len(FINISHED_FILE_STATES))})",
+                    (run_id, *FINISHED_FILE_STATES),
+                )
+            }
+            self._conn.execute("UPDATE runs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), run_id))
+            self._conn.commit()
+        return [file_name for file_name in json.loads(files) if file_name not in finished]
+
+    def finish_run(self, run_id: int, status: str):
+        """Close a run as 'completed' or 'interrupted'. A completed run keeps no batch records."""
+        with self._lock:
+            self._conn.execute("UPDATE runs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), run_id))
+            if status == "completed":
+                self._conn.execute("DELETE FROM batches WHERE run_id = ?", (run_id,))
+            self._conn.commit()
+
+    # --- Files and batches ---
+
+    def record_file(self, run_id: int, file_name: str, state: str, content_hash: str | None = None):
+        """Record the state a file has reached. Once it is done, its batch records are no longer needed."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO files (run_id, file_name, state, content_hash, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(run_id, file_name) DO UPDATE SET state = excluded.state, "
+                "content_hash = COALESCE(excluded.content_hash, files.content_hash), updated_at = excluded.updated_at",
+                (run_id, file_name, state, content_hash, time.time()),
+            )
+            if state == "done":
+                self._conn.execute("DELETE FROM batches WHERE file_name = ?", (file_name,))
+            self._conn.commit()
+
+    def record_batch(self, run_id: int, file_name: str, content_hash: str, vector_ids: list[str]):
+        """Record an upsert batch that reached the sink. Spooled batches are not recorded, so a resume rewrites them."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO batches (run_id, file_name, content_hash, vector_ids) VALUES (?, ?, ?, ?)",
+                (run_id, file_name, content_hash, json.dumps(vector_ids)),
+            )
+            self._conn.commit()
+
+    def written_vector_ids(self, chunk_params: dict) -> dict[tuple[str, str], set[str]]:
+        """
+        Vector IDs already written for unfinished filings by runs with these
+        chunking parameters, keyed by (file name, content hash).
+        """
+        written = {}
+        with self._lock:
+            for file_name, content_hash, vector_ids in self._conn.execute(
+                    "SELECT b.file_name, b.content_hash, b.vector_ids FROM batches b JOIN runs r ON r.id = b.run_id "
+                    "WHERE r.chunk_params = ?", (json.dumps(chunk_params, sort_keys=True),)):
+                written.setdefault((file_name, content_hash), set()).update(json.loads(vector_ids))
+        return written
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
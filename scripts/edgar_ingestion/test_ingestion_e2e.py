@@ -4,7 +4,7 @@ End-to-end test script for Edgar data ingestion to Pinecone.
 This script performs the following steps:
 1.  Sets up clients for Edgar, OpenAI, and Pinecone.
 2.  Fetches a specific SEC filing using its accession number.
-3.  Saves the filing content to a local JSON file.
+3.  Saves the filing content to the local filing store.
 4.  (Simulated) Processes the local file to create text chunks.
 5.  (Simulated) Generates embeddings for each chunk using OpenAI.
 6.  (Simulated) Upserts the embeddings and metadata to a Pinecone index.
@@ -14,13 +14,13 @@ running the full data ingestion process.
 """
 
 import os
-import json
 import time
 from dotenv import load_dotenv
 from edgar import set_identity, get_filings
 from pinecone import Pinecone, ServerlessSpec
 from pinecone.exceptions import PineconeException
 from openai import OpenAI
+from filing_store import FilingStore
 
 # --- Configuration ---
 # Load environment variables from a .env file
@@ -48,7 +48,6 @@ if not OPENAI_API_KEY:
 
 # We will fetch the latest 10-K, so no specific accession number is needed here.
 FILING_DATA_DIR = "filings_data"
-os.makedirs(FILING_DATA_DIR, exist_ok=True)
 
 # --- Main Execution ---
 def main():
@@ -98,11 +97,10 @@ def main():
             "sections": sections
         }
 
-        # Save to local JSON file
-        file_path = os.path.join(FILING_DATA_DIR, f"{accession_number}.json")
-        with open(file_path, "w") as f:
-            json.dump(filing_content, f, indent=2)
-        print(f"Filing content saved to {file_path}")
+        # Save to the local filing store
+        filing_store = FilingStore(FILING_DATA_DIR)
+        filing_store.put(filing_content)
+        print(f"Filing content saved to the filing store in {FILING_DATA_DIR}")
 
     except Exception as e:
         print(f"An error occurred during Phase 1: {e}")
@@ -131,9 +129,8 @@ def main():
         index = pinecone.Index(INDEX_NAME)
 
         # 2. Load the local filing data
-        print(f"Loading data from {file_path}...")
-        with open(file_path, "r") as f:
-            data = json.load(f)
+        print(f"Loading {accession_number} from the filing store...")
+        data = filing_store.get(accession_number)
 
         # 3. Process each section: chunk text, generate embeddings, and prepare for upsert
         vectors_to_upsert = []
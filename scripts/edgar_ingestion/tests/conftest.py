@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)  # The ingestion modules import each other as top-level modules
+
+from mock_api_server import MockApiServer  # noqa: E402
+
+
+@pytest.fixture
+def mock_server():
+    """The benchmark's OpenAI/Pinecone stand-in, with no latency and batches that finish immediately."""
+    server = MockApiServer(dimension=64, embedding_latency_ms=0, embedding_ms_per_1k_tokens=0, upsert_latency_ms=0,
+                           latency_jitter=0, batch_latency_seconds=0).start()
+    yield server
+    server.stop()
@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from openai import OpenAI
+
+from batch_embedder import BatchEmbedder
+from benchmark import generate_filings
+from conftest import SCRIPTS_DIR
+from embedding_cache import EmbeddingCache
+from ingestion_manifest import IngestionManifest
+from mock_api_server import fake_embedding
+
+MODEL = "text-embedding-3-small"
+
+
+def new_embedder(mock_server, tmp_path, cache):
+    client = OpenAI(api_key="mock", base_url=f"{mock_server.url}/v1")
+    return BatchEmbedder(client, MODEL, cache, str(tmp_path / "batch"), request_token_budget=50,
+                         request_max_inputs=4, max_inputs_per_batch=6, poll_seconds=0.05)
+
+
+def test_batch_results_land_in_the_embedding_cache(mock_server, tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    embedder = new_embedder(mock_server, tmp_path, cache)
+    texts = [f"Chunk number {i} of a filing." for i in range(10)]
+    assert all(embedder.add(text, 10) for text in texts)
+    assert not embedder.add(texts[0], 10)  # Already queued
+    embedder.flush()
+    totals = embedder.wait()
+
+    assert totals == {'jobs_completed': 2, 'jobs_failed': 0, 'embeddings_stored': 10, 'requests_failed': 0}
+    assert mock_server.stats()['batch_jobs'] == 2  # Split at max_inputs_per_batch
+    assert mock_server.stats()['embedding_requests'] == 0
+    for text, vector in zip(texts, cache.get_many(MODEL, texts)):
+        np.testing.assert_allclose(vector, fake_embedding(text, 64), rtol=1e-6)
+    embedder.close()
+    cache.close()
+
+
+def test_a_resumed_embedder_collects_jobs_without_resubmitting(mock_server, tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    embedder = new_embedder(mock_server, tmp_path, cache)
+    texts = [f"Chunk number {i} of a filing." for i in range(3)]
+    for text in texts:
+        embedder.add(text, 10)
+    embedder.flush()  # Submitted, then the run stops before waiting
+    embedder.close()
+
+    resumed = new_embedder(mock_server, tmp_path, cache)
+    assert not resumed.add(texts[0], 10)  # Already in an unfinished job
+    assert resumed.wait()['embeddings_stored'] == 3
+    assert mock_server.stats()['batch_jobs'] == 1
+    assert all(vector is not None for vector in cache.get_many(MODEL, texts))
+    assert resumed.wait()['jobs_completed'] == 0
+    resumed.close()
+    cache.close()
+
+
+@pytest.fixture
+def cli_env(mock_server, tmp_path):
+    generate_filings(str(tmp_path / "filings"), files=4, words_per_section=200, boilerplate=0.25)
+    return dict(
+        os.environ,
+        FILINGS_DATA_DIR=str(tmp_path / "filings"),
+        INGESTION_CACHE_DIR=str(tmp_path / "cache"),
+        INGESTION_LOG_DIR=str(tmp_path / "logs"),
+        EDGAR_IDENTITY="Test test@example.com",
+        OPENAI_API_KEY="mock",
+        OPENAI_BASE_URL=f"{mock_server.url}/v1",
+        VECTOR_SINK="local",
+        EMBEDDING_BACKEND="openai",
+        EMBEDDING_DIMENSIONS="",
+    )
+
+
+def run_cli(env, *args):
+    return subprocess.run([sys.executable, "ingestion_e2e.py", *args], cwd=SCRIPTS_DIR, env=env,
+                          capture_output=True, text=True, timeout=300)
+
+
+def test_upsert_in_batch_mode_embeds_only_through_batch_jobs(mock_server, cli_env, tmp_path):
+    process = run_cli(cli_env, "upsert", "--mode", "batch")
+    assert process.returncode == 0, process.stderr[-4000:]
+    stats = mock_server.stats()
+    assert stats['batch_jobs'] >= 1
+    assert stats['embedding_requests'] == 0
+
+    manifest = IngestionManifest(str(tmp_path / "cache" / "local_vectors" / "ingestion_manifest.sqlite3"))
+    assert len(manifest.known_files()) == 4
+    manifest.close()
+
+    # Nothing changed, so a second run submits no new jobs
+    process = run_cli(cli_env, "upsert", "--mode", "batch")
+    assert process.returncode == 0, process.stderr[-4000:]
+    assert mock_server.stats()['batch_jobs'] == stats['batch_jobs']
+    assert mock_server.stats()['embedding_requests'] == 0
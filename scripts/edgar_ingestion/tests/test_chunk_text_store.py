@@ -0,0 +1,33 @@
+import pytest
+
+from chunk_text_store import ChunkTextStore, is_loopback_host, serve_chunk_texts
+
+
+def test_texts_survive_reopening(tmp_path):
+    store = ChunkTextStore(str(tmp_path), block_size=16)
+    store.put("a", "First chunk, long enough to fill a block.")
+    store.put("b", "Buffered until close.")
+    store.put("a", "Rewritten first chunk.")
+    assert store.get("a") == "Rewritten first chunk."  # Unflushed copies are newer
+    store.close()
+
+    store = ChunkTextStore(str(tmp_path))
+    assert store.get_many(["a", "b", "missing"]) == {"a": "Rewritten first chunk.", "b": "Buffered until close."}
+    store.delete(["a"])
+    assert store.get("a") is None
+    store.close()
+
+
+@pytest.mark.parametrize("host, loopback", [
+    ("127.0.0.1", True), ("localhost", True), ("::1", True),
+    ("0.0.0.0", False), ("10.0.0.5", False), ("chunks.example.com", False),
+])
+def test_loopback_hosts(host, loopback):
+    assert is_loopback_host(host) == loopback
+
+
+def test_serving_beyond_localhost_requires_an_api_key(tmp_path):
+    store = ChunkTextStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        serve_chunk_texts(store, host="0.0.0.0", port=0)
+    store.close()
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from chunker import iter_chunk_spans, split_span_by_tokens
+from token_batcher import count_tokens
+
+WORDS = "revenue increased compared with prior year primarily due to higher volumes and pricing".split()
+
+
+def make_text(paragraphs: int = 12, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return "\n\n".join(
+        " ".join(" ".join(rng.choices(WORDS, k=rng.randint(6, 30))).capitalize() + "." for _ in range(rng.randint(2, 8)))
+        for _ in range(paragraphs)
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [40, 120, 400])
+def test_token_chunks_stay_within_the_limit(chunk_size):
+    text = make_text()
+    spans = list(iter_chunk_spans(text, chunk_size=chunk_size, overlap=chunk_size // 10, unit="tokens"))
+    assert len(spans) > 1
+    for start, end in spans:
+        assert count_tokens(text[start:end]) <= chunk_size
+
+
+def test_chunks_end_at_sentence_boundaries_and_cover_the_text():
+    text = make_text()
+    spans = list(iter_chunk_spans(text, chunk_size=80, overlap=10, unit="tokens"))
+    assert spans[0][0] == 0
+    assert spans[-1][1] == len(text.rstrip())
+    for start, end in spans:
+        assert text[end - 1] == "."
+        assert start == 0 or text[start - 1].isspace()
+    for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+        assert not text[previous_end:start].strip()  # Overlapping or adjacent: no text between chunks is skipped
+
+
+def test_consecutive_chunks_overlap_by_whole_sentences():
+    text = make_text()
+    spans = list(iter_chunk_spans(text, chunk_size=120, overlap=40, unit="tokens"))
+    overlaps = [previous_end - start for (_, previous_end), (start, _) in zip(spans, spans[1:])]
+    assert any(overlap > 0 for overlap in overlaps)
+    for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+        if previous_end > start:
+            assert count_tokens(text[start:previous_end]) <= 40
+
+
+def test_a_sentence_longer_than_the_limit_is_split_at_words():
+    text = " ".join(["1,234,567"] * 300)  # A table row: no sentence breaks at all
+    spans = list(iter_chunk_spans(text, chunk_size=50, overlap=0, unit="tokens"))
+    assert len(spans) > 1
+    for start, end in spans:
+        assert count_tokens(text[start:end]) <= 50
+        assert not text[start].isspace() and not text[end - 1].isspace()
+
+
+def test_split_span_by_tokens():
+    text = make_text(paragraphs=3)
+    pieces = list(split_span_by_tokens(text, 0, len(text), 25))
+    assert pieces[0][0] == 0 and pieces[-1][1] == len(text)
+    assert all(count_tokens(text[start:end]) <= 25 for start, end in pieces)
+
+
+def test_word_chunks_respect_the_word_limit():
+    text = make_text()
+    for start, end in iter_chunk_spans(text, chunk_size=100, overlap=10, unit="words"):
+        assert len(text[start:end].split()) <= 100
@@ -0,0 +1,17 @@
+from embedders import LocalEmbedder
+
+
+def test_onnx_runtime_needs_a_model_directory(tmp_path):
+    hub_name = LocalEmbedder("sentence-transformers/all-MiniLM-L6-v2", runtime="onnx")
+    assert hub_name.missing_files() == ["sentence-transformers/all-MiniLM-L6-v2/model.onnx",
+                                        "sentence-transformers/all-MiniLM-L6-v2/tokenizer.json"]
+
+    (tmp_path / "onnx").mkdir()
+    (tmp_path / "onnx" / "model_qint8.onnx").touch()
+    (tmp_path / "tokenizer.json").touch()
+    assert LocalEmbedder(str(tmp_path), runtime="onnx", onnx_file="onnx/model_qint8.onnx").missing_files() == []
+    assert LocalEmbedder(str(tmp_path), runtime="onnx").missing_files() == [str(tmp_path / "model.onnx")]
+
+
+def test_sentence_transformers_takes_hub_names():
+    assert LocalEmbedder("sentence-transformers/all-MiniLM-L6-v2", runtime="sentence-transformers").missing_files() == []
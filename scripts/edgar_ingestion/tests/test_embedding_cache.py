@@ -0,0 +1,64 @@
+import itertools
+
+import numpy as np
+
+import embedding_cache
+from embedding_cache import EmbeddingCache, cache_key
+
+MODEL = "test-model"
+
+
+def vectors(count, dimension=4):
+    return np.arange(count * dimension, dtype=np.float32).reshape(count, dimension)
+
+
+def test_round_trip_and_hit_counts(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    cache.put_many(MODEL, ["a", "b"], vectors(2))
+    found = cache.get_many(MODEL, ["a", "missing", "b"])
+    np.testing.assert_array_equal(found[0], vectors(2)[0])
+    assert found[1] is None
+    np.testing.assert_array_equal(found[2], vectors(2)[1])
+    assert cache.get_many("other-model", ["a"]) == [None]  # Keys are per model
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 2, 2)
+    cache.close()
+
+
+def test_eviction_drops_least_recently_used_entries(tmp_path, monkeypatch):
+    clock = itertools.count(1)
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: next(clock))
+    monkeypatch.setattr(embedding_cache, "EVICTION_CHUNK_FRACTION", 0)
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=4)
+    for text in ["a", "b", "c", "d"]:
+        cache.put_many(MODEL, [text], vectors(1))
+    cache.get_many(MODEL, ["a", "b"])  # Buffered hits must still protect these from eviction
+    cache.put_many(MODEL, ["e", "f"], vectors(2))
+    assert cache.contains_keys([cache_key(MODEL, text) for text in "abcdef"]) == {
+        cache_key(MODEL, text) for text in "abef"
+    }
+    assert cache.stats()['entries'] == 4
+    assert cache.evictions == 2
+    cache.close()
+
+
+def test_eviction_frees_a_chunk_beyond_the_overflow(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=100)
+    cache.put_many(MODEL, [str(i) for i in range(101)], vectors(101))
+    assert cache.evictions == 1 + int(100 * embedding_cache.EVICTION_CHUNK_FRACTION)
+    evictions = cache.evictions
+    cache.put_many(MODEL, ["next"], vectors(1))  # Fits in the space the chunk freed
+    assert cache.evictions == evictions
+    cache.close()
+
+
+def test_entry_count_survives_replacements_and_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = EmbeddingCache(path, max_entries=10)
+    cache.put_many(MODEL, ["a", "b", "a"], vectors(3))
+    cache.put_many(MODEL, ["b", "c"], vectors(2))
+    assert cache.stats()['entries'] == 3
+    cache.close()
+    reopened = EmbeddingCache(path, max_entries=10)
+    assert reopened.stats()['entries'] == 3
+    reopened.close()
@@ -0,0 +1,52 @@
+from filing_store import FilingStore
+
+
+def filing(accession_number, text="Revenue grew.", **fields):
+    return {
+        'company': "Example Corp",
+        'cik': 320193,
+        'form': "10-K",
+        'filing_date': "2024-01-31",
+        'accession_number': accession_number,
+        'sections': {'Item 1': text, 'Item 7': "Management discussion."},
+        **fields,
+    }
+
+
+def test_put_skips_identical_content_and_replaces_changed_content(tmp_path):
+    store = FilingStore(str(tmp_path))
+    assert store.put(filing("0001-24-000001"))
+    assert not store.put(filing("0001-24-000001"))
+    assert store.put(filing("0001-24-000001", text="Revenue fell."))
+    assert len(store) == 1
+    assert store.get("0001-24-000001")['sections']['Item 1'] == "Revenue fell."
+    store.close()
+
+
+def test_get_returns_the_filing_as_stored(tmp_path):
+    store = FilingStore(str(tmp_path))
+    store.put(filing("0001-24-000001"))
+    stored = store.get("0001-24-000001")
+    assert stored == filing("0001-24-000001")
+    assert list(stored['sections']) == ['Item 1', 'Item 7']  # Filing order is kept
+    assert store.get_section("0001-24-000001", "Item 7") == "Management discussion."
+    assert store.get("missing") is None
+    assert store.get_section("0001-24-000001", "Item 99") is None
+    store.close()
+
+
+def test_headers_and_membership_survive_reopening(tmp_path):
+    store = FilingStore(str(tmp_path))
+    store.put(filing("0001-24-000001"))
+    store.put(filing("0001-24-000002", text="Other text."))
+    store.close()
+
+    store = FilingStore(str(tmp_path))
+    assert "0001-24-000002" in store and "0001-24-000003" not in store
+    assert store.accession_numbers() == ["0001-24-000001", "0001-24-000002"]
+    headers = store.headers(["0001-24-000001", "0001-24-000003"])
+    assert list(headers) == ["0001-24-000001"]
+    assert headers["0001-24-000001"]['filing']['cik'] == "320193"
+    assert list(headers["0001-24-000001"]['sections']) == ['Item 1', 'Item 7']
+    assert headers["0001-24-000001"]['content_hash'] != store.headers()["0001-24-000002"]['content_hash']
+    store.close()
@@ -0,0 +1,55 @@
+import sqlite3
+
+from ingestion_manifest import IngestionManifest
+
+CHUNK_PARAMS = {'unit': "tokens", 'size': 200, 'overlap': 20}
+SECTIONS = {
+    'Item 1': {'hash': "h1", 'vector_ids': ["f-0", "f-1"]},
+    'Item 7': {'hash': "h7", 'vector_ids': ["f-2"]},
+}
+
+
+def test_recorded_filings_survive_reopening(tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    manifest = IngestionManifest(path)
+    manifest.record_filing("f", "0001-24-000001", "hash", CHUNK_PARAMS, SECTIONS, size=123, namespace="2024")
+    manifest.close()
+
+    manifest = IngestionManifest(path)
+    assert manifest.get_filing("f") == {
+        'accession_number': "0001-24-000001",
+        'size': 123,
+        'content_hash': "hash",
+        'chunk_params': CHUNK_PARAMS,
+        'namespace': "2024",
+        'sections': SECTIONS,
+    }
+    assert manifest.get_filing("missing") is None
+    assert manifest.known_files() == {"f"}
+    assert manifest.namespaces() == {"f": "2024"}
+    manifest.close()
+
+
+def test_record_filing_replaces_the_previous_sections(tmp_path):
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite"))
+    manifest.record_filing("f", "0001-24-000001", "hash", CHUNK_PARAMS, SECTIONS)
+    manifest.record_filing("f", "0001-24-000001", "new-hash", CHUNK_PARAMS, {'Item 1': SECTIONS['Item 1']})
+    filing = manifest.get_filing("f")
+    assert filing['content_hash'] == "new-hash"
+    assert list(filing['sections']) == ['Item 1']
+    manifest.close()
+
+
+def test_old_manifests_lose_the_mtime_column(tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    manifest = IngestionManifest(path)
+    manifest.record_filing("f", "0001-24-000001", "hash", CHUNK_PARAMS, SECTIONS)
+    manifest.close()
+    with sqlite3.connect(path) as conn:
+        conn.execute("ALTER TABLE filings ADD COLUMN mtime REAL")
+
+    manifest = IngestionManifest(path)
+    assert manifest.get_filing("f")['content_hash'] == "hash"
+    manifest.close()
+    with sqlite3.connect(path) as conn:
+        assert "mtime" not in {row[1] for row in conn.execute("PRAGMA table_info(filings)")}
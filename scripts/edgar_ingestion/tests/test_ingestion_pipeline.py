@@ -0,0 +1,132 @@
+import threading
+import time
+
+from ingestion_pipeline import FileJob, IngestionPipeline
+
+
+def new_stats(file_name):
+    return {'file_name': file_name, 'error': None, 'skipped': False, 'chunks_processed': 0,
+            'embedding_requests': 0, 'vectors_upserted': 0}
+
+
+class Recorder:
+    """Stub stage functions that chunk file `name` into `chunks[name]` items and record what reaches each stage."""
+
+    def __init__(self, chunks: dict[str, int], upsert_fn=None):
+        self.chunks = chunks
+        self.upsert_fn = upsert_fn
+        self.lock = threading.Lock()
+        self.upserted = []
+        self.finalized = []
+        self.done = []
+        self.progress = {}  # File name -> [(state, vector count)]
+
+    def load(self, job):
+        job.data = job.source
+        return job.data > 0
+
+    def chunk(self, job):
+        job.stats['chunks_processed'] = job.data
+        return ({'chunk': f"{job.file_name} {i}", 'tokens': 10} for i in range(job.data))
+
+    def embed(self, texts):
+        return [[float(len(text))] for text in texts]
+
+    def build(self, job, items, embeddings):
+        return [{'id': item['chunk'], 'values': embedding} for item, embedding in zip(items, embeddings)]
+
+    def upsert(self, vectors, partition):
+        with self.lock:
+            self.upserted += [vector['id'] for vector in vectors]
+        return self.upsert_fn(vectors, partition) if self.upsert_fn else None
+
+    def finalize(self, job):
+        with self.lock:
+            self.finalized.append(job.file_name)
+
+    def on_file_done(self, stats):
+        self.done.append(stats)
+
+    def on_progress(self, job, state, vectors):
+        with self.lock:
+            self.progress.setdefault(job.file_name, []).append((state, len(vectors) if vectors else 0))
+
+    def run(self, partitions=None, **settings):
+        jobs = [FileJob(count, name, index, new_stats(name), size=count, partition=(partitions or {}).get(name, ""))
+                for index, (name, count) in enumerate(self.chunks.items())]
+        pipeline = IngestionPipeline(self.load, self.chunk, self.embed, self.build, self.upsert, self.finalize,
+                                     self.on_file_done, self.on_progress, **settings)
+        pipeline.run(jobs)
+        return pipeline, {stats['file_name']: stats for stats in self.done}
+
+
+def test_every_file_is_written_once_and_finalized():
+    chunks = {f"f{i}": i * 7 + 1 for i in range(12)}
+    recorder = Recorder(chunks)
+    pipeline, stats = recorder.run(partitions={name: str(i % 3) for i, name in enumerate(chunks)},
+                                   embed_batch_size=8, upsert_batch_size=5, queue_size=2)
+    assert sorted(recorder.upserted) == sorted(f"{name} {i}" for name, count in chunks.items() for i in range(count))
+    assert sorted(recorder.finalized) == sorted(chunks)
+    assert len(recorder.done) == len(chunks)
+    for name, count in chunks.items():
+        assert stats[name]['success']
+        assert stats[name]['vectors_upserted'] == count
+        assert stats[name]['vectors_unwritten'] == 0
+    assert pipeline.embedding_requests >= sum(chunks.values()) / 8
+
+
+def test_progress_reports_every_written_vector_then_each_state_once():
+    chunks = {"a": 23, "b": 4, "c": 11}
+    recorder = Recorder(chunks)
+    recorder.run(embed_batch_size=4, upsert_batch_size=3)
+    for name, count in chunks.items():
+        events = recorder.progress[name]
+        assert sum(vectors for state, vectors in events if state == "batch_upserted") == count
+        states = [state for state, _ in events if state != "batch_upserted"]
+        assert states == ["chunked", "embedded", "upserted"]
+        assert events[-1] == ("upserted", 0)
+
+
+def test_skipped_files_are_finalized_without_reaching_the_later_stages():
+    recorder = Recorder({"empty": 0, "full": 3})
+    _, stats = recorder.run()
+    assert sorted(recorder.finalized) == ["empty", "full"]
+    assert "empty" not in recorder.progress
+    assert stats["empty"]['vectors_upserted'] == 0
+
+
+def test_vectors_the_sink_did_not_write_keep_the_file_unfinished():
+    recorder = Recorder({"a": 6, "b": 2}, upsert_fn=lambda vectors, partition: 0)
+    _, stats = recorder.run(upsert_batch_size=4)
+    assert recorder.finalized == []
+    for name, count in {"a": 6, "b": 2}.items():
+        assert not stats[name]['success']
+        assert stats[name]['error'] is None
+        assert stats[name]['vectors_upserted'] == 0
+        assert stats[name]['vectors_unwritten'] == count
+        assert all(state != "batch_upserted" for state, _ in recorder.progress[name])
+
+
+def test_upsert_errors_fail_the_files_in_the_batch():
+    def upsert(vectors, partition):
+        raise RuntimeError("sink unavailable")
+
+    recorder = Recorder({"a": 3}, upsert_fn=upsert)
+    _, stats = recorder.run()
+    assert stats["a"]['error'] == "sink unavailable"
+    assert not stats["a"]['success']
+
+
+def test_files_finish_under_upsert_backpressure():
+    # A full upsert queue suspends the hand-off of one batch while other workers buffer and flush
+    # more vectors into the same partition; every file must still be written and finalized
+    def slow_upsert(vectors, partition):
+        time.sleep(0.001)
+
+    chunks = {f"f{i}": i % 7 + 1 for i in range(16)}
+    for _ in range(30):
+        recorder = Recorder(chunks, upsert_fn=slow_upsert)
+        _, stats = recorder.run(embed_batch_size=8, queue_size=1, upsert_batch_size=2)
+        assert sorted(recorder.finalized) == sorted(chunks)
+        assert len(recorder.upserted) == sum(chunks.values())
+        assert all(stats[name]['vectors_upserted'] == count for name, count in chunks.items())
@@ -0,0 +1,25 @@
+from near_duplicates import NearDuplicateIndex
+
+BOILERPLATE = " ".join(f"Our business is exposed to risk number {i} of many." for i in range(40))
+
+
+def test_finds_the_closest_near_duplicate(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "near_duplicates.sqlite3"))
+    index.add("original", index.signature(BOILERPLATE))
+    index.add("unrelated", index.signature("Revenue grew in every segment during the fiscal year."))
+    match = index.find(index.signature(BOILERPLATE + " Company name appended."))
+    assert match is not None and match[0] == "original" and match[1] >= index.threshold
+    assert index.find(index.signature("A sentence nobody has written before today.")) is None
+    index.close()
+
+
+def test_registered_chunks_match_before_and_after_they_are_committed(tmp_path):
+    path = str(tmp_path / "near_duplicates.sqlite3")
+    index = NearDuplicateIndex(path)
+    index.add("original", index.signature(BOILERPLATE))
+    assert index.find(index.signature(BOILERPLATE))[0] == "original"  # Not committed yet, same connection
+    index.close()
+
+    reopened = NearDuplicateIndex(path)
+    assert reopened.find(reopened.signature(BOILERPLATE))[0] == "original"
+    reopened.close()
@@ -0,0 +1,46 @@
+from run_journal import RunJournal
+
+CHUNK_PARAMS = {'unit': "tokens", 'size': 200, 'overlap': 20}
+
+
+def test_resume_returns_unfinished_files_in_order(tmp_path):
+    path = str(tmp_path / "journal.sqlite")
+    journal = RunJournal(path)
+    run_id = journal.start_run(["a", "b", "c", "d"], CHUNK_PARAMS)
+    journal.record_file(run_id, "a", "done", "hash-a")
+    journal.record_file(run_id, "b", "embedded", "hash-b")
+    journal.record_file(run_id, "c", "skipped")
+    journal.finish_run(run_id, "interrupted")
+    journal.close()
+
+    journal = RunJournal(path)
+    unfinished = journal.unfinished_run()
+    assert unfinished['id'] == run_id
+    assert unfinished['status'] == "interrupted"
+    assert unfinished['chunk_params'] == CHUNK_PARAMS
+    assert unfinished['file_states'] == {"a": "done", "b": "embedded", "c": "skipped"}
+    assert journal.resume_run(run_id) == ["b", "d"]
+    assert journal.unfinished_run()['status'] == "running"
+    journal.finish_run(run_id, "completed")
+    assert journal.unfinished_run() is None
+    journal.close()
+
+
+def test_written_batches_are_kept_until_their_file_is_done(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.sqlite"))
+    run_id = journal.start_run(["a", "b"], CHUNK_PARAMS)
+    journal.record_batch(run_id, "a", "hash-a", ["a-0", "a-1"])
+    journal.record_batch(run_id, "a", "hash-a", ["a-2"])
+    journal.record_batch(run_id, "b", "hash-b", ["b-0"])
+    journal.record_file(run_id, "b", "done", "hash-b")
+    journal.finish_run(run_id, "interrupted")
+
+    assert journal.written_vector_ids(CHUNK_PARAMS) == {("a", "hash-a"): {"a-0", "a-1", "a-2"}}
+    assert journal.written_vector_ids({**CHUNK_PARAMS, 'size': 100}) == {}  # Chunked differently: nothing to reuse
+
+    resumed = journal.start_run(journal.resume_run(run_id), CHUNK_PARAMS, keep_batches=True)
+    assert journal.unfinished_run()['id'] == resumed  # The interrupted run is superseded
+    assert journal.written_vector_ids(CHUNK_PARAMS) == {("a", "hash-a"): {"a-0", "a-1", "a-2"}}
+    journal.start_run(["a"], CHUNK_PARAMS)  # A fresh run discards them
+    assert journal.written_vector_ids(CHUNK_PARAMS) == {}
+    journal.close()
@@ -0,0 +1,32 @@
+from token_batcher import TokenBatcher
+
+
+def test_packs_up_to_the_token_budget():
+    batcher = TokenBatcher(token_budget=100, max_items=10)
+    assert batcher.add("a", 60) is None
+    assert batcher.add("b", 40) is None  # Exactly at the budget still fits
+    assert batcher.add("c", 1) == ["a", "b"]
+    assert batcher.flush() == ["c"]
+    assert batcher.flush() is None
+
+
+def test_closes_batches_at_the_item_limit():
+    batcher = TokenBatcher(token_budget=1_000, max_items=3)
+    completed = [batch for batch in (batcher.add(i, 1) for i in range(7)) if batch]
+    assert completed == [[0, 1, 2], [3, 4, 5]]
+    assert batcher.flush() == [6]
+
+
+def test_an_entry_over_the_budget_gets_a_batch_of_its_own():
+    batcher = TokenBatcher(token_budget=100, max_items=10)
+    batcher.add("small", 10)
+    assert batcher.add("huge", 500) == ["small"]
+    assert batcher.add("next", 10) == ["huge"]
+    assert len(batcher) == 1
+
+
+def test_budget_changes_apply_to_the_open_batch():
+    batcher = TokenBatcher(token_budget=100, max_items=10)
+    batcher.add("a", 30)
+    batcher.token_budget = 50  # As the autotuner does mid-run
+    assert batcher.add("b", 30) == ["a"]
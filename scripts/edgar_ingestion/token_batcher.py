@@ -0,0 +1,82 @@
+"""
+Token counting and token-budget batch packing for embedding requests.
+
+Chunks vary a lot in token length (prose vs. numeric tables), so batching by
+chunk count gives tiny requests for some filings and oversized ones for others.
+`TokenBatcher` instead packs chunks, across sections and files, up to a
+per-request token budget.
+
+Tokens are counted locally with tiktoken when it is installed and its encoding
+is available; otherwise a ~4 characters/token estimate is used.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# text-embedding-3-* models reject any single input longer than this
+MAX_INPUT_TOKENS = 8191
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding(model: str):
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            try:
+                _encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # Missing package or no network to fetch the encoding file
+            logger.warning(f"tiktoken unavailable ({e}); falling back to character-based token estimates")
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str, model: str = "text-embedding-3-small") -> int:
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode_ordinary(text))
+
+
+class TokenBatcher:
+    """
+    Packs entries into batches bounded by a token budget and an item count.
+    Not thread-safe; the pipeline drives it from its event loop.
+    """
+
+    def __init__(self, token_budget: int, max_items: int):
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self._entries = []
+        self._tokens = 0
+
+    def add(self, entry, tokens: int) -> list | None:
+        """
+        Add an entry. Returns the batch that was completed to make room for it,
+        or None while the current batch still has room.
+        """
+        completed = None
+        if self._entries and (self._tokens + tokens > self.token_budget or len(self._entries) >= self.max_items):
+            completed = self.flush()
+        self._entries.append(entry)
+        self._tokens += tokens
+        return completed
+
+    def flush(self) -> list | None:
+        """Return the partial batch (if any) and start a new one."""
+        if not self._entries:
+            return None
+        batch = self._entries
+        self._entries = []
+        self._tokens = 0
+        return batch
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,61 @@
+"""
+Destinations the ingestion pipeline writes vectors to.
+
+The pipeline only needs to upsert batches of Pinecone-style vector dicts
+({"id", "values", "metadata"}) and delete stale IDs, each within a namespace
+("" is the default one; see partitions.py), so anything implementing
+`VectorSink` can stand in for Pinecone. `PineconeSink` wraps a Pinecone index;
+`local_vector_store.LocalVectorStore` keeps everything on local disk for
+offline runs, benchmarks and development.
+"""
+
+from abc import ABC, abstractmethod
+
+
+class VectorSink(ABC):
+    """
+    Interface for vector destinations. Upserts and deletes are called from
+    several pipeline threads at once, so implementations must be thread-safe.
+    A sink missing any abstract method fails when it is constructed, not
+    halfway through a run.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: list[dict], namespace: str = ""):
+        ...
+
+    @abstractmethod
+    def delete(self, vector_ids: list[str], namespace: str = ""):
+        ...
+
+    @abstractmethod
+    def delete_namespace(self, namespace: str):
+        """Delete every vector in a namespace, e.g. one a partition rebuild replaced."""
+
+    def flush(self):
+        """Make everything written so far durable. Called before the manifest records a filing."""
+
+    def close(self):
+        self.flush()
+
+
+class PineconeSink(VectorSink):
+    """
+    Writes to a Pinecone index. No lock - Pinecone handles concurrent upserts well.
+    Vector values may be float32 NumPy rows: the client unboxes them in C, and
+    over gRPC they travel as packed floats rather than JSON text.
+    """
+
+    def __init__(self, index, batch_size: int = 100):
+        self.index = index
+        self.batch_size = batch_size
+
+    def upsert(self, vectors: list[dict], namespace: str = ""):
+        self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def delete(self, vector_ids: list[str], namespace: str = ""):
+        for i in range(0, len(vector_ids), self.batch_size):
+            self.index.delete(ids=vector_ids[i:i+self.batch_size], namespace=namespace)
+
+    def delete_namespace(self, namespace: str):
+        self.index.delete(delete_all=True, namespace=namespace)
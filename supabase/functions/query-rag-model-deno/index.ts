@@ -12,7 +12,8 @@ const corsHeaders = {
 };
 
 interface PineconeMetadata {
-  text: string; // This is what's actually stored in Pinecone
+  text?: string; // Full chunk text (default ingestion layout)
+  text_preview?: string; // Short preview when full text lives in the chunk text store
   company: string;
   cik: string;
   form: string; // This is what's actually stored (not filing_type)
@@ -29,6 +30,150 @@ interface Source {
   filingType: string;
 }
 
+interface PineconeMatch {
+  id: string;
+  score: number;
+  metadata: PineconeMetadata;
+}
+
+// Optional request filters; they select partitions and are applied to the matches
+interface QueryFilters {
+  forms?: string[];
+  years?: number[];
+  ciks?: (string | number)[];
+}
+
+// One entry of the partition manifest written by ingestion (partitions.json)
+interface Partition {
+  name: string;
+  namespace: string;
+  vectors: number;
+  forms: string[];
+  years: [number, number] | null;
+  ciks: [number, number] | null;
+}
+
+const TOP_K = 20;
+const PARTITION_MANIFEST_TTL_MS = 60_000;
+let partitionManifestCache: { partitions: Partition[]; loadedAt: number } | null = null;
+
+/**
+ * Loads the partition manifest from PARTITION_MANIFEST_URL (cached for a
+ * minute). Returns null when none is configured or it cannot be read, in
+ * which case the index is queried as one default namespace.
+ */
+const loadPartitions = async (): Promise<Partition[] | null> => {
+  const manifestUrl = Deno.env.get('PARTITION_MANIFEST_URL');
+  if (!manifestUrl) {
+    return null;
+  }
+  if (partitionManifestCache && Date.now() - partitionManifestCache.loadedAt < PARTITION_MANIFEST_TTL_MS) {
+    return partitionManifestCache.partitions;
+  }
+  try {
+    const response = await fetch(manifestUrl);
+    if (!response.ok) {
+      console.error('Failed to load partition manifest:', await response.text());
+      return partitionManifestCache?.partitions ?? null;
+    }
+    const manifest = await response.json();
+    partitionManifestCache = { partitions: manifest.partitions || [], loadedAt: Date.now() };
+    return partitionManifestCache.partitions;
+  } catch (error) {
+    console.error('Partition manifest unavailable:', error);
+    return partitionManifestCache?.partitions ?? null;
+  }
+};
+
+/** Partitions that can hold a match for the filters: only those are searched. */
+const selectPartitions = (partitions: Partition[], filters: QueryFilters): Partition[] =>
+  partitions.filter(partition => {
+    if (partition.vectors === 0) {
+      return false;
+    }
+    if (filters.forms?.length && !filters.forms.some(form => partition.forms.includes(form))) {
+      return false;
+    }
+    const years = partition.years;
+    if (filters.years?.length && years && !filters.years.some(year => year >= years[0] && year <= years[1])) {
+      return false;
+    }
+    const ciks = partition.ciks;
+    if (
+      filters.ciks?.length &&
+      ciks &&
+      !filters.ciks.some(cik => Number(cik) >= ciks[0] && Number(cik) <= ciks[1])
+    ) {
+      return false;
+    }
+    return true;
+  });
+
+/** Pinecone metadata filter for the form and CIK filters; years are matched on filing_date afterwards. */
+const metadataFilter = (filters: QueryFilters): Record<string, unknown> | undefined => {
+  const clauses: Record<string, unknown>[] = [];
+  if (filters.forms?.length) {
+    clauses.push({ form: { $in: filters.forms } });
+  }
+  if (filters.ciks?.length) {
+    clauses.push({ cik: { $in: filters.ciks.map(cik => String(Number(cik))) } });
+  }
+  if (clauses.length === 0) {
+    return undefined;
+  }
+  return clauses.length === 1 ? clauses[0] : { $and: clauses };
+};
+
+/**
+ * Fills in full chunk text for matches ingested with the external chunk text
+ * store enabled (their metadata only holds `text_preview`). Texts are fetched
+ * from the store's HTTP endpoint (`ingestion_e2e.py serve-chunk-texts`) when
+ * CHUNK_TEXT_STORE_URL is configured; otherwise the preview is used.
+ */
+const resolveChunkTexts = async (matches: PineconeMatch[]): Promise<Map<string, string>> => {
+  const texts = new Map<string, string>();
+  const missing: string[] = [];
+  for (const match of matches) {
+    if (match.metadata?.text) {
+      texts.set(match.id, match.metadata.text);
+    } else {
+      missing.push(match.id);
+    }
+  }
+
+  const storeUrl = Deno.env.get('CHUNK_TEXT_STORE_URL');
+  if (missing.length > 0 && storeUrl) {
+    try {
+      const storeApiKey = Deno.env.get('CHUNK_TEXT_STORE_API_KEY');
+      const response = await fetch(`${storeUrl}/chunks`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          ...(storeApiKey ? { Authorization: `Bearer ${storeApiKey}` } : {}),
+        },
+        body: JSON.stringify({ ids: missing }),
+      });
+      if (response.ok) {
+        const { texts: storedTexts } = await response.json();
+        for (const [id, text] of Object.entries(storedTexts as Record<string, string>)) {
+          texts.set(id, text);
+        }
+      } else {
+        console.error('Failed to fetch chunk texts:', await response.text());
+      }
+    } catch (error) {
+      console.error('Chunk text store unavailable:', error);
+    }
+  }
+
+  for (const match of matches) {
+    if (!texts.has(match.id) && match.metadata?.text_preview) {
+      texts.set(match.id, match.metadata.text_preview);
+    }
+  }
+  return texts;
+};
+
 serve(async req => {
   if (req.method === 'OPTIONS') {
     return new Response('ok', { headers: corsHeaders });
@@ -60,7 +205,8 @@ serve(async req => {
       });
     }
 
-    const { prompt, conversationId } = await req.json();
+    const { prompt, conversationId, filters } = await req.json();
+    const queryFilters: QueryFilters = filters || {};
 
     if (!prompt) {
       return new Response(JSON.stringify({ error: 'Prompt is required' }), {
@@ -78,6 +224,7 @@ serve(async req => {
       });
     }
 
+    const embeddingDimensions = Number(Deno.env.get('EMBEDDING_DIMENSIONS')) || undefined;
     const embeddingResponse = await fetch('https://api.openai.com/v1/embeddings', {
       method: 'POST',
       headers: {
@@ -87,6 +234,8 @@ serve(async req => {
       body: JSON.stringify({
         model: 'text-embedding-3-small',
         input: prompt,
+        // Must match the EMBEDDING_DIMENSIONS the index was ingested with
+        ...(embeddingDimensions ? { dimensions: embeddingDimensions } : {}),
       }),
     });
 
@@ -114,9 +263,15 @@ serve(async req => {
       });
     }
 
-    const pineconeResponse = await fetch(
-      `https://${pineconeIndexName}-${pineconeEnvironment}.pinecone.io/query`,
-      {
+    // With a partition manifest, only the partitions the filters can match are
+    // searched - in parallel, one namespace each - and the results merged by score
+    const partitions = await loadPartitions();
+    const namespaces = partitions
+      ? selectPartitions(partitions, queryFilters).map(partition => partition.namespace)
+      : [''];
+    const pineconeFilter = metadataFilter(queryFilters);
+    const queryNamespace = async (namespace: string): Promise<PineconeMatch[]> => {
+      const response = await fetch(`https://${pineconeIndexName}-${pineconeEnvironment}.pinecone.io/query`, {
         method: 'POST',
         headers: {
           'Api-Key': pineconeApiKey,
@@ -124,29 +279,42 @@ serve(async req => {
         },
         body: JSON.stringify({
           vector: queryVector,
-          topK: 20,
+          topK: TOP_K,
+          namespace,
           includeMetadata: true,
           includeValues: false,
+          ...(pineconeFilter ? { filter: pineconeFilter } : {}),
         }),
-      },
-    );
+      });
+      if (!response.ok) {
+        throw new Error(`namespace "${namespace}": ${await response.text()}`);
+      }
+      return (await response.json()).matches || [];
+    };
 
-    if (!pineconeResponse.ok) {
-      const errorBody = await pineconeResponse.text();
-      console.error('Failed to query Pinecone:', errorBody);
+    let partitionMatches: PineconeMatch[][];
+    try {
+      partitionMatches = await Promise.all(namespaces.map(queryNamespace));
+    } catch (error) {
+      console.error('Failed to query Pinecone:', error);
       return new Response(JSON.stringify({ error: 'Failed to query Pinecone' }), {
         headers: { ...corsHeaders, 'Content-Type': 'application/json' },
         status: 500,
       });
     }
 
-    const pineconeData = await pineconeResponse.json();
-    const relevantDocs: { metadata: PineconeMetadata }[] = pineconeData.matches || [];
+    const years = queryFilters.years;
+    const relevantDocs: PineconeMatch[] = partitionMatches
+      .flat()
+      .filter(match => !years?.length || years.includes(Number(match.metadata?.filing_date?.slice(0, 4))))
+      .sort((a, b) => b.score - a.score)
+      .slice(0, TOP_K);
+    const chunkTexts = await resolveChunkTexts(relevantDocs);
 
     const context = relevantDocs
       .map(match => {
         const metadata = match.metadata;
-        const text = metadata?.text || '';
+        const text = chunkTexts.get(match.id) || '';
         const company = metadata?.company || 'Unknown Company';
 
         if (text.length > 0) {